@@ -1,6 +1,8 @@
 from septentrion import metadata as _metadata_module
 from septentrion.lib import (
+    Migrator,
     build_migration_plan,
+    clone,
     fake,
     get_known_versions,
     is_schema_initialized,
@@ -10,7 +12,9 @@ from septentrion.lib import (
 )
 
 __all__ = [
+    "Migrator",
     "build_migration_plan",
+    "clone",
     "fake",
     "get_known_versions",
     "is_schema_initialized",
@@ -0,0 +1,478 @@
+"""
+asyncio counterparts of the functions of septentrion.lib, to migrate many
+databases from a single event loop:
+
+    async def migrate_all(names):
+        await asyncio.gather(
+            *(septentrion.aio.migrate(dbname=name, quiet=True) for name in names)
+        )
+
+The migrations table is read and written with asyncpg (install
+septentrion[asyncpg]), and the migrations are run by psql, in asyncio
+subprocesses. Discovering and reading the migration files is synchronous: it's
+done in the default executor of the loop, so that the loop isn't blocked (see
+also the discovery_workers setting). Functions of septentrion.lib that don't
+use the database (e.g. get_known_versions) have no counterpart.
+
+Initializing an empty database (loading its schema and fixtures, or restoring
+a snapshot) is left to septentrion.migration.migrate, in a thread: it happens
+once in the life of a database.
+"""
+import asyncio
+import collections
+import contextlib
+import datetime
+import functools
+import itertools
+import logging
+import os
+import pathlib
+import re
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    TypeVar,
+)
+
+from septentrion import (
+    configuration,
+    core,
+    db,
+    exceptions,
+    files,
+    migration,
+    runner,
+    style,
+    utils,
+    versions,
+)
+
+logger = logging.getLogger(__name__)
+
+# Settings of septentrion.db.get_connection, and their name for asyncpg
+CONNECTION_SETTINGS = {
+    "HOST": "host",
+    "PORT": "port",
+    "DBNAME": "database",
+    "USERNAME": "user",
+    "PASSWORD": "password",
+}
+# SQLSTATE of the error raised when a table doesn't exist
+UNDEFINED_TABLE = "42P01"
+
+T = TypeVar("T")
+
+
+def _import_asyncpg() -> Any:
+    try:
+        import asyncpg
+    except ImportError:
+        raise exceptions.SeptentrionException(
+            "The asyncpg package is required by septentrion.aio "
+            "(install septentrion[asyncpg])"
+        )
+    return asyncpg
+
+
+async def _run_in_executor(function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run blocking code (reading files, decompressing them...) in the default
+    executor of the running loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(function, *args, **kwargs)
+    )
+
+
+@contextlib.asynccontextmanager
+async def connect(settings: configuration.Settings) -> AsyncIterator[Any]:
+    """
+    Open an asyncpg connection. Like psycopg2, asyncpg falls back to the libpq
+    environment variables (PGHOST, PGUSER...) for missing settings.
+    """
+    asyncpg = _import_asyncpg()
+    kwargs: Dict[str, Any] = {}
+    for name, asyncpg_name in CONNECTION_SETTINGS.items():
+        value = getattr(settings, name)
+        if value:
+            kwargs[asyncpg_name] = value
+    if "port" in kwargs:
+        kwargs["port"] = int(kwargs["port"])
+    if settings.SESSION_OPTIONS:
+        kwargs["server_settings"] = dict(settings.SESSION_OPTIONS)
+
+    connection = await asyncpg.connect(**kwargs)
+    try:
+        yield connection
+    finally:
+        await connection.close()
+
+
+def _quote_identifier(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def format_query(settings: configuration.Settings, query: str) -> str:
+    """
+    Turn a query of septentrion.db into an asyncpg query: identifiers are
+    filled in, and %s placeholders become $1, $2...
+    >>> format_query(configuration.Settings(), "SELECT %s FROM {table}")
+    'SELECT $1 FROM "septentrion_migrations"'
+    """
+    query = query.format(
+        table=_quote_identifier(settings.TABLE),
+        version_column=_quote_identifier(settings.VERSION_COLUMN),
+        name_column=_quote_identifier(settings.NAME_COLUMN),
+        applied_at_column=_quote_identifier(settings.APPLIED_AT_COLUMN),
+    )
+    numbers = itertools.count(1)
+    return re.sub("%s", lambda _: f"${next(numbers)}", query)
+
+
+async def create_table(connection: Any, settings: configuration.Settings) -> None:
+    await connection.execute(format_query(settings, db.query_create_table))
+
+
+async def _is_schema_initialized(
+    connection: Any, settings: configuration.Settings
+) -> bool:
+    try:
+        row = await connection.fetchrow(
+            format_query(settings, db.query_is_schema_initialized)
+        )
+    except Exception as exc:
+        # asyncpg.exceptions.UndefinedTableError
+        if getattr(exc, "sqlstate", None) != UNDEFINED_TABLE:
+            raise
+        return False
+    return row is not None
+
+
+async def get_current_schema_version(
+    connection: Any, settings: configuration.Settings
+) -> versions.Version:
+    rows = await connection.fetch(format_query(settings, db.query_max_version))
+    if not rows:
+        raise exceptions.SeptentrionException("The migrations table is empty")
+    return max(versions.Version.from_string(row[0]) for row in rows)
+
+
+async def get_applied_migrations_by_version(
+    connection: Any,
+    settings: configuration.Settings,
+    versions_: Iterable[versions.Version],
+) -> Dict[versions.Version, Set[str]]:
+    """
+    See db.get_applied_migrations_by_version.
+    """
+    by_string = {version.original_string: version for version in versions_}
+    applied: Dict[versions.Version, Set[str]] = {
+        version: set() for version in by_string.values()
+    }
+    if not by_string:
+        return applied
+
+    rows = await connection.fetch(
+        format_query(settings, db.query_get_applied_migrations_by_version),
+        list(by_string),
+    )
+    for version_string, name in rows:
+        applied[by_string[version_string]].add(name)
+    return applied
+
+
+async def write_migration(
+    connection: Any,
+    settings: configuration.Settings,
+    version: versions.Version,
+    name: str,
+) -> None:
+    await connection.execute(
+        format_query(settings, db.query_write_migration),
+        version.original_string,
+        name,
+        datetime.datetime.utcnow(),
+    )
+
+
+async def _read_lines(stream: Any, callback: Callable[[str], None]) -> None:
+    # Lines are split here rather than by StreamReader.readline, which fails on
+    # lines longer than its buffer.
+    pending = b""
+    while True:
+        chunk = await stream.read(runner.CHUNK_SIZE)
+        if not chunk:
+            break
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            callback((line + b"\n").decode("utf-8", errors="replace"))
+    if pending:
+        callback(pending.decode("utf-8", errors="replace"))
+
+
+class Script(runner.Script):
+    """
+    A runner.Script run by an asyncio subprocess (see run_async).
+    """
+
+    async def run_async(self) -> None:
+        with contextlib.ExitStack() as stack:
+            # Scripts with --meta-psql directives are run until all the write
+            # operations return 0 rows
+            while (await self._run_simple_async()).rows_remaining and (
+                await _run_in_executor(self._has_meta_directives)
+            ):
+                await _run_in_executor(self._reopen, stack)
+
+    async def _run_simple_async(self) -> runner.Output:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "psql",
+                "--set",
+                "ON_ERROR_STOP=on",
+                "-f",
+                "-",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                # environment has precedence over os.environ
+                env={**os.environ, **self._env()},
+            )
+        except FileNotFoundError:
+            raise RuntimeError(
+                "Septentrion requires the 'psql' executable to be present in "
+                "the PATH."
+            )
+
+        errors: Deque[str] = collections.deque(maxlen=runner.ERROR_TAIL_SIZE)
+        output = runner.Output()
+        await asyncio.gather(
+            self._write_input_async(process.stdin),
+            _read_lines(process.stdout, functools.partial(self._process_line, output)),
+            _read_lines(process.stderr, errors.append),
+        )
+        returncode = await process.wait()
+
+        if returncode:
+            raise runner.SQLRunnerException(
+                "Error during migration: {}".format("".join(errors))
+            )
+        return output
+
+    async def _write_input_async(self, stdin: Any) -> None:
+        try:
+            with memoryview(self.content) as view:
+                for start in range(0, len(view), runner.CHUNK_SIZE):
+                    end = start + runner.CHUNK_SIZE
+                    stdin.write(bytes(view[start:end]))
+                    await stdin.drain()
+            while self.stream is not None:
+                chunk = await _run_in_executor(self.stream.read, runner.CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._scan(chunk)
+                stdin.write(chunk)
+                await stdin.drain()
+            stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            # psql stopped reading (probably because of an error), we'll know
+            # why from its error output.
+            pass
+
+
+async def run_script(
+    settings: configuration.Settings,
+    path: pathlib.Path,
+    progress: Optional[Callable[[str], None]] = None,
+) -> None:
+    logger.info("Running SQL file %s", path)
+    with contextlib.ExitStack() as stack:
+        content = await _run_in_executor(
+            stack.enter_context, files.open_migration(path)
+        )
+        script = Script(
+            settings=settings, file_handler=content, path=path, progress=progress
+        )
+        await script.run_async()
+
+
+async def get_migration_plan(
+    connection: Any,
+    settings: configuration.Settings,
+    from_version: versions.Version,
+) -> List[Dict[str, Any]]:
+    """
+    Like core.build_migration_plan, querying the applied migrations with
+    asyncpg.
+    """
+    versions_to_apply = await _run_in_executor(
+        core.get_versions_to_apply, settings=settings, from_version=from_version
+    )
+    applied_by_version = await get_applied_migrations_by_version(
+        connection=connection, settings=settings, versions_=versions_to_apply
+    )
+    return await _run_in_executor(
+        _build_migration_plan,
+        settings=settings,
+        from_version=from_version,
+        applied_by_version=applied_by_version,
+    )
+
+
+def _build_migration_plan(
+    settings: configuration.Settings,
+    from_version: versions.Version,
+    applied_by_version: Dict[versions.Version, Set[str]],
+) -> List[Dict[str, Any]]:
+    # Reads the headers of the migration files
+    return [
+        version_plan.as_dict(workers=settings.DISCOVERY_WORKERS)
+        for version_plan in core.iter_migration_plan(
+            settings=settings,
+            from_version=from_version,
+            applied_by_version=applied_by_version,
+        )
+    ]
+
+
+async def apply_migration_plan(
+    connection: Any,
+    settings: configuration.Settings,
+    migration_plan: Iterable[Dict[str, Any]],
+    stylist: style.Stylist = style.noop_stylist,
+) -> None:
+    """
+    See migration.apply_migration_plan.
+    """
+    with stylist.activate("title") as echo:
+        echo("Applying migrations")
+
+    for plan in migration_plan:
+        version = plan["version"]
+        logger.info("Processing version %s", version)
+        with stylist.activate("subtitle") as echo:
+            echo("Version {}".format(version))
+        for name, applied, path, is_manual in plan["plan"]:
+            if applied:
+                stylist.draw_checkbox(checked=True, content="Already applied")
+                stylist.echo("")  # new line
+                continue
+            title = name + (" (manual)" if is_manual else "") + " "
+            with stylist.checkbox(
+                content="Applying {}...".format(title),
+                content_after="Applied {}".format(title),
+            ) as progress:
+                await run_script(settings=settings, path=path, progress=progress)
+                logger.info("Saving operation in the database")
+                await write_migration(
+                    connection=connection, settings=settings, version=version, name=name
+                )
+
+
+def initialize(settings_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Like lib.initialize, without creating the migrations table: that's done
+    with asyncpg.
+    """
+    quiet = settings_kwargs.pop("quiet", False)
+    return {
+        "settings": configuration.Settings(**settings_kwargs),
+        "stylist": style.noop_stylist if quiet else style.stylist,
+    }
+
+
+@contextlib.asynccontextmanager
+async def _connect_and_create_table(
+    settings: configuration.Settings,
+) -> AsyncIterator[Any]:
+    async with connect(settings=settings) as connection:
+        if settings.CREATE_TABLE:
+            logger.info("Ensuring migration table exists")
+            await create_table(connection=connection, settings=settings)
+        yield connection
+
+
+async def migrate(**settings_kwargs: Any) -> None:
+    lib_kwargs = initialize(settings_kwargs)
+    settings, stylist = lib_kwargs["settings"], lib_kwargs["stylist"]
+
+    async with _connect_and_create_table(settings=settings) as connection:
+        if not await _is_schema_initialized(connection=connection, settings=settings):
+            logger.info("Migration table is empty, initializing the database")
+            await _run_in_executor(
+                migration.migrate, settings=settings, stylist=stylist
+            )
+            return
+
+        from_version = await get_current_schema_version(
+            connection=connection, settings=settings
+        )
+        migration_plan = await get_migration_plan(
+            connection=connection, settings=settings, from_version=from_version
+        )
+        await apply_migration_plan(
+            connection=connection,
+            settings=settings,
+            migration_plan=migration_plan,
+            stylist=stylist,
+        )
+
+
+async def is_schema_initialized(**settings_kwargs: Any) -> bool:
+    lib_kwargs = initialize(settings_kwargs)
+    settings = lib_kwargs["settings"]
+    async with _connect_and_create_table(settings=settings) as connection:
+        return await _is_schema_initialized(connection=connection, settings=settings)
+
+
+async def build_migration_plan(**settings_kwargs: Any) -> List[Dict[str, Any]]:
+    """
+    See lib.build_migration_plan.
+    """
+    lib_kwargs = initialize(settings_kwargs)
+    settings = lib_kwargs["settings"]
+    schema_version = await _run_in_executor(
+        core.get_best_schema_version, settings=settings
+    )
+    async with _connect_and_create_table(settings=settings) as connection:
+        return await get_migration_plan(
+            connection=connection, settings=settings, from_version=schema_version
+        )
+
+
+async def fake(version: str, **settings_kwargs: Any) -> None:
+    """
+    See lib.fake.
+    """
+    lib_kwargs = initialize(settings_kwargs)
+    settings, stylist = lib_kwargs["settings"], lib_kwargs["stylist"]
+    fake_version = versions.Version.from_string(version)
+    known_versions = await _run_in_executor(files.get_known_versions, settings=settings)
+
+    with stylist.activate("title") as echo:
+        echo("Faking migrations.")
+    async with _connect_and_create_table(settings=settings) as connection:
+        for version_ in utils.until(known_versions, fake_version):
+            migrations = await _run_in_executor(
+                files.get_migrations_files_mapping, settings=settings, version=version_
+            )
+            for name in sorted(migrations):
+                logger.info("Faking %s", name)
+                with stylist.checkbox(
+                    content="Faking {}...".format(name),
+                    content_after="Faked {}".format(name),
+                ):
+                    await write_migration(
+                        connection=connection,
+                        settings=settings,
+                        version=version_,
+                        name=name,
+                    )
@@ -0,0 +1,282 @@
+"""
+Read migrations from a single zip archive (see the "pack" command), or from the
+resources of an installed python package (possibly zipped). The central
+directory of the zip file acts as an index: discovery doesn't need to touch the
+filesystem beyond reading it once.
+"""
+import contextlib
+import datetime
+import functools
+import os
+import pathlib
+import zipfile
+from typing import (
+    IO,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Set,
+    Tuple,
+    Union,
+)
+
+from septentrion import exceptions, utils
+
+# Folders of the migrations root that are not versions, but still read
+SPECIAL_FOLDERS = ["schemas", "fixtures"]
+
+# Migrations roots can be given as "package:<module>/<path>"
+PACKAGE_PREFIX = "package:"
+
+# Migrations roots that come from installed packages: they won't change during
+# the life of the process, so what we discover in them can be cached.
+_package_roots: Set[pathlib.Path] = set()
+# Migrations roots that are considered as not changing for a while (see
+# files.frozen_root)
+_frozen_roots: Set[pathlib.Path] = set()
+
+
+class ArchiveStat(NamedTuple):
+    st_mtime_ns: int
+    st_size: int
+
+
+class Archive:
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        try:
+            self.zipfile = zipfile.ZipFile(path)
+        except (OSError, zipfile.BadZipFile) as exc:
+            raise exceptions.SeptentrionException(
+                f"Cannot read migrations archive {path}: {exc}"
+            ) from exc
+
+        self.files: Dict[pathlib.PurePosixPath, zipfile.ZipInfo] = {}
+        self.folders: Dict[pathlib.PurePosixPath, Set[str]] = {
+            pathlib.PurePosixPath(): set()
+        }
+        for info in self.zipfile.infolist():
+            member = pathlib.PurePosixPath(info.filename)
+            if info.is_dir():
+                self.folders.setdefault(member, set())
+            else:
+                self.files[member] = info
+            # Register the member and all its parents in their own parent folder
+            child = member
+            for parent in member.parents:
+                self.folders.setdefault(parent, set()).add(child.name)
+                child = parent
+
+    def __repr__(self):
+        return f"Archive({str(self.path)!r})"
+
+
+@functools.lru_cache(maxsize=None)
+def open_archive(path: pathlib.Path) -> Archive:
+    """
+    Archives are opened (and their index read) once per process.
+    """
+    return Archive(path)
+
+
+class ArchivePath:
+    """
+    Path of a file or folder inside an archive. Implements the (small) part of
+    the pathlib.Path API that septentrion uses.
+    """
+
+    def __init__(
+        self, archive: Archive, member: Union[str, pathlib.PurePosixPath] = ""
+    ):
+        self.archive = archive
+        self.member = pathlib.PurePosixPath(member)
+
+    def __truediv__(self, other: str) -> "ArchivePath":
+        return ArchivePath(self.archive, self.member / other)
+
+    def __eq__(self, other):
+        if not isinstance(other, ArchivePath):
+            return NotImplemented
+        return (self.archive, self.member) == (other.archive, other.member)
+
+    def __lt__(self, other: "ArchivePath") -> bool:
+        return self.member < other.member
+
+    def __hash__(self):
+        return hash((self.archive, self.member))
+
+    def __str__(self):
+        return f"{self.archive.path}:{self.member}"
+
+    def __repr__(self):
+        return f"ArchivePath({str(self)!r})"
+
+    @property
+    def name(self) -> str:
+        return self.member.name
+
+    @property
+    def suffix(self) -> str:
+        return self.member.suffix
+
+    @property
+    def suffixes(self) -> List[str]:
+        return self.member.suffixes
+
+    @property
+    def stem(self) -> str:
+        return self.member.stem
+
+    @property
+    def parts(self) -> Tuple[str, ...]:
+        return self.member.parts
+
+    def relative_to(self, other: "ArchivePath") -> pathlib.PurePosixPath:
+        return self.member.relative_to(other.member)
+
+    def exists(self) -> bool:
+        return self.is_file() or self.is_dir()
+
+    def is_dir(self) -> bool:
+        return self.member in self.archive.folders
+
+    def is_file(self) -> bool:
+        return self.member in self.archive.files
+
+    def is_symlink(self) -> bool:
+        return False
+
+    def iterdir(self) -> Iterable["ArchivePath"]:
+        try:
+            children = self.archive.folders[self.member]
+        except KeyError:
+            raise FileNotFoundError(str(self))
+        return (self / name for name in sorted(children))
+
+    def stat(self) -> ArchiveStat:
+        try:
+            info = self.archive.files[self.member]
+        except KeyError:
+            raise FileNotFoundError(str(self))
+        mtime = datetime.datetime(*info.date_time).timestamp()
+        return ArchiveStat(st_mtime_ns=int(mtime * 1e9), st_size=info.file_size)
+
+    def open(self, mode: str = "rb") -> IO[bytes]:
+        if mode != "rb":
+            raise ValueError("Archive members can only be opened in 'rb' mode")
+        try:
+            info = self.archive.files[self.member]
+        except KeyError:
+            raise FileNotFoundError(str(self))
+        return self.archive.zipfile.open(info)
+
+
+def is_archive(path: pathlib.Path) -> bool:
+    return path.is_file() and zipfile.is_zipfile(path)
+
+
+def is_immutable(root: Union[pathlib.Path, ArchivePath]) -> bool:
+    """
+    Whether the migrations root can be considered as not changing while the
+    process runs.
+    """
+    return (
+        isinstance(root, ArchivePath) or root in _package_roots or root in _frozen_roots
+    )
+
+
+@contextlib.contextmanager
+def frozen(root: pathlib.Path) -> Iterator[None]:
+    """
+    Consider the migrations root as immutable inside the block.
+    """
+    _frozen_roots.add(root)
+    try:
+        yield
+    finally:
+        _frozen_roots.discard(root)
+
+
+def _resource_files(module: str) -> Any:
+    try:
+        from importlib.resources import files
+    except ImportError:  # Python < 3.9
+        from importlib_resources import files  # type: ignore
+
+    return files(module)
+
+
+def get_package_root(spec: str) -> Union[pathlib.Path, ArchivePath]:
+    """
+    Return the migrations root for "package:<module>/<path>": the folder <path>
+    in the resources of the python package <module>, even when the package is
+    installed as a zip (zipped wheel, zipapp, ...).
+    """
+    module, _, subpath = spec.partition(":")[2].partition("/")
+    try:
+        resources = _resource_files(module)
+    except (ImportError, TypeError) as exc:
+        raise exceptions.SeptentrionException(
+            f"Cannot find migrations in package {module!r}: {exc}"
+        ) from exc
+
+    if isinstance(resources, pathlib.Path):
+        root = resources / subpath
+        _package_roots.add(root)
+        return root
+
+    try:
+        # The package is in a zip: resources is a zipfile.Path
+        archive_path, member = resources.root.filename, resources.at
+    except AttributeError:
+        raise exceptions.SeptentrionException(
+            f"Cannot read migrations from package {module!r}: "
+            f"unsupported resources type {type(resources).__name__}"
+        )
+    return ArchivePath(open_archive(pathlib.Path(archive_path)), member) / subpath
+
+
+def iter_packable_files(
+    root: pathlib.Path, ignore_symlinks: bool = False
+) -> Iterable[pathlib.Path]:
+    """
+    Yield the files of the migration root that septentrion reads: the content
+    of version folders and of special folders, in a deterministic order.
+    With ignore_symlinks, symbolic links to files are left out, as they are
+    when discovering migrations (see the ignore_symlinks setting).
+    """
+    for folder in sorted(root.iterdir()):
+        if not folder.is_dir():
+            continue
+        if folder.name not in SPECIAL_FOLDERS and not utils.is_version(folder.name):
+            continue
+        for dirpath, dirnames, filenames in os.walk(folder):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = pathlib.Path(dirpath) / filename
+                if ignore_symlinks and path.is_symlink():
+                    continue
+                yield path
+
+
+def pack(
+    root: pathlib.Path,
+    output: pathlib.Path,
+    compression: int = zipfile.ZIP_STORED,
+    ignore_symlinks: bool = False,
+) -> int:
+    """
+    Write all the migration files of root in a zip archive that can be used
+    as a migrations root. Return the number of packed files.
+    By default, files are stored uncompressed so they can be streamed out of
+    the archive for free (SQL files can be compressed individually).
+    """
+    count = 0
+    with zipfile.ZipFile(output, "w", compression=compression) as archive:
+        for path in iter_packable_files(root, ignore_symlinks=ignore_symlinks):
+            archive.write(path, arcname=path.relative_to(root).as_posix())
+            count += 1
+    return count
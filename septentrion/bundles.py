@@ -0,0 +1,220 @@
+"""
+Compile the migrations between two versions into a single SQL script (see the
+"bundle" command), that can be reviewed and run in a single psql session,
+without septentrion nor access to the migration files.
+"""
+import dataclasses
+import logging
+import pathlib
+from typing import Iterable, List, Optional, TextIO, Tuple
+
+import sqlparse
+
+from septentrion import configuration, exceptions, files, versions
+
+logger = logging.getLogger(__name__)
+
+# Statements that start or end a transaction (see unwrap_transaction)
+TRANSACTION_STATEMENTS = {"BEGIN", "START", "COMMIT", "END", "ROLLBACK", "ABORT"}
+
+
+@dataclasses.dataclass(frozen=True)
+class BundledMigration:
+    version: versions.Version
+    name: str
+    sql: str
+    # Whether the migration can be run in the same transaction as its neighbours
+    transactional: bool
+
+
+def quote_identifier(identifier: str) -> str:
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def quote_literal(value: str) -> str:
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def get_bundle_versions(
+    settings: configuration.Settings,
+    from_version: versions.Version,
+    to_version: Optional[versions.Version],
+) -> List[versions.Version]:
+    """
+    Return the versions whose migrations go in the bundle: from from_version
+    up to to_version, both included (or the latest version), like the versions
+    "migrate" goes through with --from. The state of the database is not known
+    here: all the migrations of those versions are bundled.
+    """
+    known_versions = files.get_known_versions(settings=settings)
+    if to_version and to_version not in known_versions:
+        raise exceptions.SeptentrionException(f"Version {to_version} not found")
+    return [
+        version
+        for version in known_versions
+        if from_version <= version and (not to_version or version <= to_version)
+    ]
+
+
+def _is_filler(token: sqlparse.sql.Token) -> bool:
+    """
+    Whitespace, comments and psql meta-commands
+    """
+    return (
+        token.is_whitespace
+        or isinstance(token, sqlparse.sql.Comment)
+        or token.ttype in sqlparse.tokens.Comment
+        or token.ttype in sqlparse.tokens.Generic.Command
+    )
+
+
+def _first_keyword(statement: sqlparse.sql.Statement) -> Optional[str]:
+    for token in statement.tokens:
+        if not _is_filler(token):
+            return token.normalized.upper()
+    return None
+
+
+def unwrap_transaction(sql: str) -> Tuple[str, bool]:
+    """
+    Return the SQL to bundle, and whether it controls transactions itself.
+    Migrations are often written wrapped in BEGIN; ... COMMIT;: these
+    statements are removed (keeping comments and psql meta-commands) so that
+    the migration can share the transaction of its neighbours.
+    """
+    statements = sqlparse.parse(sql)
+    keywords = [_first_keyword(statement) for statement in statements]
+    code = [index for index, keyword in enumerate(keywords) if keyword]
+    controls = [index for index in code if keywords[index] in TRANSACTION_STATEMENTS]
+    if not controls:
+        return sql, False
+
+    first, last = code[0], code[-1]
+    if controls != [first, last] or first == last:
+        return sql, True
+    if keywords[first] not in {"BEGIN", "START"}:
+        return sql, True
+    if keywords[last] not in {"COMMIT", "END"}:
+        return sql, True
+
+    parts: List[str] = []
+    for index, statement in enumerate(statements):
+        if index in controls:
+            parts.extend(str(token) for token in statement.tokens if _is_filler(token))
+        else:
+            parts.append(str(statement))
+    return "".join(parts), False
+
+
+def read_migration(
+    settings: configuration.Settings,
+    version: versions.Version,
+    name: str,
+    path: pathlib.Path,
+) -> BundledMigration:
+    metadata = files.get_migration_metadata(path)
+    sql = files.read_text(path)
+    if files.META_PSQL_PREFIX in sql:
+        # Such migrations are run in a loop (see runner.Script)
+        raise exceptions.SeptentrionException(
+            f"Migration {name} uses --meta-psql directives, it cannot be bundled"
+        )
+
+    sql, controls_transactions = unwrap_transaction(sql)
+    transactional = (
+        metadata.transactional
+        and not controls_transactions
+        and not any(keyword in sql for keyword in settings.NON_TRANSACTIONAL_KEYWORD)
+    )
+    return BundledMigration(
+        version=version, name=name, sql=sql, transactional=transactional
+    )
+
+
+def build_bundle(
+    settings: configuration.Settings,
+    from_version: versions.Version,
+    to_version: Optional[versions.Version] = None,
+) -> List[BundledMigration]:
+    """
+    Read all the migrations from from_version up to to_version, in the order in
+    which they would be applied.
+    """
+    bundle = []
+    for version in get_bundle_versions(
+        settings=settings, from_version=from_version, to_version=to_version
+    ):
+        migrations = files.get_migrations_files_mapping(
+            settings=settings, version=version
+        )
+        for name in sorted(migrations):
+            bundle.append(
+                read_migration(
+                    settings=settings,
+                    version=version,
+                    name=name,
+                    path=migrations[name],
+                )
+            )
+    return bundle
+
+
+def get_insert_statement(
+    settings: configuration.Settings, migration: BundledMigration
+) -> str:
+    return "INSERT INTO {} ({}, {}, {}) VALUES ({}, {}, clock_timestamp());\n".format(
+        quote_identifier(settings.TABLE),
+        quote_identifier(settings.VERSION_COLUMN),
+        quote_identifier(settings.NAME_COLUMN),
+        quote_identifier(settings.APPLIED_AT_COLUMN),
+        quote_literal(migration.version.original_string),
+        quote_literal(migration.name),
+    )
+
+
+def write_bundle(
+    settings: configuration.Settings,
+    bundle: Iterable[BundledMigration],
+    output: TextIO,
+    single_transaction: bool = False,
+) -> None:
+    """
+    Write the bundle as a psql script. Consecutive transactional migrations are
+    run in the same transaction, along with the migrations table rows
+    recording them. Other migrations are run on their own, outside of any
+    transaction.
+    With single_transaction, the whole bundle is run in one transaction, which
+    is only possible if all its migrations are transactional.
+    """
+    bundle = list(bundle)
+    if single_transaction:
+        for migration in bundle:
+            if not migration.transactional:
+                raise exceptions.SeptentrionException(
+                    f"Migration {migration.name} cannot be run in a transaction, "
+                    f"the bundle cannot be run in a single transaction"
+                )
+
+    output.write("-- Generated by septentrion, run it with psql\n")
+    output.write("\\set ON_ERROR_STOP on\n")
+
+    in_transaction = False
+    for migration in bundle:
+        if migration.transactional and not in_transaction:
+            output.write("\nBEGIN;\n")
+            in_transaction = True
+        elif not migration.transactional and in_transaction:
+            output.write("\nCOMMIT;\n")
+            in_transaction = False
+
+        output.write(f"\n\\echo Applying {migration.version} {migration.name}\n")
+        output.write(migration.sql)
+        if not migration.sql.endswith("\n"):
+            output.write("\n")
+        if not migration.sql.rstrip().endswith(";"):
+            # Make sure the last statement of the migration is terminated
+            output.write(";\n")
+        output.write(get_insert_statement(settings=settings, migration=migration))
+
+    if in_transaction:
+        output.write("\nCOMMIT;\n")
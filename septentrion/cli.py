@@ -6,17 +6,26 @@ it.
 import functools
 import logging
 import os
-from typing import Any, TextIO
+import pathlib
+import zipfile
+from typing import Any, List, Optional, TextIO
 
 import click
 from click.types import StringParamType
 
 from septentrion import (
     __version__,
+    archives,
+    bundles,
+    clones,
     configuration,
     core,
+    databases,
+    db,
     exceptions,
     migration,
+    plans,
+    state,
     style,
     versions,
 )
@@ -45,6 +54,13 @@ CONTEXT_SETTINGS = {
 
 LATEST_VERSION = "latest"
 
+# Commands that don't use the migrations table of the database: they only work
+# with the migration files, or with other databases
+OFFLINE_COMMANDS = {"pack", "bundle", "clone"}
+# Commands that create the migrations table themselves: they may migrate other
+# databases than the one given by --dbname, or read a state file instead
+TABLE_COMMANDS = {"migrate", "show-migrations", "plan"}
+
 
 def validate_version(ctx: click.Context, param: Any, value: str):
     if value == LATEST_VERSION:
@@ -56,6 +72,17 @@ def validate_version(ctx: click.Context, param: Any, value: str):
     return version
 
 
+class MigrationsRootParamType(click.Path):
+    """
+    A path, or a reference to package resources ("package:<module>/<path>")
+    """
+
+    def convert(self, value: Any, param: Any, ctx: Any) -> Any:
+        if isinstance(value, str) and value.startswith(archives.PACKAGE_PREFIX):
+            return value
+        return super().convert(value, param, ctx)
+
+
 class CommaSeparatedMultipleString(StringParamType):
     envvar_list_splitter = ","
 
@@ -133,8 +160,10 @@ class CommaSeparatedMultipleString(StringParamType):
 )
 @click.option(
     "--migrations-root",
-    help="Path to the migration files (env: SEPTENTRION_MIGRATION_ROOT)",
-    type=click.Path(exists=True, file_okay=False, resolve_path=True),
+    help="Path to the migration files, or to an archive created with the 'pack' "
+    "command, or 'package:<module>/<path>' to read them from the resources of an "
+    "installed python package (env: SEPTENTRION_MIGRATION_ROOT)",
+    type=MigrationsRootParamType(exists=True, resolve_path=True),
     default=configuration.DEFAULTS["migrations_root"],
 )
 @click.option(
@@ -201,6 +230,56 @@ class CommaSeparatedMultipleString(StringParamType):
     default=configuration.DEFAULTS["ignore_symlinks"],
     help="Ignore migration files that are symlinks",
 )
+@click.option(
+    "--discovery-workers",
+    type=click.IntRange(min=1),
+    default=configuration.DEFAULTS["discovery_workers"],
+    help="Number of threads used to list version folders and read migration files "
+    "headers. Raising it speeds up discovery on high-latency (network) filesystems "
+    "(env: SEPTENTRION_DISCOVERY_WORKERS)",
+)
+@click.option(
+    "--schema-file-workers",
+    type=click.IntRange(min=1),
+    default=configuration.DEFAULTS["schema_file_workers"],
+    help="Number of before and after schema files run at the same time. They must "
+    "not depend on each other (env: SEPTENTRION_SCHEMA_FILE_WORKERS)",
+)
+@click.option(
+    "--snapshot-dir",
+    type=click.Path(file_okay=False, writable=True, resolve_path=True),
+    default=configuration.DEFAULTS["snapshot_dir"],
+    help="Folder in which to keep snapshots of migrated databases. When migrating an "
+    "empty database, a snapshot matching the migration files is restored if it "
+    "exists, and saved otherwise (env: SEPTENTRION_SNAPSHOT_DIR)",
+)
+@click.option(
+    "--snapshot-max-size",
+    type=click.IntRange(min=0),
+    default=configuration.DEFAULTS["snapshot_max_size"],
+    help="Total size of the snapshots, in MiB, above which the least recently used "
+    "ones are deleted (env: SEPTENTRION_SNAPSHOT_MAX_SIZE)",
+)
+@click.option(
+    "--restore-jobs",
+    type=click.IntRange(min=1),
+    default=configuration.DEFAULTS["restore_jobs"],
+    help="Number of parallel jobs used to restore schemas and fixtures that are "
+    "pg_dump archives. Defaults to the number of CPUs "
+    "(env: SEPTENTRION_RESTORE_JOBS)",
+)
+@click.option(
+    "--fast-init/--no-fast-init",
+    default=configuration.DEFAULTS["fast_init"],
+    help="When migrating an empty database, trade durability for speed: only for "
+    "databases that can be created again, e.g. in CI (env: SEPTENTRION_FAST_INIT)",
+)
+@click.option(
+    "--defer-post-data/--no-defer-post-data",
+    default=configuration.DEFAULTS["defer_post_data"],
+    help="When loading a schema, build its indexes, constraints and triggers after "
+    "the fixtures are loaded, in parallel (env: SEPTENTRION_DEFER_POST_DATA)",
+)
 @click.option(
     "--create-table/--no-create-table",
     default=configuration.DEFAULTS["create_table"],
@@ -214,34 +293,231 @@ def cli(ctx: click.Context, **kwargs):
         password = os.getenv("SEPTENTRION_PASSWORD")
     kwargs["password"] = password
 
-    ctx.obj = settings = core.initialize(**kwargs)
+    if ctx.invoked_subcommand in OFFLINE_COMMANDS:
+        # No need for the migrations table, or even a database
+        kwargs["create_table"] = False
+
+    if ctx.invoked_subcommand in TABLE_COMMANDS:
+        ctx.obj = settings = configuration.Settings(**kwargs)
+    else:
+        ctx.obj = settings = core.initialize(**kwargs)
 
     level = configuration.log_level(verbosity=settings.VERBOSITY)
     logging.basicConfig(level=level)
     logger.info("Verbosity level: %s", logging.getLevelName(level))
 
 
+def state_option(function):
+    return click.option(
+        "--state",
+        "state_file",
+        type=click.File("r"),
+        help="Read the applied migrations from this file, written by the "
+        "'export-state' command, instead of the database",
+    )(function)
+
+
+def get_store(
+    settings: configuration.Settings, state_file: Optional[TextIO]
+) -> state.StateStore:
+    if state_file:
+        return state.MemoryStateStore(state.read_state(state_file))
+    if settings.CREATE_TABLE:
+        db.create_table(settings=settings)
+    return state.PostgresStateStore(settings=settings)
+
+
 @cli.command(name="show-migrations")
+@click.option(
+    "--last",
+    type=click.IntRange(min=0),
+    help="Only show the last N versions",
+)
+@state_option
 @click.pass_obj
-def show_migrations(settings: configuration.Settings):
+def show_migrations(
+    settings: configuration.Settings, last: Optional[int], state_file: Optional[TextIO]
+):
     """
     Show the current state of the database.
     Retrieves informations on the current version
     of the database schema, and the applied and
     unapplied migrations.
     """
-    core.describe_migration_plan(settings=settings, stylist=style.stylist)
+    core.describe_migration_plan(
+        settings=settings,
+        stylist=style.stylist,
+        last=last,
+        store=get_store(settings=settings, state_file=state_file),
+    )
+
+
+@cli.command()
+@click.option(
+    "--output",
+    "-o",
+    type=click.File("w"),
+    default="-",
+    help="File in which to write the plan (defaults to the standard output)",
+)
+@state_option
+@click.pass_obj
+def plan(
+    settings: configuration.Settings, output: TextIO, state_file: Optional[TextIO]
+):
+    """
+    Save the migration plan to a file.
+    The plan can be run later with "migrate --plan", which skips discovering
+    the migration files, as long as the database and the files to run didn't
+    change in between.
+    """
+    store = get_store(settings=settings, state_file=state_file)
+    plans.write_plan(plans.build_plan(settings=settings, store=store), output)
+
+
+@cli.command(name="export-state")
+@click.option(
+    "--output",
+    "-o",
+    type=click.File("w"),
+    default="-",
+    help="File in which to write the state (defaults to the standard output)",
+)
+@click.pass_obj
+def export_state(settings: configuration.Settings, output: TextIO):
+    """
+    Save the applied migrations of the database to a file.
+    The migrations can then be shown, or planned, without connecting to the
+    database (see the --state option of "show-migrations" and "plan").
+    """
+    state.write_state(state.PostgresStateStore(settings=settings), output)
 
 
 @cli.command()
+@click.option(
+    "--plan",
+    "plan_file",
+    type=click.File("r"),
+    help="Run the plan saved in this file by the 'plan' command, instead of "
+    "computing it",
+)
+@click.option(
+    "--databases",
+    "databases_file",
+    type=click.File("r"),
+    help="Migrate the databases listed in this file (one name per line), "
+    "instead of --dbname",
+)
+@click.option(
+    "--dbname-pattern",
+    help="Migrate the databases whose name matches this LIKE pattern (e.g. "
+    "'tenant_%'), instead of --dbname. They're listed from --dbname",
+)
+@click.option(
+    "--schemas",
+    "schemas_file",
+    type=click.File("r"),
+    help="Migrate the schemas of the database listed in this file (one name per "
+    "line), each with its own migrations table",
+)
+@click.option(
+    "--schema-pattern",
+    help="Migrate the schemas of the database whose name matches this LIKE "
+    "pattern (e.g. 'tenant\\_%'), each with its own migrations table",
+)
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=4,
+    help="With --databases, --dbname-pattern, --schemas or --schema-pattern, "
+    "number of databases or schemas migrated at the same time",
+)
 @click.pass_obj
-def migrate(settings: configuration.Settings):
+def migrate(
+    settings: configuration.Settings,
+    plan_file: Optional[TextIO],
+    databases_file: Optional[TextIO],
+    dbname_pattern: Optional[str],
+    schemas_file: Optional[TextIO],
+    schema_pattern: Optional[str],
+    concurrency: int,
+):
     """
     Run unapplied migrations.
+    With --databases or --dbname-pattern (--schemas or --schema-pattern),
+    migrate several databases (schemas) concurrently, and print a summary of
+    the results.
     """
+    options = [plan_file, databases_file, dbname_pattern, schemas_file, schema_pattern]
+    if sum(bool(option) for option in options) > 1:
+        raise click.UsageError(
+            "--plan, --databases, --dbname-pattern, --schemas and --schema-pattern "
+            "are mutually exclusive"
+        )
+    if databases_file:
+        names = databases.read_names(databases_file)
+        migrate_targets(settings=settings, names=names, workers=concurrency)
+        return
+    if dbname_pattern:
+        names = db.get_database_names(settings=settings, pattern=dbname_pattern)
+        migrate_targets(settings=settings, names=names, workers=concurrency)
+        return
+    if schemas_file:
+        names = databases.read_names(schemas_file)
+        migrate_targets(
+            settings=settings, names=names, workers=concurrency, schemas=True
+        )
+        return
+    if schema_pattern:
+        names = db.get_schema_names(settings=settings, pattern=schema_pattern)
+        migrate_targets(
+            settings=settings, names=names, workers=concurrency, schemas=True
+        )
+        return
+
+    if settings.CREATE_TABLE:
+        db.create_table(settings=settings)
+
+    if plan_file:
+        plan = plans.read_plan(plan_file)
+        try:
+            migration.migrate_plan(settings=settings, plan=plan, stylist=style.stylist)
+        except exceptions.OutdatedPlan as exc:
+            raise click.ClickException(f"Cannot run the plan: {exc}")
+        return
+
     migration.migrate(settings=settings, stylist=style.stylist)
 
 
+def migrate_targets(
+    settings: configuration.Settings,
+    names: List[str],
+    workers: int,
+    schemas: bool = False,
+) -> None:
+    kind = "schema" if schemas else "database"
+    if not names:
+        raise click.ClickException(f"No {kind} to migrate")
+
+    results = databases.migrate_targets(
+        settings=settings,
+        names=names,
+        workers=workers,
+        select=databases.select_schema if schemas else databases.select_database,
+        stylist=style.stylist,
+    )
+    with style.stylist.activate("title") as echo:
+        echo("Summary")
+    for line in databases.format_summary(results, kind=kind.capitalize()):
+        style.stylist.echo(line)
+
+    failures = sum(result.failed for result in results)
+    if failures:
+        raise click.ClickException(
+            f"{failures} of {len(results)} {kind}s failed to migrate"
+        )
+
+
 @cli.command()
 @click.argument("version", callback=validate_version)
 @click.pass_obj
@@ -253,3 +529,136 @@ def fake(settings: configuration.Settings, version: versions.Version):
     when installing septentrion on an existing DB.
     """
     migration.create_fake_entries(settings=settings, version=version)
+
+
+@cli.command()
+@click.option(
+    "--from",
+    "from_version",
+    required=True,
+    callback=validate_version,
+    help="First version to bundle (included, as with migrate --from). All its "
+    "migrations are bundled: the database is not read, so already applied "
+    "migrations are not skipped",
+)
+@click.option(
+    "--to",
+    "to_version",
+    default=LATEST_VERSION,
+    callback=validate_version,
+    help="Last version to bundle",
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.File("w"),
+    default="-",
+    help="File in which to write the bundle (defaults to the standard output)",
+)
+@click.option(
+    "--single-transaction/--no-single-transaction",
+    default=False,
+    help="Run the whole bundle in a single transaction. Fails if a migration "
+    "cannot be run in a transaction",
+)
+@click.pass_obj
+def bundle(
+    settings: configuration.Settings,
+    from_version: Optional[versions.Version],
+    to_version: Optional[versions.Version],
+    output: TextIO,
+    single_transaction: bool,
+):
+    """
+    Compile migrations into a single SQL script.
+    The script runs, with psql, all the migrations of the versions from --from
+    to --to, and records them in the migrations table. Bundling does not
+    connect to the database: the migrations already applied are not known, and
+    are bundled too. Consecutive migrations are run in the same transaction,
+    except those that cannot run in a transaction.
+    """
+    if not from_version:
+        raise click.BadParameter("a version is required", param_hint="--from")
+
+    try:
+        bundled = bundles.build_bundle(
+            settings=settings, from_version=from_version, to_version=to_version
+        )
+        bundles.write_bundle(
+            settings=settings,
+            bundle=bundled,
+            output=output,
+            single_transaction=single_transaction,
+        )
+    except exceptions.SeptentrionException as exc:
+        raise click.ClickException(f"Cannot bundle migrations: {exc}")
+
+
+@cli.command()
+@click.option(
+    "--count", type=click.IntRange(min=1), default=1, help="Number of databases"
+)
+@click.option(
+    "--prefix",
+    default="test_",
+    help="Prefix of the names of the databases: they're named <prefix>0, "
+    "<prefix>1...",
+)
+@click.option(
+    "--template",
+    help="Name of the template database  [default: <prefix>template]",
+)
+@click.pass_obj
+def clone(
+    settings: configuration.Settings,
+    count: int,
+    prefix: str,
+    template: Optional[str],
+):
+    """
+    Create many migrated databases.
+    A template database is migrated (only if the migration files changed since
+    it was last migrated), then copied into each database. Existing databases
+    are replaced. --dbname is the database to connect to in order to create the
+    others, e.g. "postgres".
+    """
+    names = clones.clone_databases(
+        settings=settings,
+        count=count,
+        prefix=prefix,
+        template=template,
+        stylist=style.stylist,
+    )
+    with style.stylist.activate("title") as echo:
+        echo(f"Created {', '.join(names)}")
+
+
+@cli.command()
+@click.argument(
+    "output", type=click.Path(dir_okay=False, writable=True, resolve_path=True)
+)
+@click.option(
+    "--deflate/--no-deflate",
+    default=False,
+    help="Compress the files in the archive. Leave it off to stream files out of "
+    "the archive without decompressing them (SQL files can be compressed "
+    "individually)",
+)
+@click.pass_obj
+def pack(settings: configuration.Settings, output: str, deflate: bool):
+    """
+    Pack the migration files in a single archive.
+    The archive can then be used as migrations root: discovering migrations
+    only needs reading the archive index instead of listing many folders.
+    """
+    if not isinstance(settings.MIGRATIONS_ROOT, pathlib.Path):
+        raise click.UsageError("The migrations root to pack must be a folder")
+
+    count = archives.pack(
+        root=settings.MIGRATIONS_ROOT,
+        output=pathlib.Path(output),
+        compression=zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED,
+        ignore_symlinks=settings.IGNORE_SYMLINKS,
+    )
+    with style.stylist.activate("title") as echo:
+        echo(f"Packed {count} files in {output}")
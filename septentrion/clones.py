@@ -0,0 +1,91 @@
+"""
+Create many migrated databases quickly (see the "clone" command): a template
+database is migrated once, then copied with CREATE DATABASE ... TEMPLATE, which
+copies files instead of replaying migrations. The template is kept between
+runs, and only migrated again when the migration files change.
+"""
+import logging
+from typing import List, Optional
+
+from septentrion import configuration, db, migration, snapshots, style
+
+logger = logging.getLogger(__name__)
+
+# The template database comment holds the key of the migration files it was
+# migrated with (see snapshots.get_repository_key)
+COMMENT_PREFIX = "septentrion:"
+
+
+def get_template_name(prefix: str) -> str:
+    return f"{prefix}template"
+
+
+def get_clone_names(prefix: str, count: int) -> List[str]:
+    return [f"{prefix}{index}" for index in range(count)]
+
+
+def is_template_up_to_date(
+    settings: configuration.Settings, template: str, key: str
+) -> bool:
+    exists, comment = db.get_database_comment(settings=settings, dbname=template)
+    return exists and comment == f"{COMMENT_PREFIX}{key}"
+
+
+def prepare_template(
+    settings: configuration.Settings,
+    template: str,
+    stylist: style.Stylist = style.noop_stylist,
+) -> None:
+    """
+    Make sure the template database is migrated with the current migration
+    files. settings are those of the database used to create the template.
+    """
+    key = snapshots.get_repository_key(settings=settings)
+    if is_template_up_to_date(settings=settings, template=template, key=key):
+        with stylist.activate("title") as echo:
+            echo(f"Template {template} is up to date")
+        return
+
+    with stylist.activate("title") as echo:
+        echo(f"Migrating template {template}")
+    db.drop_database(settings=settings, dbname=template)
+    db.create_database(settings=settings, dbname=template)
+
+    template_settings = settings.replace(dbname=template)
+    db.create_table(settings=template_settings)
+    migration.migrate(settings=template_settings, stylist=stylist)
+
+    # Only marked as up to date once fully migrated
+    db.comment_database(
+        settings=settings, dbname=template, comment=f"{COMMENT_PREFIX}{key}"
+    )
+
+
+def clone_databases(
+    settings: configuration.Settings,
+    count: int,
+    prefix: str,
+    template: Optional[str] = None,
+    stylist: style.Stylist = style.noop_stylist,
+) -> List[str]:
+    """
+    Create count migrated databases named <prefix>0, <prefix>1... (replacing
+    existing ones), and return their names.
+    settings are those of the database used to create the others (e.g.
+    "postgres"): the template and the clones are created on the same server.
+    """
+    template = template or get_template_name(prefix)
+    prepare_template(settings=settings, template=template, stylist=stylist)
+
+    names = get_clone_names(prefix=prefix, count=count)
+    with stylist.activate("title") as echo:
+        echo(f"Cloning {template}")
+    for name in names:
+        # Clones are created one at a time: PostgreSQL refuses to copy a
+        # database that is being copied.
+        with stylist.checkbox(
+            content=f"Creating {name}...", content_after=f"Created {name}"
+        ):
+            db.drop_database(settings=settings, dbname=name)
+            db.create_database(settings=settings, dbname=name, template=template)
+    return names
@@ -4,10 +4,11 @@ the settings, see cli.py (for now)
 """
 import configparser
 import logging
+import os
 import pathlib
 from typing import Any, Dict, Optional, TextIO, Tuple, Union
 
-from septentrion import exceptions, versions
+from septentrion import archives, exceptions, versions
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +41,14 @@ DEFAULTS = {
     "fixtures_template": "fixtures_{}.sql",
     "non_transactional_keyword": ["CONCURRENTLY", "ALTER TYPE", "VACUUM"],
     "ignore_symlinks": False,
+    "discovery_workers": 1,
+    "schema_file_workers": 1,
+    "snapshot_dir": None,
+    "snapshot_max_size": 1024,
+    # None means one job per CPU
+    "restore_jobs": None,
+    "fast_init": False,
+    "defer_post_data": False,
     "schema_version": None,
     "target_version": None,
     # Values that don't have an explicit default need to be present too
@@ -120,9 +129,17 @@ def log_level(verbosity: int) -> int:
 class Settings:
     def __init__(self, **kwargs):
         self._settings = {}
+        # PostgreSQL settings of the sessions opened by septentrion. They are
+        # not part of the configuration: septentrion sets them itself (see
+        # with_session_options).
+        self._session_options = {}
         self.update(DEFAULTS)
         self.update(kwargs)
 
+    @property
+    def SESSION_OPTIONS(self) -> Dict[str, str]:
+        return self._session_options
+
     def __getattr__(self, key: str) -> Any:
         try:
             return self._settings[key]
@@ -141,12 +158,40 @@ class Settings:
         self._settings[upper_key] = value
 
     def clean_migrations_root(
-        self, migrations_root: Union[str, pathlib.Path]
-    ) -> pathlib.Path:
+        self, migrations_root: Union[str, pathlib.Path, archives.ArchivePath]
+    ) -> Union[pathlib.Path, archives.ArchivePath]:
         if isinstance(migrations_root, str):
+            if migrations_root.startswith(archives.PACKAGE_PREFIX):
+                return archives.get_package_root(migrations_root)
             migrations_root = pathlib.Path(migrations_root)
+        if isinstance(migrations_root, pathlib.Path) and archives.is_archive(
+            migrations_root
+        ):
+            archive = archives.open_archive(migrations_root.resolve())
+            return archives.ArchivePath(archive)
         return migrations_root
 
+    def clean_discovery_workers(self, workers: Union[str, int]) -> int:
+        return int(workers)
+
+    def clean_schema_file_workers(self, workers: Union[str, int]) -> int:
+        return int(workers)
+
+    def clean_snapshot_dir(
+        self, snapshot_dir: Union[None, str, pathlib.Path]
+    ) -> Optional[pathlib.Path]:
+        if not snapshot_dir:
+            return None
+        return pathlib.Path(snapshot_dir)
+
+    def clean_snapshot_max_size(self, max_size: Union[str, int]) -> int:
+        return int(max_size)
+
+    def clean_restore_jobs(self, jobs: Union[None, str, int]) -> int:
+        if not jobs:
+            return os.cpu_count() or 1
+        return int(jobs)
+
     def clean_schema_version(
         self, version: Union[None, str, versions.Version]
     ) -> Optional[versions.Version]:
@@ -163,6 +208,25 @@ class Settings:
 
         return version
 
+    def replace(self, **kwargs) -> "Settings":
+        """
+        Return a copy of the settings, with some values changed.
+        """
+        settings = Settings.__new__(Settings)
+        settings._settings = dict(self._settings)
+        settings._session_options = self._session_options
+        settings.update(kwargs)
+        return settings
+
+    def with_session_options(self, options: Dict[str, str]) -> "Settings":
+        """
+        Return a copy of the settings, whose sessions use the given PostgreSQL
+        settings (instead of those of these settings).
+        """
+        settings = self.replace()
+        settings._session_options = dict(options)
+        return settings
+
     def __repr__(self):
         return repr(self._settings)
 
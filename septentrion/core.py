@@ -2,10 +2,21 @@
 This is where the migration plan is computed, by merging information
 from the existing files (septentrion.files) and from the db (septentrion.db)
 """
+import itertools
 import logging
-from typing import Any, Dict, Iterable, Optional
-
-from septentrion import configuration, db, exceptions, files, style, utils, versions
+import pathlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from septentrion import (
+    configuration,
+    db,
+    exceptions,
+    files,
+    state,
+    style,
+    utils,
+    versions,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -22,13 +33,14 @@ def initialize(**kwargs):
 
 
 def get_applied_versions(
-    settings: configuration.Settings,
+    settings: configuration.Settings, store: Optional[state.StateStore] = None
 ) -> Iterable[versions.Version]:
     """
     Return the list of applied versions.
     Reuse django migration table.
     """
-    applied_versions = set(db.get_applied_versions(settings=settings))
+    store = state.get_store(settings=settings, store=store)
+    applied_versions = set(store.get_applied_versions())
 
     known_versions = set(files.get_known_versions(settings=settings))
 
@@ -49,23 +61,19 @@ def get_closest_version(
     Take the closest to the target_version. Can be the same version, or older.
     """
     # get known versions
-    known_versions = files.get_known_versions(settings=settings)
+    known_versions = versions.VersionIndex(files.get_known_versions(settings=settings))
     # find target version
-
-    if not target_version:
-        previous_versions = known_versions
-    else:
-        try:
-            previous_versions = list(utils.until(known_versions, target_version))
-        except ValueError:
-            raise ValueError(
-                "settings.TARGET_VERSION is improperly configured: "
-                "version {} not found.".format(target_version)
-            )
+    if target_version and target_version not in known_versions:
+        raise ValueError(
+            "settings.TARGET_VERSION is improperly configured: "
+            "version {} not found.".format(target_version)
+        )
 
     # should we set a version from settings ?
     if force_version:
-        if force_version not in previous_versions:
+        if force_version not in known_versions or (
+            target_version and force_version > target_version
+        ):
             raise ValueError(
                 "settings.TARGET_VERSION is improperly configured: "
                 "settings.SCHEMA_VERSION is more recent."
@@ -78,13 +86,55 @@ def get_closest_version(
         # not found
         return None
 
-    for version in previous_versions[::-1]:
-        schema_file = sql_tpl.format(version.original_string)
-        if schema_file in existing_files:
-            return version
+    # Rather than trying each known version, read the versions of the existing
+    # files, keeping those that are named after a known version
+    available_versions = versions.VersionIndex(
+        version
+        for version in get_template_versions(sql_tpl, existing_files)
+        if _same_string(known_versions.find(version), version)
+    )
+    return available_versions.closest(target_version)
+
+
+def _same_string(version: Optional[versions.Version], other: versions.Version) -> bool:
+    return version is not None and version.original_string == other.original_string
 
-    # not found
-    return None
+
+def get_template_versions(
+    sql_tpl: str, file_names: Iterable[str]
+) -> Iterable[versions.Version]:
+    """
+    Return the versions of the file names that match the template (e.g.
+    "schema_{}.sql").
+    """
+    prefix, placeholder, suffix = sql_tpl.partition("{}")
+    if not placeholder:
+        return
+    for name in file_names:
+        if not (name.startswith(prefix) and name.endswith(suffix)):
+            continue
+        start, end = len(prefix), len(name) - len(suffix)
+        version_string = name[start:end]
+        if utils.is_version(version_string):
+            yield versions.Version.from_string(version_string)
+
+
+def get_special_file_names(
+    settings: configuration.Settings, folder: str, sql_tpl: str
+) -> List[str]:
+    """
+    Return the names of the files of a special folder, as SQL file names:
+    compressed files, pg_dump archives and COPY folders are listed under the
+    name of the SQL file they replace.
+    """
+    names = files.get_special_files(root=settings.MIGRATIONS_ROOT, folder=folder)
+    replacing_versions = itertools.chain(
+        get_template_versions(files.get_dump_name(sql_tpl), names),
+        get_template_versions(files.get_copy_name(sql_tpl), names),
+    )
+    return [files.strip_compression_suffix(name) for name in names] + [
+        sql_tpl.format(version.original_string) for version in replacing_versions
+    ]
 
 
 # TODO: refactor this and the function below
@@ -93,8 +143,8 @@ def get_best_schema_version(settings: configuration.Settings) -> versions.Versio
     """
     Get the best candidate to init the DB.
     """
-    schema_files = files.get_special_files(
-        root=settings.MIGRATIONS_ROOT, folder="schemas"
+    schema_files = get_special_file_names(
+        settings=settings, folder="schemas", sql_tpl=settings.SCHEMA_TEMPLATE
     )
     version = get_closest_version(
         settings=settings,
@@ -116,8 +166,8 @@ def get_fixtures_version(
     Get the closest fixtures to use to init a new DB
     to the current target version.
     """
-    fixture_files = files.get_special_files(
-        root=settings.MIGRATIONS_ROOT, folder="fixtures"
+    fixture_files = get_special_file_names(
+        settings=settings, folder="fixtures", sql_tpl=settings.FIXTURES_TEMPLATE
     )
     version = get_closest_version(
         settings=settings,
@@ -131,66 +181,255 @@ def get_fixtures_version(
     return version
 
 
-def build_migration_plan(
-    settings: configuration.Settings, from_version: versions.Version
-) -> Iterable[Dict[str, Any]]:
+def is_manual_migration(path: pathlib.Path, applied: bool) -> bool:
+    if applied:
+        # Applied migrations won't be run again: we don't read them at all,
+        # only the path can tell us if they're manual.
+        return files.is_manual_migration(migration_path=path, migration_contents=[])
+    return files.get_migration_metadata(path).manual
+
+
+class MigrationStep:
     """
-    Return the list of migrations by version,
-    from the version used to init the DB to the current target version.
+    One migration of the plan. Whether it is manual is only known when asked:
+    it requires reading the header of the migration file.
     """
-    # get known versions
-    known_versions = files.get_known_versions(settings=settings)
-    target_version = settings.TARGET_VERSION
 
-    # get all versions to apply
-    if not target_version:
-        versions_to_apply = known_versions
-    else:
-        try:
-            versions_to_apply = list(utils.until(known_versions, target_version))
-        except ValueError:
-            raise ValueError(
-                "settings.TARGET_VERSION is improperly configured: "
-                "version {} not found.".format(target_version)
-            )
+    __slots__ = ("version", "name", "applied", "path", "_manual")
+
+    def __init__(
+        self,
+        version: versions.Version,
+        name: str,
+        applied: bool,
+        path: pathlib.Path,
+        manual: Optional[bool] = None,
+    ):
+        self.version = version
+        self.name = name
+        self.applied = applied
+        self.path = path
+        self._manual = manual
+
+    @property
+    def manual(self) -> bool:
+        if self._manual is None:
+            self._manual = is_manual_migration(path=self.path, applied=self.applied)
+        return self._manual
+
+    def as_tuple(self) -> Tuple[str, bool, pathlib.Path, bool]:
+        return (self.name, self.applied, self.path, self.manual)
+
+    def __eq__(self, other):
+        if not isinstance(other, MigrationStep):
+            return NotImplemented
+        return (self.version, self.name, self.applied, self.path) == (
+            other.version,
+            other.name,
+            other.applied,
+            other.path,
+        )
 
-    versions_to_apply = list(utils.since(versions_to_apply, from_version))
+    def __repr__(self):
+        return "MigrationStep(version={!r}, name={!r}, applied={!r})".format(
+            str(self.version), self.name, self.applied
+        )
 
-    # get plan for each version to apply
-    for version in versions_to_apply:
-        version_plan = []
-        # get applied migrations
-        applied_migrations = db.get_applied_migrations(
-            settings=settings, version=version
+
+class VersionPlan:
+    """
+    The migrations of one version, in the order in which they are applied.
+    """
+
+    __slots__ = ("version", "steps")
+
+    def __init__(self, version: versions.Version, steps: Sequence[MigrationStep]):
+        self.version = version
+        self.steps = steps
+
+    def __iter__(self) -> Iterator[MigrationStep]:
+        return iter(self.steps)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def __eq__(self, other):
+        if not isinstance(other, VersionPlan):
+            return NotImplemented
+        return (self.version, list(self.steps)) == (other.version, list(other.steps))
+
+    def __repr__(self):
+        return "VersionPlan(version={!r}, steps={!r})".format(
+            str(self.version), list(self.steps)
         )
-        # get migrations to apply
-        migrations_to_apply = files.get_migrations_files_mapping(
-            settings=settings, version=version
+
+    def as_dict(self, workers: int = 1) -> Dict[str, Any]:
+        manual_flags = utils.map_concurrently(
+            lambda step: step.manual, self.steps, workers=workers
         )
-        migs = list(migrations_to_apply)
-        migs.sort()
-        # build plan
-        for mig in migs:
-            applied = mig in applied_migrations
-            path = migrations_to_apply[mig]
-            contents = files.file_lines_generator(path)
-            is_manual = files.is_manual_migration(
-                migration_path=path, migration_contents=contents
+        return {
+            "version": self.version,
+            "plan": [
+                (step.name, step.applied, step.path, manual)
+                for step, manual in zip(self.steps, manual_flags)
+            ],
+        }
+
+
+def get_versions_to_apply(
+    settings: configuration.Settings, from_version: versions.Version
+) -> List[versions.Version]:
+    known_versions = versions.VersionIndex(files.get_known_versions(settings=settings))
+    target_version = settings.TARGET_VERSION
+
+    if target_version and target_version not in known_versions:
+        raise ValueError(
+            "settings.TARGET_VERSION is improperly configured: "
+            "version {} not found.".format(target_version)
+        )
+    if from_version not in known_versions:
+        return []
+
+    return known_versions.window(start=from_version, end=target_version)
+
+
+def iter_migration_plan(
+    settings: configuration.Settings,
+    from_version: versions.Version,
+    pending_only: bool = False,
+    last: Optional[int] = None,
+    applied_by_version: Optional[Dict[versions.Version, Set[str]]] = None,
+    store: Optional[state.StateStore] = None,
+) -> Iterator[VersionPlan]:
+    """
+    Lazily yield the plan of each version, from the version used to init the
+    DB to the current target version. Older versions are never looked at, and
+    version folders are only listed when the iteration reaches them.
+    With pending_only, applied migrations are left out, and so are versions
+    without any migration left to apply.
+    With last, only the last versions of the plan are considered.
+    applied_by_version, if given, holds the applied migrations of the versions
+    (see db.get_applied_migrations_by_version), instead of querying them.
+    store, if given, is where the applied migrations are read from, instead of
+    the migrations table (see septentrion.state).
+    """
+    versions_to_apply = get_versions_to_apply(
+        settings=settings, from_version=from_version
+    )
+    if last is not None:
+        start = max(len(versions_to_apply) - last, 0)
+        versions_to_apply = versions_to_apply[start:]
+
+    if applied_by_version is None:
+        # A single query for the applied migrations of all the versions
+        applied_by_version = state.get_store(
+            settings=settings, store=store
+        ).get_applied_migrations_by_version(versions_=versions_to_apply)
+
+    migrations_by_version = _iter_migrations_by_version(
+        settings=settings, versions_to_apply=versions_to_apply
+    )
+    for version, migrations_to_apply in zip(versions_to_apply, migrations_by_version):
+        applied_migrations = applied_by_version[version]
+        steps = []
+        for name in sorted(migrations_to_apply):
+            applied = name in applied_migrations
+            if applied and pending_only:
+                continue
+            steps.append(
+                MigrationStep(
+                    version=version,
+                    name=name,
+                    applied=applied,
+                    path=migrations_to_apply[name],
+                )
             )
-            version_plan.append((mig, applied, path, is_manual))
-        yield {"version": version, "plan": version_plan}
+        if pending_only and not steps:
+            continue
+        yield VersionPlan(version=version, steps=steps)
+
+
+def _iter_migrations_by_version(
+    settings: configuration.Settings, versions_to_apply: List[versions.Version]
+) -> Iterator[Dict[str, pathlib.Path]]:
+    """
+    Listing version folders can be spread over a pool of threads: on network
+    filesystems, each of these is a round trip. Folders are listed in batches
+    of DISCOVERY_WORKERS, so that an iteration stopping early (e.g.
+    get_first_pending_step) only waits for the listings of its batch.
+    """
+    workers = settings.DISCOVERY_WORKERS
+    batch_size = max(workers, 1)
+    for start in range(0, len(versions_to_apply), batch_size):
+        end = start + batch_size
+        yield from utils.map_concurrently(
+            lambda version: files.get_migrations_files_mapping(
+                settings=settings, version=version
+            ),
+            versions_to_apply[start:end],
+            workers=workers,
+        )
+
+
+def iter_migration_steps(
+    settings: configuration.Settings,
+    from_version: versions.Version,
+    pending_only: bool = False,
+) -> Iterator[MigrationStep]:
+    for version_plan in iter_migration_plan(
+        settings=settings, from_version=from_version, pending_only=pending_only
+    ):
+        yield from version_plan
+
+
+def get_first_pending_step(
+    settings: configuration.Settings, from_version: versions.Version
+) -> Optional[MigrationStep]:
+    """
+    Return the next migration to apply, or None if everything is applied.
+    Iteration stops there: later versions are not looked at.
+    """
+    steps = iter_migration_steps(
+        settings=settings, from_version=from_version, pending_only=True
+    )
+    return next(steps, None)
+
+
+def build_migration_plan(
+    settings: configuration.Settings,
+    from_version: versions.Version,
+    store: Optional[state.StateStore] = None,
+) -> Iterable[Dict[str, Any]]:
+    """
+    Return the list of migrations by version,
+    from the version used to init the DB to the current target version.
+    This is the dict form of iter_migration_plan.
+    """
+    for version_plan in iter_migration_plan(
+        settings=settings, from_version=from_version, store=store
+    ):
+        # Reading migration headers can be spread over a pool of threads too
+        yield version_plan.as_dict(workers=settings.DISCOVERY_WORKERS)
 
 
 def describe_migration_plan(
-    settings: configuration.Settings, stylist: style.Stylist = style.noop_stylist
+    settings: configuration.Settings,
+    stylist: style.Stylist = style.noop_stylist,
+    last: Optional[int] = None,
+    store: Optional[state.StateStore] = None,
 ) -> None:
-
-    if not db.is_schema_initialized(settings=settings):
+    """
+    With last, only the last versions are shown.
+    With store, the state of the database is read from there (see
+    septentrion.state).
+    """
+    store = state.get_store(settings=settings, store=store)
+    if not store.is_initialized():
         from_version = get_best_schema_version(settings=settings)
         with stylist.activate("title") as echo:
             echo("Schema file version is {}".format(from_version))
     else:
-        _from_version = db.get_current_schema_version(settings=settings)
+        _from_version = store.get_current_version()
         assert _from_version  # mypy shenanigans
         from_version = _from_version
         with stylist.activate("title") as echo:
@@ -204,15 +443,18 @@ def describe_migration_plan(
     with stylist.activate("title") as echo:
         echo(f"Target version is {target_version or 'latest'}")
 
-    for plan in build_migration_plan(settings=settings, from_version=from_version):
-        version = plan["version"]
-        migrations = plan["plan"]
+    if last is not None:
+        hidden = len(get_versions_to_apply(settings, from_version)) - last
+        if hidden > 0:
+            with stylist.activate("title") as echo:
+                echo(f"{hidden} earlier versions not shown")
 
+    for version_plan in iter_migration_plan(
+        settings=settings, from_version=from_version, last=last, store=store
+    ):
         with stylist.activate("title") as echo:
-            echo("Version {}".format(version))
-
-        for migration_elem in migrations:
+            echo("Version {}".format(version_plan.version))
 
-            name, applied, path, is_manual = migration_elem
-            stylist.draw_checkbox(name, checked=applied)
+        for step in version_plan:
+            stylist.draw_checkbox(step.name, checked=step.applied)
             stylist.echo()
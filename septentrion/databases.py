@@ -0,0 +1,339 @@
+"""
+Migrate many databases with the same migration files (see the --databases and
+--dbname-pattern options of the "migrate" command), or many schemas of a
+database (--schemas and --schema-pattern), each with its own migrations table.
+
+The migration files are discovered once, the targets are grouped by their
+current version, and the migration plan of each group is computed once, from
+its first target (see septentrion.plans). The targets are then migrated
+concurrently: each one checks the plan of its group before running it, and
+computes its own if it doesn't match. A failure only stops its own target.
+"""
+import contextlib
+import dataclasses
+import functools
+import logging
+import time
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+)
+
+from septentrion import (
+    configuration,
+    db,
+    exceptions,
+    files,
+    migration,
+    plans,
+    style,
+    utils,
+)
+
+logger = logging.getLogger(__name__)
+
+STATUS_MIGRATED = "migrated"
+STATUS_UP_TO_DATE = "up to date"
+STATUS_FAILED = "failed"
+
+SUMMARY_COLUMNS = ["Status", "From", "To", "Duration"]
+
+# Schemas following the schema of a tenant in its search_path
+SCHEMA_SEARCH_PATH_TAIL = ["public"]
+
+# Return the settings of a target (database or schema), given its name
+Select = Callable[[configuration.Settings, str], configuration.Settings]
+
+
+@dataclasses.dataclass
+class Result:
+    # Name of the database or schema
+    name: str
+    status: str
+    # Versions of the target before and after migrating (None when empty)
+    from_version: Optional[str] = None
+    to_version: Optional[str] = None
+    duration: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def failed(self) -> bool:
+        return self.status == STATUS_FAILED
+
+
+def read_names(file: TextIO) -> List[str]:
+    """
+    Read one database (or schema) name per line. Empty lines and lines starting
+    with "#" are ignored, and so are duplicates.
+    """
+    names = (line.strip() for line in file)
+    return list(dict.fromkeys(name for name in names if name and name[0] != "#"))
+
+
+def select_database(
+    settings: configuration.Settings, name: str
+) -> configuration.Settings:
+    return settings.replace(dbname=name)
+
+
+def select_schema(
+    settings: configuration.Settings, name: str
+) -> configuration.Settings:
+    """
+    The schema is the first one of the search_path of all the sessions (see the
+    Settings.with_session_options): the migrations table, and the objects the
+    migrations don't qualify, are those of the schema. It's followed by
+    SCHEMA_SEARCH_PATH_TAIL, so that the migrations can use the extensions,
+    types and functions installed there.
+    """
+    search_path = ", ".join(
+        '"{}"'.format(schema.replace('"', '""'))
+        for schema in [name] + SCHEMA_SEARCH_PATH_TAIL
+    )
+    return settings.with_session_options(
+        {**settings.SESSION_OPTIONS, "search_path": search_path}
+    )
+
+
+def get_version(settings: configuration.Settings) -> Optional[str]:
+    """
+    Return the current version of the database, or None if it's empty.
+    """
+    if settings.CREATE_TABLE:
+        db.create_table(settings=settings)
+    if not db.is_schema_initialized(settings=settings):
+        return None
+    version = db.get_current_schema_version(settings=settings)
+    return version.original_string if version else None
+
+
+def check_schema(settings: configuration.Settings, name: str) -> None:
+    """
+    Check that the schema selected by the settings (see select_schema) exists:
+    otherwise, the migrations table, and the objects of the migrations, would be
+    read from (or created in) the next schema of the search_path.
+    """
+    if db.get_current_schema(settings=settings) != name:
+        raise exceptions.SeptentrionException(f"Schema {name} does not exist")
+
+
+def _get_version(
+    settings: configuration.Settings,
+    select: Select,
+    connections: Optional[db.ConnectionCache],
+    name: str,
+) -> Tuple[Optional[str], Optional[Exception]]:
+    try:
+        with _using(connections):
+            target_settings = select(settings, name)
+            if select is select_schema:
+                check_schema(settings=target_settings, name=name)
+            return get_version(settings=target_settings), None
+    except Exception as exc:
+        return None, exc
+
+
+def _using(connections: Optional[db.ConnectionCache]) -> ContextManager[None]:
+    if connections is None:
+        return contextlib.nullcontext()
+    return db.use_connection_cache(connections)
+
+
+def group_targets(
+    settings: configuration.Settings,
+    names: Iterable[str],
+    workers: int = 1,
+    select: Select = select_database,
+    connections: Optional[db.ConnectionCache] = None,
+) -> Tuple[Dict[Optional[str], List[str]], List[Result]]:
+    """
+    Group the targets by current version. Return the groups, and the results
+    of the targets whose version could not be read.
+    connections, if given, is used for all the queries (see migrate_targets).
+    """
+    names = list(names)
+    groups: Dict[Optional[str], List[str]] = {}
+    failures = []
+    versions = utils.map_concurrently(
+        functools.partial(_get_version, settings, select, connections),
+        names,
+        workers=workers,
+    )
+    for name, (version, error) in zip(names, versions):
+        if error is not None:
+            logger.error("Cannot read the version of %s: %s", name, error)
+            failures.append(_failure(name=name, error=error))
+            continue
+        groups.setdefault(version, []).append(name)
+    return groups, failures
+
+
+def has_work(plan: Dict[str, Any]) -> bool:
+    """
+    Whether running the plan changes the database.
+    """
+    return bool(plans.get_schema_version(plan)) or any(
+        not migration["applied"]
+        for plan_version in plan["versions"]
+        for migration in plan_version["migrations"]
+    )
+
+
+def migrate_target(
+    settings: configuration.Settings,
+    name: str,
+    plan: Dict[str, Any],
+    select: Select = select_database,
+    connections: Optional[db.ConnectionCache] = None,
+) -> Result:
+    """
+    Run the plan of its group on a target. Exceptions are not raised, but
+    reported in the result.
+    """
+    settings = select(settings, name)
+    from_version = plan["current_version"]
+    start = time.monotonic()
+    try:
+        with _using(connections):
+            try:
+                # The files were just hashed, when computing the plan
+                migration.migrate_plan(settings=settings, plan=plan, check_files=False)
+            except exceptions.OutdatedPlan as exc:
+                # e.g. the migrations of the version are not all applied, like in
+                # the first target of the group
+                logger.info("Plan doesn't match %s (%s), computing its own", name, exc)
+                plan = plans.build_plan(settings=settings)
+                from_version = plan["current_version"]
+                migration.migrate_plan(settings=settings, plan=plan, check_files=False)
+            to_version = get_version(settings=settings)
+    except Exception as exc:
+        logger.error("Error migrating %s: %s", name, exc)
+        return _failure(
+            name=name,
+            error=exc,
+            from_version=from_version,
+            duration=time.monotonic() - start,
+        )
+
+    return Result(
+        name=name,
+        status=STATUS_MIGRATED if has_work(plan) else STATUS_UP_TO_DATE,
+        from_version=from_version,
+        to_version=to_version,
+        duration=time.monotonic() - start,
+    )
+
+
+@contextlib.contextmanager
+def _closing(connections: Optional[db.ConnectionCache]) -> Iterator[None]:
+    try:
+        yield
+    finally:
+        if connections is not None:
+            connections.close()
+
+
+def _failure(name: str, error: Exception, **kwargs: Any) -> Result:
+    return Result(name=name, status=STATUS_FAILED, error=str(error), **kwargs)
+
+
+def migrate_targets(
+    settings: configuration.Settings,
+    names: Iterable[str],
+    workers: int = 1,
+    select: Select = select_database,
+    stylist: style.Stylist = style.noop_stylist,
+) -> List[Result]:
+    """
+    Migrate the targets (databases, or schemas with select_schema), at most
+    workers at a time, and return a result for each of them, in the same order.
+    The schemas of a database share a connection per worker, switching its
+    search_path, and their migrations are run over it rather than by psql
+    (see db.ConnectionCache).
+    """
+    names = list(names)
+    results: Dict[str, Result] = {}
+    connections = None
+    if select is select_schema:
+        connections = db.ConnectionCache(switch_search_path=True, run_scripts=True)
+    with files.frozen_root(settings.MIGRATIONS_ROOT), _closing(connections):
+        with stylist.checkbox(
+            content=f"Reading the version of {len(names)} targets...",
+            content_after=f"Read the version of {len(names)} targets",
+        ):
+            groups, failures = group_targets(
+                settings=settings,
+                names=names,
+                workers=workers,
+                select=select,
+                connections=connections,
+            )
+        results.update((result.name, result) for result in failures)
+
+        jobs: List[Tuple[str, Dict[str, Any]]] = []
+        for version, group in groups.items():
+            logger.info(
+                "Computing the plan of %s targets at version %s", len(group), version
+            )
+            try:
+                with _using(connections):
+                    plan = plans.build_plan(settings=select(settings, group[0]))
+            except Exception as exc:
+                logger.error("Cannot compute the plan of %s: %s", group[0], exc)
+                results.update(
+                    (name, _failure(name=name, error=exc, from_version=version))
+                    for name in group
+                )
+                continue
+            jobs.extend((name, plan) for name in group)
+
+        with stylist.activate("title") as echo:
+            echo(f"Migrating {len(jobs)} targets ({len(groups)} plans)")
+        migrated = utils.map_concurrently(
+            lambda job: migrate_target(
+                settings, *job, select=select, connections=connections
+            ),
+            jobs,
+            workers=workers,
+        )
+        for result in migrated:
+            results[result.name] = result
+            stylist.draw_checkbox(
+                content=f"{result.name}: {result.status}", checked=not result.failed
+            )
+            stylist.echo("")
+
+    return [results[name] for name in names]
+
+
+def format_summary(results: List[Result], kind: str = "Database") -> List[str]:
+    """
+    Return the lines of a table describing the results, followed by the errors.
+    kind is the title of the column of the names.
+    """
+    rows = [[kind] + SUMMARY_COLUMNS] + [
+        [
+            result.name,
+            result.status,
+            result.from_version or "-",
+            result.to_version or "-",
+            f"{result.duration:.1f}s",
+        ]
+        for result in results
+    ]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    rows.insert(1, ["-" * width for width in widths])
+    lines = [
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in rows
+    ]
+    lines.extend(f"{result.name}: {result.error}" for result in results if result.error)
+    return lines
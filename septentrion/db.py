@@ -4,24 +4,40 @@ Interact with the migrations table.
 
 import datetime
 import logging
+import threading
 from contextlib import contextmanager
-from typing import Any, Iterable, Optional, Tuple
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
 import psycopg2
 import psycopg2.errors
+import psycopg2.extensions
 import psycopg2.sql
 from psycopg2.extensions import connection as Connection
 from psycopg2.extras import DictCursor
 
-from septentrion import configuration, versions
+from septentrion import configuration, utils, versions
 
 logger = logging.getLogger(__name__)
 
 
-@contextmanager
-def get_connection(settings: configuration.Settings) -> Connection:
+def get_connection_kwargs(
+    settings: configuration.Settings,
+    session_options: Optional[Dict[str, str]] = None,
+) -> Dict[str, str]:
     """
-    Opens a PostgreSQL connection using psycopg2.
+    Arguments of psycopg2.connect for the settings. session_options replaces
+    settings.SESSION_OPTIONS, if given.
     """
     # Note that psycopg2 is responsible for using environment variables and reading
     # ~/.pgpass for all undefined arguments. Because of this, it's important to exclude
@@ -40,16 +56,138 @@ def get_connection(settings: configuration.Settings) -> Connection:
         value = getattr(settings, name)
         if value:
             kwargs[psycopg_name] = value
+    if session_options is None:
+        session_options = settings.SESSION_OPTIONS
+    if session_options:
+        kwargs["options"] = utils.get_pg_options(session_options)
+    return kwargs
+
 
+def connect(kwargs: Dict[str, str]) -> Connection:
     # We provide an empty DSN that will be overriden by kwargs in psycopg2
     # It allows us to give no arguments to connect and libpq will use its
     # default settings or its own environment variables (PGHOST, PGUSER, ...)
     connection = psycopg2.connect(dsn="", **kwargs)
+    # Autocommit=true means we'll have more control over when the code is commited
+    # (even if this sounds strange)
+    connection.set_session(autocommit=True)
+    return connection
+
+
+class ConnectionCache:
+    """
+    Connections kept open between queries (see use_connection_cache), one per
+    thread and per connection settings: a connection is never used by two
+    threads at the same time.
+    With switch_search_path, the search_path session option is set each time a
+    connection is used, instead of when connecting: the same connections are
+    used for all the schemas of a database.
+    With run_scripts, SQL scripts are run over the connections too, instead of
+    psql, when possible (see runner.Script).
+    """
+
+    def __init__(
+        self, switch_search_path: bool = False, run_scripts: bool = False
+    ) -> None:
+        self.switch_search_path = switch_search_path
+        self.run_scripts = run_scripts
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all: List[Connection] = []
+
+    def get(self, kwargs: Dict[str, str]) -> Connection:
+        connections = self._local.__dict__.setdefault("connections", {})
+        key = tuple(sorted(kwargs.items()))
+        connection = connections.get(key)
+        if connection is None or connection.closed:
+            connection = connections[key] = connect(kwargs)
+            with self._lock:
+                self._all.append(connection)
+        return connection
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._all = self._all, []
+        for connection in connections:
+            connection.close()
+
+
+# Cache used by get_connection in the current thread, if any
+_active_cache = threading.local()
+
+
+def get_connection_cache() -> Optional[ConnectionCache]:
+    """
+    Return the cache used by get_connection in the current thread, if any.
+    """
+    return getattr(_active_cache, "cache", None)
+
+
+@contextmanager
+def use_connection_cache(cache: ConnectionCache) -> Iterator[None]:
+    """
+    Inside the block, get_connection takes its connections from the cache,
+    instead of opening one for each query. Other threads are not affected.
+    """
+    previous = getattr(_active_cache, "cache", None)
+    _active_cache.cache = cache
+    try:
+        yield
+    finally:
+        _active_cache.cache = previous
+
+
+def _set_search_path(connection: Connection, search_path: Optional[str]) -> None:
+    with connection.cursor() as cur:
+        if search_path is None:
+            cur.execute("RESET search_path")
+        else:
+            cur.execute(
+                "SELECT pg_catalog.set_config('search_path', %s, false)",
+                (search_path,),
+            )
+
+
+@contextmanager
+def _get_cached_connection(
+    settings: configuration.Settings, cache: ConnectionCache
+) -> Iterator[Connection]:
+    session_options = dict(settings.SESSION_OPTIONS)
+    search_path = None
+    if cache.switch_search_path:
+        search_path = session_options.pop("search_path", None)
+    connection = cache.get(
+        get_connection_kwargs(settings=settings, session_options=session_options)
+    )
+    if search_path is not None:
+        _set_search_path(connection, search_path)
+    try:
+        yield connection
+    finally:
+        if not connection.closed:
+            if not connection.autocommit:
+                # Left in a transaction by the caller
+                connection.rollback()
+                connection.autocommit = True
+            if search_path is not None:
+                _set_search_path(connection, None)
+
 
+@contextmanager
+def get_connection(settings: configuration.Settings) -> Connection:
+    """
+    Opens a PostgreSQL connection using psycopg2 (or reuses one, see
+    use_connection_cache).
+    """
+    cache = get_connection_cache()
+    if cache is not None:
+        with _get_cached_connection(settings=settings, cache=cache) as connection:
+            yield connection
+        return
+
+    kwargs = get_connection_kwargs(settings=settings)
+    connection = connect(kwargs)
     try:
-        # Autocommit=true means we'll have more control over when the code is commited
-        # (even if this sounds strange)
-        connection.set_session(autocommit=True)
         yield connection
     finally:
         connection.close()
@@ -120,6 +258,15 @@ query_get_applied_migrations = """
     SELECT {name_column} FROM {table} WHERE {version_column} = %s
 """
 
+query_get_applied_migrations_by_version = """
+    SELECT {version_column}, {name_column} FROM {table}
+    WHERE {version_column} = ANY(%s)
+"""
+
+query_get_all_migrations = """
+    SELECT {version_column}, {name_column} FROM {table} ORDER BY id
+"""
+
 query_is_schema_initialized = """
     SELECT TRUE FROM {table} LIMIT 1
 """
@@ -152,6 +299,37 @@ def get_applied_migrations(
         return [row[0] for row in cur]
 
 
+def get_applied_migrations_by_version(
+    settings: configuration.Settings, versions_: Iterable[versions.Version]
+) -> Dict[versions.Version, Set[str]]:
+    """
+    Return the applied migrations of several versions, in a single query.
+    """
+    by_string = {version.original_string: version for version in versions_}
+    applied: Dict[versions.Version, Set[str]] = {
+        version: set() for version in by_string.values()
+    }
+    if not by_string:
+        return applied
+
+    with Query(
+        settings=settings,
+        query=query_get_applied_migrations_by_version,
+        args=(list(by_string),),
+    ) as cur:
+        for version_string, name in cur:
+            applied[by_string[version_string]].add(name)
+    return applied
+
+
+def get_all_migrations(settings: configuration.Settings) -> List[Tuple[str, str]]:
+    """
+    Return the version and name of all the applied migrations, in order.
+    """
+    with Query(settings=settings, query=query_get_all_migrations) as cur:
+        return [(row[0], row[1]) for row in cur]
+
+
 def is_schema_initialized(settings: configuration.Settings) -> bool:
 
     try:
@@ -165,6 +343,277 @@ def is_schema_initialized(settings: configuration.Settings) -> bool:
         return False
 
 
+@contextmanager
+def _execute_admin(
+    settings: configuration.Settings, query: psycopg2.sql.Composable, args: Tuple = ()
+) -> Any:
+    with get_connection(settings=settings) as conn:
+        with conn.cursor() as cur:
+            logger.debug("Executing %s -- Args: %s", query.as_string(conn), args)
+            # Without arguments, % signs in the query are not placeholders
+            cur.execute(query, args or None)
+            yield cur
+
+
+def get_database_comment(
+    settings: configuration.Settings, dbname: str
+) -> Tuple[bool, Optional[str]]:
+    """
+    Return whether the database exists, and its comment.
+    """
+    query = psycopg2.sql.SQL(
+        "SELECT shobj_description(oid, 'pg_database') FROM pg_database "
+        "WHERE datname = %s"
+    )
+    with _execute_admin(settings=settings, query=query, args=(dbname,)) as cur:
+        row = cur.fetchone()
+    if row is None:
+        return False, None
+    return True, row[0]
+
+
+def get_database_names(settings: configuration.Settings, pattern: str) -> List[str]:
+    """
+    Return the names of the databases matching a LIKE pattern, that accept
+    connections.
+    """
+    query = psycopg2.sql.SQL(
+        "SELECT datname FROM pg_database "
+        "WHERE datname LIKE %s AND datallowconn AND NOT datistemplate "
+        "ORDER BY datname"
+    )
+    with _execute_admin(settings=settings, query=query, args=(pattern,)) as cur:
+        return [row[0] for row in cur]
+
+
+def get_current_schema(settings: configuration.Settings) -> Optional[str]:
+    """
+    Return the first schema of the search_path that exists, if any.
+    """
+    query = psycopg2.sql.SQL("SELECT current_schema()")
+    with _execute_admin(settings=settings, query=query) as cur:
+        return cur.fetchone()[0]
+
+
+def can_set_option(settings: configuration.Settings, name: str, value: str) -> bool:
+    """
+    Whether the sessions of the settings may use the given value of a
+    PostgreSQL setting (some, like session_replication_role, require a
+    superuser). Nothing is changed.
+    """
+    with get_connection(settings=settings) as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_catalog.set_config(%s, %s, true)", (name, value))
+        except psycopg2.errors.InsufficientPrivilege:
+            return False
+        finally:
+            conn.rollback()
+    return True
+
+
+def get_schema_names(settings: configuration.Settings, pattern: str) -> List[str]:
+    """
+    Return the names of the schemas of the database matching a LIKE pattern,
+    except the system ones.
+    """
+    query = psycopg2.sql.SQL(
+        "SELECT nspname FROM pg_namespace "
+        "WHERE nspname LIKE %s AND nspname NOT LIKE 'pg\\_%%' "
+        "AND nspname <> 'information_schema' "
+        "ORDER BY nspname"
+    )
+    with _execute_admin(settings=settings, query=query, args=(pattern,)) as cur:
+        return [row[0] for row in cur]
+
+
+def create_database(
+    settings: configuration.Settings, dbname: str, template: Optional[str] = None
+) -> None:
+    query = psycopg2.sql.SQL("CREATE DATABASE {}").format(
+        psycopg2.sql.Identifier(dbname)
+    )
+    if template:
+        query += psycopg2.sql.SQL(" TEMPLATE {}").format(
+            psycopg2.sql.Identifier(template)
+        )
+    with _execute_admin(settings=settings, query=query):
+        pass
+
+
+def drop_database(settings: configuration.Settings, dbname: str) -> None:
+    query = psycopg2.sql.SQL("DROP DATABASE IF EXISTS {}").format(
+        psycopg2.sql.Identifier(dbname)
+    )
+    with _execute_admin(settings=settings, query=query):
+        pass
+
+
+def comment_database(
+    settings: configuration.Settings, dbname: str, comment: str
+) -> None:
+    query = psycopg2.sql.SQL("COMMENT ON DATABASE {} IS {}").format(
+        psycopg2.sql.Identifier(dbname), psycopg2.sql.Literal(comment)
+    )
+    with _execute_admin(settings=settings, query=query):
+        pass
+
+
+def truncate_tables(settings: configuration.Settings) -> None:
+    """
+    Empty all the tables of the database, except the migrations table.
+    """
+    query = psycopg2.sql.SQL(
+        "SELECT schemaname, tablename FROM pg_tables "
+        "WHERE schemaname NOT IN ('pg_catalog', 'information_schema') "
+        "AND NOT (schemaname = current_schema() AND tablename = %s)"
+    )
+    with _execute_admin(settings=settings, query=query, args=(settings.TABLE,)) as cur:
+        tables = [psycopg2.sql.Identifier(schema, table) for schema, table in cur]
+    if not tables:
+        return
+
+    query = psycopg2.sql.SQL("TRUNCATE {} RESTART IDENTITY CASCADE").format(
+        psycopg2.sql.SQL(", ").join(tables)
+    )
+    with _execute_admin(settings=settings, query=query):
+        pass
+
+
+def get_droppable_indexes(
+    settings: configuration.Settings, tables: List[str]
+) -> List[Tuple[str, str]]:
+    """
+    Return the name and the definition of the indexes of tables that don't back
+    a constraint (primary key, unique...).
+    """
+    query = psycopg2.sql.SQL(
+        "SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid) "
+        "FROM pg_index i WHERE i.indrelid = ANY(%s::regclass[]) "
+        "AND NOT EXISTS ("
+        "SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid"
+        ") ORDER BY 1"
+    )
+    with _execute_admin(settings=settings, query=query, args=(tables,)) as cur:
+        return [tuple(row) for row in cur]
+
+
+def get_foreign_keys(
+    settings: configuration.Settings, tables: List[str]
+) -> List[Tuple[str, str, str]]:
+    """
+    Return the table, the name and the definition of the foreign keys from or
+    to tables.
+    """
+    query = psycopg2.sql.SQL(
+        "SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) "
+        "FROM pg_constraint WHERE contype = 'f' "
+        "AND (conrelid = ANY(%s::regclass[]) OR confrelid = ANY(%s::regclass[])) "
+        "ORDER BY 1, 2"
+    )
+    with _execute_admin(settings=settings, query=query, args=(tables, tables)) as cur:
+        return [tuple(row) for row in cur]
+
+
+def drop_index(settings: configuration.Settings, index: str) -> None:
+    # index is a name as output by PostgreSQL (regclass), quoted if needed
+    query = psycopg2.sql.SQL("DROP INDEX {}").format(psycopg2.sql.SQL(index))
+    with _execute_admin(settings=settings, query=query):
+        pass
+
+
+def create_index(settings: configuration.Settings, definition: str) -> None:
+    with _execute_admin(settings=settings, query=psycopg2.sql.SQL(definition)):
+        pass
+
+
+def drop_constraint(settings: configuration.Settings, table: str, name: str) -> None:
+    query = psycopg2.sql.SQL("ALTER TABLE {} DROP CONSTRAINT {}").format(
+        psycopg2.sql.SQL(table), psycopg2.sql.Identifier(name)
+    )
+    with _execute_admin(settings=settings, query=query):
+        pass
+
+
+def add_constraint(
+    settings: configuration.Settings, table: str, name: str, definition: str
+) -> None:
+    query = psycopg2.sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {}").format(
+        psycopg2.sql.SQL(table),
+        psycopg2.sql.Identifier(name),
+        psycopg2.sql.SQL(definition),
+    )
+    with _execute_admin(settings=settings, query=query):
+        pass
+
+
+def copy_from(
+    settings: configuration.Settings, query: psycopg2.sql.Composable, file: IO[bytes]
+) -> int:
+    """
+    Run a COPY ... FROM STDIN query, reading the rows from file, and return the
+    number of rows copied.
+    """
+    with get_connection(settings=settings) as conn:
+        with conn.cursor() as cur:
+            logger.debug("Executing %s", query.as_string(conn))
+            cur.copy_expert(query, file)
+            return cur.rowcount
+
+
+def run_statements(settings: configuration.Settings, statements: List[str]) -> None:
+    """
+    Run SQL statements, in order, in the same session.
+    """
+    with get_connection(settings=settings) as conn:
+        with conn.cursor() as cur:
+            try:
+                for statement in statements:
+                    logger.debug("Executing %s", statement)
+                    cur.execute(statement)
+            finally:
+                # The statements may change settings of the session (SET...),
+                # which may be reused (see use_connection_cache)
+                cur.execute("RESET ALL")
+
+
+def run_script(
+    settings: configuration.Settings,
+    statements: List[str],
+    callback: Callable[[str], None],
+) -> None:
+    """
+    Run the statements of a script one at a time, in autocommit mode like psql
+    does, and call back with the status of each one (e.g. "UPDATE 3"). The
+    session is then discarded as if it was closed, since its connection may be
+    reused (see use_connection_cache).
+    """
+    with get_connection(settings=settings) as conn:
+        try:
+            with conn.cursor() as cur:
+                for statement in statements:
+                    logger.debug("Executing %s", statement)
+                    cur.execute(statement)
+                    callback(cur.statusmessage)
+        finally:
+            if not conn.closed:
+                _discard_session(conn)
+
+
+def _discard_session(connection: Connection) -> None:
+    idle = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    with connection.cursor() as cur:
+        if connection.get_transaction_status() != idle:
+            # A transaction left open (or failed) by the script
+            cur.execute("ROLLBACK")
+        cur.execute("DISCARD ALL")
+
+
+def analyze(settings: configuration.Settings) -> None:
+    with _execute_admin(settings=settings, query=psycopg2.sql.SQL("ANALYZE")):
+        pass
+
+
 def create_table(settings: configuration.Settings) -> None:
     Query(settings=settings, query=query_create_table, commit=True)()
 
@@ -12,3 +12,20 @@ class NoSeptentrionSection(SeptentrionException):
 
 class InvalidVersion(SeptentrionException):
     pass
+
+
+class OutdatedPlan(SeptentrionException):
+    pass
+
+
+class SchemaFilesError(SeptentrionException):
+    """
+    Some of the before/after schema files, run concurrently, failed.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(
+            "Error loading schema files:\n"
+            + "\n".join(f"{path}: {error}" for path, error in errors)
+        )
@@ -2,25 +2,167 @@
 Interact with the migration files.
 """
 
+import contextlib
+import copy
+import dataclasses
+import functools
+import gzip
+import hashlib
+import lzma
+import mmap
+import os
 import pathlib
-from typing import Dict, Iterable, List, Tuple
+from typing import (
+    IO,
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
-from septentrion import configuration, exceptions, utils, versions
+from septentrion import archives, configuration, exceptions, utils, versions
+
+# Migration metadata is declared in the header of the file: the leading block of
+# SQL comments (and blank lines). We never read more than this to find it, so
+# that huge data migrations are not scanned.
+HEADER_MAX_SIZE = 64 * 1024
+
+# Size of the chunks read to compute a file hash
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Number of migration files whose metadata is kept in memory
+METADATA_CACHE_SIZE = 4096
+
+# Schemas and fixtures can also be archives written by pg_dump --format=custom
+# (a file) or --format=directory (a folder holding a table of contents), named
+# after the SQL file they replace: "schema_1.0.dump" for "schema_1.0.sql".
+DUMP_SUFFIX = ".dump"
+DUMP_TOC = "toc.dat"
+
+# Fixtures can also be a folder of COPY files, described by a manifest (see
+# septentrion.fixtures): "fixtures_1.0.copy" for "fixtures_1.0.sql".
+COPY_SUFFIX = ".copy"
+COPY_MANIFEST = "manifest.json"
+
+META_PSQL_PREFIX = "--meta-psql:"
+DIRECTIVE_PREFIX = "--septentrion:"
+
+T = TypeVar("T")
+
+# Read-only view on the contents of a file
+Buffer = Union[bytes, mmap.mmap]
+# Contents of a migration file: a buffer, or a stream for compressed files
+Content = Union[Buffer, IO[bytes]]
+
+
+def _open_zstd(file: Union[pathlib.Path, BinaryIO]) -> IO[bytes]:
+    try:
+        import zstandard
+    except ImportError:
+        raise exceptions.SeptentrionException(
+            "The zstandard package is required to read .zst files "
+            "(install septentrion[zstd])"
+        )
+    return zstandard.open(file, "rb")
+
+
+# Compressed files are decompressed on the fly, when they're read. Decompressors
+# accept either a path or a binary file object.
+COMPRESSIONS: Dict[str, Callable[[Union[pathlib.Path, BinaryIO]], IO[bytes]]] = {
+    ".gz": gzip.open,  # type: ignore
+    ".xz": lzma.open,  # type: ignore
+    ".zst": _open_zstd,
+}
+
+
+def strip_compression_suffix(name: str) -> str:
+    """
+    Return the name of a file once decompressed
+    >>> strip_compression_suffix("schema_1.0.sql.gz")
+    'schema_1.0.sql'
+    """
+    for suffix in COMPRESSIONS:
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def _sorted_entries(root: pathlib.Path) -> List[Any]:
+    """
+    Return the entries of root (objects with a name, and is_dir, is_file and
+    is_symlink methods).
+    """
+    if isinstance(root, archives.ArchivePath):
+        return list(root.iterdir())
+    # os.scandir gets the file type along with the directory listing, so we
+    # don't need an extra stat call per entry (expensive on network filesystems)
+    with os.scandir(root) as entries:
+        return sorted(entries, key=lambda entry: entry.name)
 
 
 def iter_dirs(root: pathlib.Path) -> Iterable[pathlib.Path]:
-    return (d for d in sorted(root.iterdir()) if d.is_dir())
+    return (root / d.name for d in _sorted_entries(root) if d.is_dir())
 
 
 def iter_files(
     root: pathlib.Path, ignore_symlinks: bool = False
 ) -> Iterable[pathlib.Path]:
-    for f in sorted(root.iterdir()):
+    for f in _sorted_entries(root):
         if not f.is_file():
             continue
         if ignore_symlinks and f.is_symlink():
             continue
-        yield f
+        yield root / f.name
+
+
+# Caches of the discovery functions (see frozen_root)
+_discovery_caches: List[Any] = []
+
+
+def _cached_discovery(function: Callable[..., T]) -> Callable[..., T]:
+    """
+    Cache the results of a discovery function (taking the migrations root as
+    first argument) for the life of the process, for roots that don't change
+    (see archives.is_immutable).
+    """
+    cached_function = functools.lru_cache(maxsize=None)(function)
+    _discovery_caches.append(cached_function)
+
+    @functools.wraps(function)
+    def wrapper(root, *args):
+        if archives.is_immutable(root):
+            # Callers get their own copy of the result
+            return copy.copy(cached_function(root, *args))
+        return function(root, *args)
+
+    wrapper.cache_clear = cached_function.cache_clear  # type: ignore
+    return wrapper
+
+
+@contextlib.contextmanager
+def frozen_root(root: pathlib.Path) -> Iterator[None]:
+    """
+    Cache what is discovered in a migrations folder inside the block, as if it
+    was an archive: the files are expected not to change meanwhile (e.g. while
+    migrating many databases with them).
+    """
+    if archives.is_immutable(root):
+        yield
+        return
+
+    with archives.frozen(root):
+        try:
+            yield
+        finally:
+            for cache in _discovery_caches:
+                cache.cache_clear()
 
 
 def get_known_versions(settings: configuration.Settings) -> List[versions.Version]:
@@ -29,9 +171,14 @@ def get_known_versions(settings: configuration.Settings) -> List[versions.Versio
     ordered.
     Ignore symlinks.
     """
+    return _list_versions(settings.MIGRATIONS_ROOT)
+
+
+@_cached_discovery
+def _list_versions(root: pathlib.Path) -> List[versions.Version]:
     # exclude symlinks and some folders (like schemas, fixtures, etc)
     try:
-        folders_names = [str(d.name) for d in iter_dirs(settings.MIGRATIONS_ROOT)]
+        folders_names = [str(d.name) for d in iter_dirs(root)]
     except OSError:
         raise exceptions.SeptentrionException(
             "settings.MIGRATIONS_ROOT is improperly configured."
@@ -44,6 +191,30 @@ def get_known_versions(settings: configuration.Settings) -> List[versions.Versio
     )
 
 
+@dataclasses.dataclass(frozen=True)
+class MigrationMetadata:
+
+    manual: bool = False
+    transactional: bool = True
+    meta: Tuple[str, ...] = ()
+
+
+def iter_header_lines(lines: Iterable[str]) -> Iterable[str]:
+    """
+    Returns the lines of the header block: leading comments and blank lines,
+    up to HEADER_MAX_SIZE characters.
+    """
+    size = 0
+    for line in lines:
+        size += len(line)
+        if size > HEADER_MAX_SIZE:
+            return
+        stripped = line.strip()
+        if stripped and not stripped.startswith("--"):
+            return
+        yield stripped
+
+
 def is_manual_migration(
     migration_path: pathlib.Path, migration_contents: Iterable[str]
 ) -> bool:
@@ -51,36 +222,173 @@ def is_manual_migration(
     if "manual" in migration_path.parts:
         return True
 
-    if not migration_path.suffixes[-2:] == [".dml", ".sql"]:
+    if not _is_dml(migration_path):
         return False
 
-    for line in migration_contents:
-        if "--meta-psql:" in line:
+    for line in iter_header_lines(migration_contents):
+        if line.startswith(META_PSQL_PREFIX):
             return True
 
     return False
 
 
+def _is_dml(migration_path: pathlib.Path) -> bool:
+    name = pathlib.PurePath(strip_compression_suffix(migration_path.name))
+    return name.suffixes[-2:] == [".dml", ".sql"]
+
+
+def parse_migration_metadata(
+    migration_path: pathlib.Path, migration_contents: Iterable[str]
+) -> MigrationMetadata:
+    """
+    Read the metadata declared in the header of a migration:
+    - "--meta-psql:<directive>" lines (see runner.Script)
+    - "--septentrion:manual" marks the migration as manual
+    - "--septentrion:non-transactional" marks the migration as needing to be run
+      outside of a transaction
+    """
+    header = list(iter_header_lines(migration_contents))
+    directives = {
+        line.partition(":")[2].strip()
+        for line in header
+        if line.startswith(DIRECTIVE_PREFIX)
+    }
+    meta = tuple(
+        line.partition(":")[2].strip()
+        for line in header
+        if line.startswith(META_PSQL_PREFIX)
+    )
+    manual = "manual" in directives or is_manual_migration(
+        migration_path=migration_path, migration_contents=header
+    )
+    return MigrationMetadata(
+        manual=manual,
+        transactional="non-transactional" not in directives,
+        meta=meta,
+    )
+
+
+@functools.lru_cache(maxsize=METADATA_CACHE_SIZE)
+def _get_migration_metadata(
+    path: pathlib.Path, mtime_ns: int, size: int
+) -> MigrationMetadata:
+    with open_migration(path) as content:
+        return parse_migration_metadata(
+            migration_path=path, migration_contents=header_lines(content)
+        )
+
+
+def get_migration_metadata(path: pathlib.Path) -> MigrationMetadata:
+    """
+    Return the metadata of a migration. Only the header of the file is read,
+    and the result is cached until the file changes. (--meta-psql directives
+    further in the file are found by runner.Script, as the migration is run.)
+    """
+    stat = path.stat()
+    return _get_migration_metadata(path, stat.st_mtime_ns, stat.st_size)
+
+
 # TODO: remove this function when get_best_schema_version is refactored
 def get_special_files(root: pathlib.Path, folder: str) -> List[str]:
+    """
+    Return the names of the files of a special folder ("schemas", "fixtures"),
+    including the pg_dump archives in directory format.
+    """
+    path = root / folder
     try:
-        return [str(f.name) for f in iter_files(root / folder)]
+        return [str(f.name) for f in iter_files(path)] + [
+            str(d.name) for d in iter_dirs(path) if is_dump(d) or is_copy_folder(d)
+        ]
     except FileNotFoundError:
         return []
 
 
+def get_dump_name(name: str) -> str:
+    """
+    Return the name of the pg_dump archive replacing a SQL file (works with name
+    templates too)
+    >>> get_dump_name("schema_1.0.sql")
+    'schema_1.0.dump'
+    """
+    return os.path.splitext(name)[0] + DUMP_SUFFIX
+
+
+def is_dump(path: pathlib.Path) -> bool:
+    if path.is_dir():
+        return (path / DUMP_TOC).is_file()
+    return path.name.endswith(DUMP_SUFFIX) and path.is_file()
+
+
+def get_copy_name(name: str) -> str:
+    """
+    Return the name of the COPY folder replacing a SQL file (works with name
+    templates too)
+    >>> get_copy_name("fixtures_1.0.sql")
+    'fixtures_1.0.copy'
+    """
+    return os.path.splitext(name)[0] + COPY_SUFFIX
+
+
+def is_copy_folder(path: pathlib.Path) -> bool:
+    return path.is_dir() and (path / COPY_MANIFEST).is_file()
+
+
+def find_special_file(folder: pathlib.Path, name: str) -> pathlib.Path:
+    """
+    Return the path to the file named `name` in folder, or to its compressed
+    version if only the latter exists.
+    """
+    path = folder / name
+    if path.exists():
+        return path
+    for suffix in COMPRESSIONS:
+        compressed_path = folder / (name + suffix)
+        if compressed_path.exists():
+            return compressed_path
+    return path
+
+
+def find_dump(folder: pathlib.Path, name: str) -> Optional[pathlib.Path]:
+    """
+    Return the path to the pg_dump archive replacing the SQL file named `name`
+    in folder, if any.
+    """
+    path = folder / get_dump_name(name)
+    if is_dump(path):
+        return path
+    return None
+
+
+def find_copy_folder(folder: pathlib.Path, name: str) -> Optional[pathlib.Path]:
+    """
+    Return the path to the COPY folder replacing the SQL file named `name` in
+    folder, if any.
+    """
+    path = folder / get_copy_name(name)
+    if is_copy_folder(path):
+        return path
+    return None
+
+
 def get_migrations_files_mapping(
     settings: configuration.Settings, version: versions.Version
 ) -> Dict[str, pathlib.Path]:
     """
     Return an dict containing the list of migrations for
     the given version.
-    Key: name of the migration.
+    Key: name of the migration (without compression suffix).
     Value: path to the migration file.
     """
-    ignore_symlinks = settings.IGNORE_SYMLINKS
+    return _list_migrations(
+        settings.MIGRATIONS_ROOT, version.original_string, settings.IGNORE_SYMLINKS
+    )
+
 
-    version_root = settings.MIGRATIONS_ROOT / version.original_string
+@_cached_discovery
+def _list_migrations(
+    root: pathlib.Path, version_string: str, ignore_symlinks: bool
+) -> Dict[str, pathlib.Path]:
+    version_root = root / version_string
     migrations = {}
 
     # TODO: should be a setting
@@ -101,14 +409,110 @@ def list_migrations_and_paths(
     folder: pathlib.Path, ignore_symlinks: bool
 ) -> Iterable[Tuple[str, pathlib.Path]]:
 
+    seen: Dict[str, pathlib.Path] = {}
     for file in iter_files(root=folder, ignore_symlinks=ignore_symlinks):
-        if not file.suffix == ".sql" or not file.stem[-3:] in ("ddl", "dml"):
+        # A compressed migration has the same name as its decompressed version,
+        # so that compressing a migration doesn't make it look new.
+        name = pathlib.PurePath(strip_compression_suffix(file.name))
+        if not name.suffix == ".sql" or not name.stem[-3:] in ("ddl", "dml"):
             continue
+        if name.name in seen:
+            raise exceptions.SeptentrionException(
+                f"Migration {name.name} is both {seen[name.name].name} and "
+                f"{file.name} in {folder}: keep only one of them"
+            )
+        seen[name.name] = file
 
-        yield file.name, file
+        yield name.name, file
 
 
 def file_lines_generator(path: pathlib.Path):
     with open(path) as f:
         for line in f:
             yield line
+
+
+@contextlib.contextmanager
+def map_file(path: pathlib.Path) -> Iterator[Buffer]:
+    """
+    Give access to the contents of a file through a read-only memory map: the
+    file is read (lazily) by the OS only once, whoever reads the buffer, and
+    nothing is copied in Python memory.
+    """
+    with open(path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            yield b""
+            return
+        with buffer:
+            yield buffer
+
+
+@contextlib.contextmanager
+def open_migration(path: pathlib.Path) -> Iterator[Content]:
+    """
+    Give access to the contents of a migration (or schema, or fixtures) file:
+    a memory map for regular files, a stream for compressed files and files in
+    an archive.
+    """
+    open_compressed = COMPRESSIONS.get(path.suffix)
+    if isinstance(path, archives.ArchivePath):
+        # Archive members are streamed out of the archive
+        with path.open() as member:
+            if open_compressed is None:
+                yield member
+                return
+            with open_compressed(member) as stream:
+                yield stream
+        return
+
+    if open_compressed is None:
+        with map_file(path) as buffer:
+            yield buffer
+        return
+
+    with open_compressed(path) as stream:
+        yield stream
+
+
+def read_text(path: pathlib.Path) -> str:
+    """
+    Return the whole (decompressed) contents of a file, as text.
+    """
+    with open_migration(path) as content:
+        if isinstance(content, (bytes, mmap.mmap)):
+            data = content[:]
+        else:
+            data = content.read()
+    return data.decode("utf-8")
+
+
+def read_header(content: Content) -> bytes:
+    """
+    Return the first bytes of the contents, enough to contain its header.
+    Streams are consumed.
+    """
+    if isinstance(content, (bytes, mmap.mmap)):
+        return content[:HEADER_MAX_SIZE]
+    return content.read(HEADER_MAX_SIZE)
+
+
+def header_lines(content: Content) -> List[str]:
+    """
+    Return the first lines of the contents, enough to contain its header.
+    """
+    header = read_header(content).decode("utf-8", errors="replace")
+    return header.splitlines(keepends=True)
+
+
+def hash_file(path: pathlib.Path) -> str:
+    """
+    Return the SHA-256 of the file (as stored, even if compressed).
+    """
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(functools.partial(f.read, HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,164 @@
+"""
+Fast fixtures: instead of a SQL file, fixtures can be a folder (named like
+"fixtures_1.0.copy") holding one file per table and a manifest describing them:
+
+    {
+        "tables": [
+            {"table": "public.author", "file": "author.csv", "header": true},
+            {"table": "book", "file": "book.bin.gz", "format": "binary"}
+        ]
+    }
+
+Each file is streamed with COPY ... FROM STDIN, several tables at a time over
+separate connections. The indexes and foreign keys of the tables are dropped
+before loading the rows, and created again at the end: building an index or
+checking a foreign key once is much faster than doing it for each row.
+"""
+import contextlib
+import dataclasses
+import functools
+import json
+import logging
+import pathlib
+from typing import IO, Any, Callable, Iterator, List, Optional, Tuple
+
+import psycopg2.sql
+
+from septentrion import configuration, db, exceptions, files, utils
+
+logger = logging.getLogger(__name__)
+
+# Formats of COPY (https://www.postgresql.org/docs/current/sql-copy.html)
+FORMATS = ["csv", "text", "binary"]
+
+
+@dataclasses.dataclass(frozen=True)
+class TableFile:
+    # Name of the table, possibly schema-qualified
+    table: str
+    path: pathlib.Path
+    format: str = "csv"
+    header: bool = False
+    # None means all the columns, in the order of the table
+    columns: Optional[Tuple[str, ...]] = None
+
+
+def read_manifest(path: pathlib.Path) -> List[TableFile]:
+    manifest_path = path / files.COPY_MANIFEST
+    try:
+        with manifest_path.open("rb") as manifest_file:
+            manifest = json.load(manifest_file)
+        table_files = [
+            _parse_table_file(path=path, entry=entry) for entry in manifest["tables"]
+        ]
+    except (ValueError, TypeError, KeyError) as exc:
+        raise exceptions.SeptentrionException(
+            f"Invalid fixtures manifest {manifest_path}: {exc!r}"
+        ) from exc
+
+    tables = [table_file.table for table_file in table_files]
+    if len(set(tables)) != len(tables):
+        raise exceptions.SeptentrionException(
+            f"Invalid fixtures manifest {manifest_path}: a table appears twice"
+        )
+    return table_files
+
+
+def _parse_table_file(path: pathlib.Path, entry: Any) -> TableFile:
+    file_format = entry.get("format", "csv")
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format {file_format!r}")
+    columns = entry.get("columns")
+    return TableFile(
+        table=str(entry["table"]),
+        path=path / str(entry["file"]),
+        format=file_format,
+        header=bool(entry.get("header", False)),
+        columns=tuple(str(column) for column in columns) if columns else None,
+    )
+
+
+def get_copy_query(table_file: TableFile) -> psycopg2.sql.Composed:
+    query = psycopg2.sql.SQL("COPY {}").format(
+        psycopg2.sql.Identifier(*table_file.table.split("."))
+    )
+    if table_file.columns:
+        query += psycopg2.sql.SQL(" ({})").format(
+            psycopg2.sql.SQL(", ").join(
+                psycopg2.sql.Identifier(column) for column in table_file.columns
+            )
+        )
+    options = [psycopg2.sql.SQL(f"FORMAT {table_file.format}")]
+    if table_file.header:
+        options.append(psycopg2.sql.SQL("HEADER"))
+    return query + psycopg2.sql.SQL(" FROM STDIN WITH ({})").format(
+        psycopg2.sql.SQL(", ").join(options)
+    )
+
+
+@contextlib.contextmanager
+def open_table_file(path: pathlib.Path) -> Iterator[IO[bytes]]:
+    """
+    Table files can be compressed, like migration files: they are decompressed
+    on the fly.
+    """
+    open_compressed = files.COMPRESSIONS.get(path.suffix)
+    with path.open("rb") as file:
+        if open_compressed is None:
+            yield file
+            return
+        with open_compressed(file) as stream:
+            yield stream
+
+
+def load_table(settings: configuration.Settings, table_file: TableFile) -> int:
+    logger.info("Loading %s into %s", table_file.path, table_file.table)
+    with open_table_file(table_file.path) as file:
+        return db.copy_from(
+            settings=settings, query=get_copy_query(table_file), file=file
+        )
+
+
+def load_fixtures(
+    settings: configuration.Settings,
+    path: pathlib.Path,
+    progress: Optional[Callable[[str], None]] = None,
+) -> None:
+    """
+    Load a COPY folder, with settings.RESTORE_JOBS parallel connections.
+    """
+    table_files = read_manifest(path)
+    tables = [table_file.table for table_file in table_files]
+    workers = settings.RESTORE_JOBS
+
+    indexes = db.get_droppable_indexes(settings=settings, tables=tables)
+    foreign_keys = db.get_foreign_keys(settings=settings, tables=tables)
+    for table, name, _ in foreign_keys:
+        db.drop_constraint(settings=settings, table=table, name=name)
+    for index, _ in indexes:
+        db.drop_index(settings=settings, index=index)
+
+    try:
+        rows = 0
+        loaded = utils.map_concurrently(
+            functools.partial(load_table, settings), table_files, workers=workers
+        )
+        for count, table_rows in enumerate(loaded, 1):
+            rows += table_rows
+            if progress:
+                progress(f"({count}/{len(table_files)} tables, {rows:,} rows)")
+    finally:
+        # Also when loading failed: the schema is left as it was
+        logger.info("Creating %s indexes", len(indexes))
+        for _ in utils.map_concurrently(
+            functools.partial(db.create_index, settings),
+            [definition for _, definition in indexes],
+            workers=workers,
+        ):
+            pass
+        # Not in parallel: adding foreign keys locks both tables
+        logger.info("Adding %s foreign keys", len(foreign_keys))
+        for table, name, definition in foreign_keys:
+            db.add_constraint(
+                settings=settings, table=table, name=name, definition=definition
+            )
@@ -1,7 +1,18 @@
+import contextlib
 import logging
-from typing import Iterable
-
-from septentrion import core, db, files, migration, style, versions
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from septentrion import (
+    clones,
+    configuration,
+    core,
+    db,
+    files,
+    migration,
+    plans,
+    style,
+    versions,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -53,3 +64,125 @@ def get_known_versions(**settings_kwargs) -> Iterable[str]:
     lib_kwargs = initialize(settings_kwargs)
     known_versions = files.get_known_versions(settings=lib_kwargs["settings"])
     return [version.original_string for version in known_versions]
+
+
+def clone(
+    count: int, prefix: str = "test_", template: Optional[str] = None, **settings_kwargs
+) -> List[str]:
+    """
+    Create count migrated databases (see clones.clone_databases), and return
+    their names. The settings are those of the database to connect to in order
+    to create the others: no migrations table is created there by default.
+    """
+    settings_kwargs.setdefault("create_table", False)
+    lib_kwargs = initialize(settings_kwargs)
+    return clones.clone_databases(
+        count=count, prefix=prefix, template=template, **lib_kwargs
+    )
+
+
+class Migrator:
+    """
+    Migrate a database from a long-lived process (e.g. an application checking
+    its database at startup, or a test suite), without the cost of the
+    functions above on each call: the settings are built once, the migrations
+    table is created once, the connections are kept open (one per thread), and
+    the migration files are discovered once, so they are expected not to change
+    until the migrator is closed.
+
+        with septentrion.Migrator(migrations_root="migrations") as migrator:
+            if migrator.status()["pending"]:
+                migrator.migrate()
+    """
+
+    def __init__(
+        self,
+        settings: Optional[configuration.Settings] = None,
+        quiet: bool = False,
+        **settings_kwargs: Any,
+    ):
+        if settings is None:
+            settings = configuration.Settings(**settings_kwargs)
+        elif settings_kwargs:
+            settings = settings.replace(**settings_kwargs)
+        self.settings = settings
+        self.stylist = style.noop_stylist if quiet else style.stylist
+        self._table_created = False
+        self._connections = db.ConnectionCache()
+        self._exit_stack = contextlib.ExitStack()
+        self._exit_stack.enter_context(files.frozen_root(settings.MIGRATIONS_ROOT))
+
+    def __enter__(self) -> "Migrator":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._exit_stack.close()
+        self._connections.close()
+
+    @contextlib.contextmanager
+    def _session(self) -> Iterator[None]:
+        with db.use_connection_cache(self._connections):
+            if self.settings.CREATE_TABLE and not self._table_created:
+                logger.info("Ensuring migration table exists")
+                db.create_table(settings=self.settings)
+                self._table_created = True
+            yield
+
+    def plan(self) -> Dict[str, Any]:
+        """
+        Compute the migration plan (see plans.build_plan).
+        """
+        with self._session():
+            return plans.build_plan(settings=self.settings)
+
+    def migrate(self, plan: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Migrate the database, or run a plan computed earlier (see plan()).
+        """
+        with self._session():
+            if plan is None:
+                migration.migrate(settings=self.settings, stylist=self.stylist)
+            else:
+                migration.migrate_plan(
+                    settings=self.settings, plan=plan, stylist=self.stylist
+                )
+
+    def fake(self, version: str) -> None:
+        fake_version = versions.Version.from_string(version)
+        with self._session():
+            migration.create_fake_entries(
+                settings=self.settings, version=fake_version, stylist=self.stylist
+            )
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Return the current version of the database (None if it's empty), and
+        the names of the migrations that migrate() would run. The schema loaded
+        in an empty database is not a migration.
+        """
+        with self._session():
+            settings = self.settings
+            current_version = None
+            if db.is_schema_initialized(settings=settings):
+                current_version = db.get_current_schema_version(settings=settings)
+                from_version = current_version
+            else:
+                from_version = core.get_best_schema_version(settings=settings)
+            assert from_version  # mypy shenanigans
+
+            pending: List[str] = []
+            # Only names are needed: no migration file is read
+            for version_plan in core.iter_migration_plan(
+                settings=settings, from_version=from_version, pending_only=True
+            ):
+                if current_version is None and version_plan.version == from_version:
+                    continue
+                pending.extend(step.name for step in version_plan)
+
+        return {
+            "current_version": current_version and current_version.original_string,
+            "pending": pending,
+        }
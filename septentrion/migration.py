@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
-import io
+import functools
+import itertools
 import logging
 import pathlib
 import warnings
-from typing import List
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
 from septentrion import (
     configuration,
@@ -11,7 +12,11 @@ from septentrion import (
     db,
     exceptions,
     files,
+    fixtures,
+    plans,
     runner,
+    sections,
+    snapshots,
     style,
     utils,
     versions,
@@ -19,6 +24,13 @@ from septentrion import (
 
 logger = logging.getLogger(__name__)
 
+# PostgreSQL settings used to initialize a database with fast_init: durability
+# doesn't matter, the database can be created again.
+FAST_INIT_OPTIONS = {"synchronous_commit": "off", "maintenance_work_mem": "1GB"}
+# While loading fixtures, triggers (including foreign key checks) are skipped.
+# This requires a superuser: for other roles, triggers run as usual.
+FAST_INIT_FIXTURES_OPTIONS = {"session_replication_role": "replica"}
+
 
 def migrate(
     settings: configuration.Settings, stylist: style.Stylist = style.noop_stylist
@@ -26,22 +38,129 @@ def migrate(
 
     logger.info("Starting migrations")
 
-    if not db.is_schema_initialized(settings=settings):
+    initialized = db.is_schema_initialized(settings=settings)
+    snapshot_path = None
+    if not initialized:
+        snapshot_path = snapshots.get_snapshot_path(settings=settings)
+    if snapshot_path and snapshot_path.exists():
+        logger.info("Migration table is empty, restoring a snapshot")
+        snapshots.restore_snapshot(
+            settings=settings, path=snapshot_path, stylist=stylist
+        )
+        initialized = True
+        # Nothing new to save
+        snapshot_path = None
+
+    fast_init = settings.FAST_INIT and not initialized
+    migrate_settings = settings
+    if fast_init:
+        logger.info("Initializing the database with fast_init")
+        migrate_settings = get_fast_init_settings(settings=settings)
+
+    if not initialized:
         logger.info("Migration table is empty, loading a schema")
         # schema not inited
         schema_version = core.get_best_schema_version(settings=settings)
-        init_schema(settings=settings, init_version=schema_version, stylist=stylist)
+        init_schema(
+            settings=migrate_settings, init_version=schema_version, stylist=stylist
+        )
         from_version = schema_version
     else:
         _from_version = db.get_current_schema_version(settings=settings)
         assert _from_version  # mypy shenanigans
         from_version = _from_version
 
+    migration_plan = core.build_migration_plan(
+        settings=settings, from_version=from_version
+    )
+    apply_migration_plan(
+        settings=migrate_settings, migration_plan=migration_plan, stylist=stylist
+    )
+
+    if fast_init:
+        analyze(settings=settings, stylist=stylist)
+
+    if snapshot_path:
+        # The database was migrated from scratch: save it for the next time
+        snapshots.save_snapshot(settings=settings, path=snapshot_path, stylist=stylist)
+
+
+def get_fast_init_settings(
+    settings: configuration.Settings, fixtures: bool = False
+) -> configuration.Settings:
+    """
+    Return the settings to use while initializing a database with fast_init
+    (fixtures: while loading fixtures).
+    """
+    options = {**settings.SESSION_OPTIONS, **FAST_INIT_OPTIONS}
+    if fixtures:
+        for name, value in FAST_INIT_FIXTURES_OPTIONS.items():
+            if db.can_set_option(settings=settings, name=name, value=value):
+                options[name] = value
+            else:
+                logger.warning(
+                    "Not allowed to set %s, fixtures are loaded without it", name
+                )
+    return settings.with_session_options(options)
+
+
+def analyze(
+    settings: configuration.Settings, stylist: style.Stylist = style.noop_stylist
+) -> None:
+    """
+    After fast_init: the options only applied to the sessions used to migrate,
+    and statistics are gathered once, now that all the rows are there.
+    """
+    with stylist.checkbox(content="Analyzing...", content_after="Analyzed"):
+        db.analyze(settings=settings)
+
+
+def migrate_plan(
+    settings: configuration.Settings,
+    plan: Dict[str, Any],
+    stylist: style.Stylist = style.noop_stylist,
+    check_files: bool = True,
+) -> None:
+    """
+    Run a plan computed earlier (see plans.build_plan), after checking that
+    neither the database nor the migration files (unless check_files is False)
+    changed since.
+    """
+    logger.info("Starting migrations from a plan")
+
+    migration_plan = plans.check_plan(
+        settings=settings, plan=plan, check_files=check_files
+    )
+    schema_version = plans.get_schema_version(plan)
+    fast_init = settings.FAST_INIT and schema_version is not None
+    migrate_settings = settings
+    if fast_init:
+        migrate_settings = get_fast_init_settings(settings=settings)
+
+    if schema_version:
+        logger.info("Migration table is empty, loading a schema")
+        init_schema(
+            settings=migrate_settings, init_version=schema_version, stylist=stylist
+        )
+
+    apply_migration_plan(
+        settings=migrate_settings, migration_plan=migration_plan, stylist=stylist
+    )
+
+    if fast_init:
+        analyze(settings=settings, stylist=stylist)
+
+
+def apply_migration_plan(
+    settings: configuration.Settings,
+    migration_plan: Iterable[Dict[str, Any]],
+    stylist: style.Stylist = style.noop_stylist,
+) -> None:
     # play migrations
     with stylist.activate("title") as echo:
         echo("Applying migrations")
 
-    for plan in core.build_migration_plan(settings=settings, from_version=from_version):
+    for plan in migration_plan:
         version = plan["version"]
         logger.info("Processing version %s", version)
         with stylist.activate("subtitle") as echo:
@@ -63,19 +182,51 @@ def migrate(
                 with stylist.checkbox(
                     content="Applying {}...".format(title),
                     content_after="Applied {}".format(title),
-                ):
-                    run_script(settings=settings, path=path)
+                ) as progress:
+                    run_script(settings=settings, path=path, progress=progress)
                     logger.info("Saving operation in the database")
                     db.write_migration(settings=settings, version=version, name=mig)
 
 
 def _load_schema_files(settings: configuration.Settings, schema_files: List[str]):
-    for file_name in schema_files:
-        if not file_name:
-            return
-        file_path = settings.MIGRATIONS_ROOT / "schemas" / file_name
-        logger.info("Loading %s", file_path)
-        run_script(settings=settings, path=file_path)
+    # As when they ran one by one, the files after an empty entry are ignored
+    paths = [
+        files.find_special_file(
+            folder=settings.MIGRATIONS_ROOT / "schemas", name=file_name
+        )
+        for file_name in itertools.takewhile(bool, schema_files)
+    ]
+    workers = settings.SCHEMA_FILE_WORKERS
+    if workers <= 1 or len(paths) <= 1:
+        for file_path in paths:
+            logger.info("Loading %s", file_path)
+            run_script(settings=settings, path=file_path)
+        return
+
+    # The files are independent: they all run, and the errors are reported
+    # together, in the order of the files (so are the logs).
+    errors = []
+    results = utils.map_concurrently(
+        functools.partial(_try_run_script, settings), paths, workers=workers
+    )
+    for file_path, error in zip(paths, results):
+        if error is None:
+            logger.info("Loaded %s", file_path)
+        else:
+            logger.error("Error loading %s: %s", file_path, error)
+            errors.append((file_path, error))
+    if errors:
+        raise exceptions.SchemaFilesError(errors)
+
+
+def _try_run_script(
+    settings: configuration.Settings, path: pathlib.Path
+) -> Optional[Exception]:
+    try:
+        run_script(settings=settings, path=path)
+    except Exception as exc:
+        return exc
+    return None
 
 
 def load_fixtures(
@@ -87,20 +238,24 @@ def load_fixtures(
         fixtures_version = core.get_fixtures_version(
             settings=settings, target_version=init_version
         )
-        fixtures_path = (
-            settings.MIGRATIONS_ROOT
-            / "fixtures"
-            / settings.FIXTURES_TEMPLATE.format(fixtures_version.original_string)
-        )
-
+        fixtures_settings = settings
+        if settings.FAST_INIT:
+            fixtures_settings = get_fast_init_settings(settings=settings, fixtures=True)
         with stylist.activate("title") as echo:
             echo("Loading fixtures")
-        logger.info("Applying fixture %s (file %s)", fixtures_version, fixtures_path)
+        logger.info("Applying fixture %s", fixtures_version)
         with stylist.checkbox(
             content="Applying fixtures {}...".format(fixtures_version),
             content_after="Applied fixtures {}".format(fixtures_version),
-        ):
-            run_script(settings=settings, path=fixtures_path)
+        ) as progress:
+            run_special_file(
+                settings=fixtures_settings,
+                folder=settings.MIGRATIONS_ROOT / "fixtures",
+                name=settings.FIXTURES_TEMPLATE.format(
+                    fixtures_version.original_string
+                ),
+                progress=progress,
+            )
     except exceptions.SeptentrionException as exception:
         logger.info("Not applying fixtures: %s", exception)
 
@@ -129,20 +284,16 @@ def init_schema(
     with stylist.activate("title") as echo:
         echo("Loading schema")
 
-    schema_path = (
-        settings.MIGRATIONS_ROOT
-        / "schemas"
-        / settings.SCHEMA_TEMPLATE.format(init_version.original_string)
-    )
-
-    logger.info("Loading %s", schema_path)
-
     with stylist.checkbox(
         content="Applying {}...".format(init_version),
         content_after="Applied {}".format(init_version),
-    ):
-
-        run_script(settings=settings, path=schema_path)
+    ) as progress:
+        build_post_data = load_schema(
+            settings=settings,
+            folder=settings.MIGRATIONS_ROOT / "schemas",
+            name=settings.SCHEMA_TEMPLATE.format(init_version.original_string),
+            progress=progress,
+        )
 
     create_fake_entries(settings=settings, version=init_version)
 
@@ -154,6 +305,53 @@ def init_schema(
     # load fixtures
     load_fixtures(settings, init_version, stylist)
 
+    if build_post_data:
+        with stylist.checkbox(
+            content="Building indexes and constraints...",
+            content_after="Built indexes and constraints",
+        ) as progress:
+            build_post_data(progress)
+
+
+def load_schema(
+    settings: configuration.Settings,
+    folder: pathlib.Path,
+    name: str,
+    progress: Optional[Callable[[str], None]] = None,
+) -> Optional[Callable[[Optional[Callable[[str], None]]], None]]:
+    """
+    Load a schema (see run_special_file). With settings.DEFER_POST_DATA, only
+    its pre-data section is loaded, and a function building the post-data
+    section (indexes, constraints...) is returned, to be called once the
+    fixtures are loaded.
+    """
+    if not settings.DEFER_POST_DATA:
+        run_special_file(settings=settings, folder=folder, name=name, progress=progress)
+        return None
+
+    dump_path = files.find_dump(folder=folder, name=name)
+    if dump_path:
+        logger.info("Restoring %s (pre-data and data)", dump_path)
+        runner.restore_dump(
+            settings=settings, path=dump_path, sections=["pre-data", "data"]
+        )
+        return lambda progress: runner.restore_dump(
+            settings=settings, path=dump_path, sections=["post-data"]
+        )
+
+    path = files.find_special_file(folder=folder, name=name)
+    logger.info("Loading %s (pre-data)", path)
+    pre_data, post_data = sections.split_schema(files.read_text(path))
+    logger.info("Deferring %s post-data statements", len(post_data))
+    script = runner.Script(
+        settings=settings,
+        file_handler=pre_data.encode("utf-8"),
+        path=path,
+        progress=progress,
+    )
+    script.run()
+    return functools.partial(sections.build_post_data, settings, post_data)
+
 
 def create_fake_entries(
     settings: configuration.Settings,
@@ -190,8 +388,41 @@ def create_fake_entries(
                 )
 
 
-def run_script(settings: configuration.Settings, path: pathlib.Path) -> None:
+def run_special_file(
+    settings: configuration.Settings,
+    folder: pathlib.Path,
+    name: str,
+    progress: Optional[Callable[[str], None]] = None,
+) -> None:
+    """
+    Run the SQL file of a special folder (schemas, fixtures), or load the
+    pg_dump archive or the COPY folder replacing it, if any.
+    """
+    dump_path = files.find_dump(folder=folder, name=name)
+    if dump_path:
+        logger.info("Restoring %s", dump_path)
+        runner.restore_dump(settings=settings, path=dump_path)
+        return
+
+    copy_path = files.find_copy_folder(folder=folder, name=name)
+    if copy_path:
+        logger.info("Copying %s", copy_path)
+        fixtures.load_fixtures(settings=settings, path=copy_path, progress=progress)
+        return
+
+    path = files.find_special_file(folder=folder, name=name)
+    logger.info("Loading %s", path)
+    run_script(settings=settings, path=path, progress=progress)
+
+
+def run_script(
+    settings: configuration.Settings,
+    path: pathlib.Path,
+    progress: Optional[Callable[[str], None]] = None,
+) -> None:
     logger.info("Running SQL file %s", path)
-    with io.open(path, "r", encoding="utf8") as f:
-        script = runner.Script(settings=settings, file_handler=f, path=path)
+    with files.open_migration(path) as content:
+        script = runner.Script(
+            settings=settings, file_handler=content, path=path, progress=progress
+        )
         script.run()
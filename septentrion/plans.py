@@ -0,0 +1,188 @@
+"""
+Save a migration plan to a file, and load it back to run it later (see the
+"plan" command and "migrate --plan"). Running a saved plan skips the discovery
+of the migration files: we only check that the database and the files to run
+didn't change since the plan was computed.
+"""
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, TextIO
+
+from septentrion import configuration, core, db, exceptions, files, state, versions
+
+logger = logging.getLogger(__name__)
+
+PLAN_FORMAT = 1
+
+
+def _version_string(version: Optional[versions.Version]) -> Optional[str]:
+    return version.original_string if version else None
+
+
+def _version(version_string: Optional[str]) -> Optional[versions.Version]:
+    return versions.Version.from_string(version_string) if version_string else None
+
+
+def build_plan(
+    settings: configuration.Settings, store: Optional[state.StateStore] = None
+) -> Dict[str, Any]:
+    """
+    Compute the migration plan, in a form that can be saved as JSON.
+    With store, the state of the database is read from there (see
+    septentrion.state).
+    """
+    store = state.get_store(settings=settings, store=store)
+    schema_version = None
+    if not store.is_initialized():
+        current_version = None
+        from_version = schema_version = core.get_best_schema_version(settings=settings)
+    else:
+        current_version = store.get_current_version()
+        assert current_version  # mypy shenanigans
+        from_version = current_version
+
+    root = settings.MIGRATIONS_ROOT
+    plan_versions = []
+    for plan in core.build_migration_plan(
+        settings=settings, from_version=from_version, store=store
+    ):
+        version = plan["version"]
+        migrations = []
+        for name, applied, path, is_manual in plan["plan"]:
+            # Migrations of the schema version will be faked when loading it
+            applied = applied or version == schema_version
+            migrations.append(
+                {
+                    "name": name,
+                    "path": path.relative_to(root).as_posix(),
+                    "applied": applied,
+                    "manual": is_manual,
+                    "sha256": None if applied else files.hash_file(path),
+                }
+            )
+        plan_versions.append(
+            {"version": version.original_string, "migrations": migrations}
+        )
+
+    return {
+        "format": PLAN_FORMAT,
+        "schema_version": _version_string(schema_version),
+        "current_version": _version_string(current_version),
+        "target_version": _version_string(settings.TARGET_VERSION),
+        "versions": plan_versions,
+    }
+
+
+def write_plan(plan: Dict[str, Any], file: TextIO) -> None:
+    json.dump(plan, file, separators=(",", ":"))
+    file.write("\n")
+
+
+def read_plan(file: TextIO) -> Dict[str, Any]:
+    try:
+        plan = json.load(file)
+    except ValueError as exc:
+        raise exceptions.SeptentrionException(f"Invalid plan file: {exc}") from exc
+    if not isinstance(plan, dict) or plan.get("format") != PLAN_FORMAT:
+        raise exceptions.SeptentrionException(
+            f"Invalid plan file: expected format {PLAN_FORMAT}"
+        )
+    return plan
+
+
+def get_schema_version(plan: Dict[str, Any]) -> Optional[versions.Version]:
+    """
+    Return the version of the schema to load before running the plan, if the
+    database was empty when the plan was computed.
+    """
+    return _version(plan["schema_version"])
+
+
+def check_plan(
+    settings: configuration.Settings, plan: Dict[str, Any], check_files: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    Check that the plan can still be applied, and return it in the same form
+    as core.build_migration_plan.
+    Raise exceptions.OutdatedPlan otherwise.
+    With check_files=False, the migration files are trusted to be those the
+    plan was computed from (e.g. the plan was just computed).
+    """
+    check_database_state(settings=settings, plan=plan)
+
+    root = settings.MIGRATIONS_ROOT
+    migration_plan = []
+    for plan_version in plan["versions"]:
+        version = versions.Version.from_string(plan_version["version"])
+        version_plan = []
+        for migration in plan_version["migrations"]:
+            path = root / migration["path"]
+            if check_files and not migration["applied"]:
+                check_file_hash(path=path, expected=migration["sha256"])
+            version_plan.append(
+                (migration["name"], migration["applied"], path, migration["manual"])
+            )
+        migration_plan.append({"version": version, "plan": version_plan})
+
+    return migration_plan
+
+
+def check_database_state(
+    settings: configuration.Settings, plan: Dict[str, Any]
+) -> None:
+    initialized = db.is_schema_initialized(settings=settings)
+    if get_schema_version(plan):
+        if initialized:
+            raise exceptions.OutdatedPlan(
+                "The plan expects an empty database, but migrations were applied"
+            )
+        return
+
+    if not initialized:
+        raise exceptions.OutdatedPlan(
+            "The plan expects migrations to be applied, but the database is empty"
+        )
+
+    current_version = db.get_current_schema_version(settings=settings)
+    if current_version != _version(plan["current_version"]):
+        raise exceptions.OutdatedPlan(
+            f"The plan expects the database to be at version "
+            f"{plan['current_version']}, but it's at version {current_version}"
+        )
+
+    plan_versions = [
+        (versions.Version.from_string(plan_version["version"]), plan_version)
+        for plan_version in plan["versions"]
+    ]
+    applied_by_version = db.get_applied_migrations_by_version(
+        settings=settings, versions_=[version for version, _ in plan_versions]
+    )
+    for version, plan_version in plan_versions:
+        check_applied_migrations(
+            migrations=plan_version["migrations"],
+            applied_migrations=applied_by_version[version],
+        )
+
+
+def check_applied_migrations(
+    migrations: Iterable[Dict[str, Any]], applied_migrations: Iterable[str]
+) -> None:
+    for migration in migrations:
+        applied = migration["name"] in applied_migrations
+        if applied != migration["applied"]:
+            raise exceptions.OutdatedPlan(
+                "Migration {} is {}applied, contrary to what the plan expects".format(
+                    migration["name"], "" if applied else "not "
+                )
+            )
+
+
+def check_file_hash(path: Any, expected: str) -> None:
+    try:
+        actual = files.hash_file(path)
+    except FileNotFoundError:
+        raise exceptions.OutdatedPlan(f"Migration file {path} doesn't exist anymore")
+    if actual != expected:
+        raise exceptions.OutdatedPlan(
+            f"Migration file {path} changed since the plan was computed"
+        )
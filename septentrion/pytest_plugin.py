@@ -0,0 +1,259 @@
+"""
+pytest plugin providing migrated databases to tests. The migrations are run
+once, in a template database (see septentrion.clones), and each test session
+(or each pytest-xdist worker) gets its own copy of it.
+
+The plugin is not loaded automatically: enable it with
+"-p septentrion.pytest_plugin", or in a conftest.py:
+
+    pytest_plugins = ["septentrion.pytest_plugin"]
+
+Settings are given by overriding the septentrion_settings_kwargs fixture, with
+the same arguments as septentrion.migrate (except dbname, see the
+--septentrion-dbname option):
+
+    @pytest.fixture(scope="session")
+    def septentrion_settings_kwargs():
+        return {"migrations_root": "migrations"}
+
+    def test_something(septentrion_db):
+        with septentrion.db.get_connection(settings=septentrion_db) as connection:
+            ...
+"""
+import contextlib
+import dataclasses
+import os
+import time
+from typing import Any, Dict, Iterator, Optional
+
+import pytest
+
+from septentrion import clones, configuration, db, snapshots
+
+# How the database of septentrion_db is cleaned between tests
+RESET_CLONE = "clone"
+RESET_TRUNCATE = "truncate"
+RESET_NONE = "none"
+
+# Where the duration of the last migration of the template is kept, to estimate
+# the time saved when the template is reused
+CACHE_KEY = "septentrion/migration_duration"
+
+
+def pytest_addoption(parser: Any) -> None:
+    group = parser.getgroup("septentrion", "migrated databases")
+    group.addoption(
+        "--septentrion-dbname",
+        default="postgres",
+        help="Database to connect to in order to create the test databases",
+    )
+    group.addoption(
+        "--septentrion-prefix",
+        default="test_",
+        help="Prefix of the names of the test databases",
+    )
+    group.addoption(
+        "--septentrion-reset",
+        choices=[RESET_CLONE, RESET_TRUNCATE, RESET_NONE],
+        default=RESET_CLONE,
+        help="How the septentrion_db database is cleaned between tests: copied "
+        "again from the template, or its tables truncated",
+    )
+
+
+def pytest_configure(config: Any) -> None:
+    config.pluginmanager.register(Session(config), "septentrion_session")
+
+
+@dataclasses.dataclass
+class Stats:
+    # Time spent checking and migrating the template
+    template_duration: float = 0.0
+    # Time spent migrating the template, if it was migrated
+    migration_duration: Optional[float] = None
+    # Databases copied from the template, and time spent doing it
+    clones: int = 0
+    clone_duration: float = 0.0
+
+    def add(self, other: "Stats") -> None:
+        self.template_duration += other.template_duration
+        if other.migration_duration is not None:
+            self.migration_duration = max(
+                self.migration_duration or 0.0, other.migration_duration
+            )
+        self.clones += other.clones
+        self.clone_duration += other.clone_duration
+
+
+@contextlib.contextmanager
+def _lock(path: Any) -> Iterator[None]:
+    """
+    Only one pytest-xdist worker at a time prepares the template.
+    """
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        yield
+        return
+
+    with open(path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@pytest.fixture(scope="session")
+def septentrion_settings_kwargs() -> Dict[str, Any]:
+    """
+    Override this fixture to configure septentrion.
+    """
+    return {}
+
+
+class Session:
+    def __init__(self, config: Any):
+        self.config = config
+        self.stats = Stats()
+        self.dirty = False
+
+    def _option(self, name: str) -> Any:
+        return self.config.getoption(f"septentrion_{name}")
+
+    @pytest.fixture(scope="session")
+    def septentrion_settings(
+        self, septentrion_settings_kwargs: Dict[str, Any]
+    ) -> configuration.Settings:
+        """
+        Settings of the database used to create the test databases.
+        """
+        return configuration.Settings(
+            **{
+                "create_table": False,
+                **septentrion_settings_kwargs,
+                "dbname": self._option("dbname"),
+            }
+        )
+
+    @pytest.fixture(scope="session")
+    def septentrion_template(
+        self, septentrion_settings: configuration.Settings, tmp_path_factory: Any
+    ) -> str:
+        """
+        Name of the migrated template database.
+        """
+        template = clones.get_template_name(prefix=self._option("prefix"))
+        lock_path = tmp_path_factory.getbasetemp().parent / "septentrion.lock"
+        start = time.monotonic()
+        with _lock(lock_path):
+            key = snapshots.get_repository_key(settings=septentrion_settings)
+            if not clones.is_template_up_to_date(
+                settings=septentrion_settings, template=template, key=key
+            ):
+                clones.prepare_template(
+                    settings=septentrion_settings, template=template
+                )
+                self.stats.migration_duration = time.monotonic() - start
+                self.config.cache.set(CACHE_KEY, self.stats.migration_duration)
+        self.stats.template_duration += time.monotonic() - start
+        return template
+
+    def _clone(
+        self, settings: configuration.Settings, template: str, name: str
+    ) -> None:
+        start = time.monotonic()
+        db.drop_database(settings=settings, dbname=name)
+        db.create_database(settings=settings, dbname=name, template=template)
+        self.stats.clones += 1
+        self.stats.clone_duration += time.monotonic() - start
+
+    @pytest.fixture(scope="session")
+    def septentrion_session_db(
+        self, septentrion_settings: configuration.Settings, septentrion_template: str
+    ) -> Iterator[configuration.Settings]:
+        """
+        Settings of a migrated database, shared by the tests of the session (or
+        of the pytest-xdist worker).
+        """
+        worker = os.environ.get("PYTEST_XDIST_WORKER", "main")
+        name = "{}{}".format(self._option("prefix"), worker)
+        self._clone(septentrion_settings, septentrion_template, name)
+        yield septentrion_settings.replace(dbname=name, create_table=True)
+        db.drop_database(settings=septentrion_settings, dbname=name)
+
+    @pytest.fixture
+    def septentrion_db(
+        self,
+        septentrion_settings: configuration.Settings,
+        septentrion_template: str,
+        septentrion_session_db: configuration.Settings,
+    ) -> Iterator[configuration.Settings]:
+        """
+        Settings of a migrated database, clean at the beginning of the test.
+        """
+        reset = self._option("reset")
+        if self.dirty and reset == RESET_CLONE:
+            self._clone(
+                septentrion_settings,
+                septentrion_template,
+                septentrion_session_db.DBNAME,
+            )
+        elif self.dirty and reset == RESET_TRUNCATE:
+            db.truncate_tables(settings=septentrion_session_db)
+        self.dirty = False
+        yield septentrion_session_db
+        self.dirty = True
+
+    @pytest.fixture
+    def septentrion_connection(
+        self, septentrion_session_db: configuration.Settings
+    ) -> Iterator[Any]:
+        """
+        A connection to a migrated database, in a transaction that is rolled
+        back at the end of the test.
+        """
+        with db.get_connection(settings=septentrion_session_db) as connection:
+            connection.autocommit = False
+            try:
+                yield connection
+            finally:
+                connection.rollback()
+
+    def pytest_sessionfinish(self) -> None:
+        workeroutput = getattr(self.config, "workeroutput", None)
+        if workeroutput is not None:
+            # pytest-xdist worker: the controller reports for everyone
+            workeroutput["septentrion"] = dataclasses.asdict(self.stats)
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node: Any, error: Any) -> None:
+        stats = getattr(node, "workeroutput", {}).get("septentrion")
+        if stats:
+            self.stats.add(Stats(**stats))
+
+    def pytest_terminal_summary(self, terminalreporter: Any) -> None:
+        stats = self.stats
+        if not stats.template_duration and not stats.clones:
+            return
+
+        if stats.migration_duration is not None:
+            template = f"template migrated in {stats.migration_duration:.1f}s"
+        else:
+            template = f"template reused (checked in {stats.template_duration:.1f}s)"
+        line = (
+            f"septentrion: {template}, {stats.clones} database(s) copied in "
+            f"{stats.clone_duration:.1f}s"
+        )
+
+        migration_duration = stats.migration_duration
+        if migration_duration is None:
+            migration_duration = self.config.cache.get(CACHE_KEY, None)
+        if migration_duration is not None:
+            # Without the plugin, each database would have been migrated
+            without = migration_duration * stats.clones
+            with_plugin = stats.template_duration + stats.clone_duration
+            line += f", ~{max(without - with_plugin, 0.0):.1f}s of setup saved"
+
+        terminalreporter.write_sep("-", "septentrion")
+        terminalreporter.write_line(line)
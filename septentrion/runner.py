@@ -1,13 +1,37 @@
+import collections
+import contextlib
+import dataclasses
+import functools
+import io
 import logging
+import mmap
 import os
 import pathlib
 import subprocess
-from typing import Iterable
+import threading
+import time
+from typing import IO, Callable, Deque, Dict, Iterable, List, Optional, Union
 
-from septentrion import configuration
+import psycopg2
+
+from septentrion import archives, configuration, db, files, sections, utils
 
 logger = logging.getLogger(__name__)
 
+# Write operations reported by psql (see Script.run)
+KEYWORDS = ["INSERT", "UPDATE", "DELETE"]
+# Number of lines of psql error output kept to report an error
+ERROR_TAIL_SIZE = 100
+# Minimum delay between two progress reports, in seconds
+PROGRESS_INTERVAL = 0.5
+# Size of the chunks sent to psql
+CHUNK_SIZE = 1024 * 1024
+# Size above which a script is run by psql, even when it could be run over the
+# cached connections (see Script._get_statements)
+IN_PROCESS_MAX_SIZE = 1024 * 1024
+# Marker of the --meta-psql directives, searched in scripts as they're run
+META_PSQL_MARKER = files.META_PSQL_PREFIX.encode("utf-8")
+
 
 class SQLRunnerException(Exception):
     pass
@@ -17,37 +41,122 @@ class Script:
     def __init__(
         self,
         settings: configuration.Settings,
-        file_handler: Iterable[str],
+        file_handler: Union[files.Content, Iterable[str]],
         path: pathlib.Path,
+        progress: Optional[Callable[[str], None]] = None,
     ):
+        """
+        file_handler is the contents of the script, ideally as a buffer
+        (see files.open_migration) that will be streamed as-is to psql. It can
+        also be a binary stream (e.g. a decompressed file), which is read as the
+        script is run. An iterable of lines (e.g. a file opened in text mode) is
+        also accepted.
+        progress, if given, is regularly called with a description of how far
+        the script went (see style.Stylist.checkbox).
+        """
         self.settings = settings
-        self.file_lines = list(file_handler)
+        self.progress = progress
+        self.content: files.Buffer = b""
+        self.stream: Optional[IO[bytes]] = None
+        # Whether a --meta-psql directive was seen in the stream as it was sent
+        self.stream_has_meta_directives = False
+        self._stream_tail = b""
+        if isinstance(file_handler, (bytes, mmap.mmap)):
+            self.content = file_handler
+        elif hasattr(file_handler, "read") and not isinstance(
+            file_handler, io.TextIOBase
+        ):
+            self.stream = file_handler  # type: ignore
+        else:
+            self.content = "".join(file_handler).encode("utf-8")  # type: ignore
         self.path = path
 
     def run(self):
-        if any("--meta-psql:" in line for line in self.file_lines):
-            self._run_with_meta_loop()
-        else:
-            self._run_simple()
+        run_once = self._run_simple
+        statements = self._get_statements()
+        if statements is not None:
+            run_once = functools.partial(self._run_statements, statements)
+        with contextlib.ExitStack() as stack:
+            # Scripts with --meta-psql directives are run until all the write
+            # operations return 0 rows
+            while run_once().rows_remaining and self._has_meta_directives():
+                self._reopen(stack)
+
+    def _get_statements(self) -> Optional[List[str]]:
+        """
+        Return the statements of the script if it can be run over the cached
+        connections (see db.ConnectionCache), instead of psql: when they're
+        asked to, for small scripts without psql meta-commands.
+        """
+        cache = db.get_connection_cache()
+        if cache is None or not cache.run_scripts or self.stream is not None:
+            return None
+        if len(self.content) > IN_PROCESS_MAX_SIZE:
+            return None
+        return sections.split_statements(self.content[:].decode("utf-8"))
+
+    def _run_statements(self, statements: List[str]) -> "Output":
+        output = Output()
+        try:
+            db.run_script(
+                settings=self.settings,
+                statements=statements,
+                callback=lambda status: self._process_line(output, status + "\n"),
+            )
+        except psycopg2.Error as exc:
+            raise SQLRunnerException(f"Error during migration: {exc}") from exc
+        return output
+
+    def _has_meta_directives(self) -> bool:
+        """
+        Whether the whole (decompressed) script contains --meta-psql directives,
+        anywhere, like the header of its migration doesn't need to. Streams are
+        searched as they're sent (see _scan), so this is only known once the
+        script has run.
+        """
+        if self.stream is not None:
+            return self.stream_has_meta_directives
+        return self.content.find(META_PSQL_MARKER) != -1
+
+    def _scan(self, chunk: bytes) -> None:
+        """
+        Search a chunk of the stream for --meta-psql directives, without
+        keeping the stream: it's decompressed only once per run.
+        """
+        if self.stream_has_meta_directives:
+            return
+        found = (self._stream_tail + chunk).find(META_PSQL_MARKER) != -1
+        self.stream_has_meta_directives = found
+        # A directive can be split between two chunks
+        overlap = len(META_PSQL_MARKER) - 1
+        self._stream_tail = chunk[-overlap:]
+
+    def _reopen(self, stack: contextlib.ExitStack) -> None:
+        """
+        Streams can only be read once: to run the script again, its file is
+        opened again (and the previous copy, if it was opened here, closed).
+        """
+        if self.stream is None:
+            return
+        stack.close()
+        self._stream_tail = b""
+        content = stack.enter_context(files.open_migration(self.path))
+        # Compressed, or in an archive: it's a stream again
+        self.stream = content  # type: ignore
 
     def _env(self):
-        environment = {
-            "PGHOST": self.settings.HOST,
-            "PGPORT": self.settings.PORT,
-            "PGDATABASE": self.settings.DBNAME,
-            "PGUSER": self.settings.USERNAME,
-            "PGPASSWORD": self.settings.PASSWORD,
-        }
-        return {key: str(value) for key, value in environment.items() if value}
+        return get_environment(settings=self.settings)
 
-    def _run_simple(self):
+    def _run_simple(self) -> "Output":
 
         try:
-            cmd = subprocess.run(
-                ["psql", "--set", "ON_ERROR_STOP=on", "-f", str(self.path)],
+            # The script is sent through psql's standard input, directly from
+            # the buffer, so that the file is not read a second time.
+            process = subprocess.Popen(
+                ["psql", "--set", "ON_ERROR_STOP=on", "-f", "-"],
+                stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                check=True,
                 # environment has precedence over os.environ
                 env={**os.environ, **self._env()},
             )
@@ -56,26 +165,155 @@ class Script:
                 "Septentrion requires the 'psql' executable to be present in "
                 "the PATH."
             )
-        except subprocess.CalledProcessError as e:
-            msg = "Error during migration: {}".format(e.stderr.decode("utf-8"))
-            raise SQLRunnerException(msg) from e
 
-        return cmd.stdout.decode("utf-8")
+        # psql output is consumed as it comes: we only keep counters and the
+        # last lines of the error output, however big the script is.
+        errors: Deque[str] = collections.deque(maxlen=ERROR_TAIL_SIZE)
+        # All three are pipes (mypy shenanigans)
+        assert process.stdin is not None
+        assert process.stdout is not None
+        assert process.stderr is not None
+        with process:
+            threads = [
+                threading.Thread(target=self._write_input, args=(process.stdin,)),
+                threading.Thread(
+                    target=_read_lines, args=(process.stderr, errors.append)
+                ),
+            ]
+            for thread in threads:
+                thread.start()
+            output = Output()
+            _read_lines(process.stdout, functools.partial(self._process_line, output))
+            for thread in threads:
+                thread.join()
+            returncode = process.wait()
+
+        if returncode:
+            msg = "Error during migration: {}".format("".join(errors))
+            raise SQLRunnerException(msg) from subprocess.CalledProcessError(
+                returncode=returncode, cmd=process.args
+            )
+
+        return output
+
+    def _write_input(self, stdin: IO[bytes]) -> None:
+        try:
+            with stdin:
+                with memoryview(self.content) as view:
+                    for start in range(0, len(view), CHUNK_SIZE):
+                        end = start + CHUNK_SIZE
+                        stdin.write(view[start:end])
+                while self.stream is not None:
+                    chunk = self.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self._scan(chunk)
+                    stdin.write(chunk)
+        except BrokenPipeError:
+            # psql stopped reading (probably because of an error), we'll know
+            # why from its error output.
+            pass
+
+    def _process_line(self, output: "Output", line: str) -> None:
+        logger.debug("psql: %s", line.rstrip("\n"))
+        output.lines += 1
+        output.rows_remaining = output.rows_remaining or any(
+            keyword in line and keyword + " 0" not in line for keyword in KEYWORDS
+        )
+
+        now = time.monotonic()
+        if self.progress and now - output.last_progress >= PROGRESS_INTERVAL:
+            output.last_progress = now
+            self.progress("({:,} lines of output)".format(output.lines))
+
+
+def get_environment(settings: configuration.Settings) -> Dict[str, str]:
+    """
+    Connection settings, for the PostgreSQL client programs
+    """
+    environment = {
+        "PGHOST": settings.HOST,
+        "PGPORT": settings.PORT,
+        "PGDATABASE": settings.DBNAME,
+        "PGUSER": settings.USERNAME,
+        "PGPASSWORD": settings.PASSWORD,
+        "PGOPTIONS": utils.get_pg_options(settings.SESSION_OPTIONS),
+    }
+    return {key: str(value) for key, value in environment.items() if value}
+
+
+def run_command(settings: configuration.Settings, args: List[str]) -> None:
+    """
+    Run a PostgreSQL client program (pg_dump, pg_restore...) against the
+    database.
+    """
+    logger.debug("Running %s", " ".join(args))
+    try:
+        result = subprocess.run(
+            args,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            # environment has precedence over os.environ
+            env={**os.environ, **get_environment(settings=settings)},
+        )
+    except FileNotFoundError:
+        raise RuntimeError(
+            f"Septentrion requires the '{args[0]}' executable to be present in "
+            "the PATH."
+        )
+
+    if result.returncode:
+        errors = result.stderr.decode("utf-8", errors="replace").splitlines()
+        msg = "Error running {}: {}".format(
+            args[0], "\n".join(errors[-ERROR_TAIL_SIZE:])
+        )
+        raise SQLRunnerException(msg) from subprocess.CalledProcessError(
+            returncode=result.returncode, cmd=args
+        )
+
+
+def restore_dump(
+    settings: configuration.Settings,
+    path: pathlib.Path,
+    sections: Optional[List[str]] = None,
+) -> None:
+    """
+    Restore a pg_dump archive (custom or directory format) in the database, with
+    settings.RESTORE_JOBS parallel jobs. sections restricts the restore to some
+    sections ("pre-data", "data", "post-data").
+    """
+    if isinstance(path, archives.ArchivePath):
+        # pg_restore needs to read (and, with several jobs, to seek in) the file
+        raise SQLRunnerException(
+            f"Cannot restore {path} from a migrations archive, extract it first"
+        )
+    run_command(
+        settings=settings,
+        args=[
+            "pg_restore",
+            "--no-owner",
+            "--exit-on-error",
+            f"--jobs={settings.RESTORE_JOBS}",
+            # An empty name lets libpq use PGDATABASE or its default
+            f"--dbname={settings.DBNAME or ''}",
+            *(f"--section={section}" for section in sections or []),
+            str(path),
+        ],
+    )
+
 
-    def _run_with_meta_loop(self):
-        KEYWORDS = ["INSERT", "UPDATE", "DELETE"]
-        rows_remaining = True
+@dataclasses.dataclass
+class Output:
+    """
+    What we keep from the standard output of psql
+    """
 
-        while rows_remaining:
-            out = self._run_simple()
+    lines: int = 0
+    # Whether the last run changed rows (see Script.run)
+    rows_remaining: bool = False
+    last_progress: float = 0.0
 
-            # we can stop once all the write operations return 0 rows
-            for line in out.split("\n"):
-                rows_remaining = any(
-                    keyword in line and keyword + " 0" not in line
-                    for keyword in KEYWORDS
-                )
 
-                # we still have work to do, we can go back to the main loop
-                if rows_remaining:
-                    break
+def _read_lines(stream: IO[bytes], callback: Callable[[str], None]) -> None:
+    for line in stream:
+        callback(line.decode("utf-8", errors="replace"))
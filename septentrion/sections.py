@@ -0,0 +1,218 @@
+"""
+Split a SQL schema into sections, like pg_dump --section does: the "pre-data"
+section (tables, types, functions...) is loaded before the fixtures, and the
+"post-data" section (indexes, constraints, triggers) is built afterwards, once,
+instead of being maintained for each fixture row (see the defer_post_data
+setting).
+"""
+import dataclasses
+import functools
+import logging
+import re
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import sqlparse
+
+from septentrion import configuration, db, utils
+
+logger = logging.getLogger(__name__)
+
+# Statements building an index: they can run in parallel
+INDEX_STATEMENT = re.compile(
+    r"^(CREATE\s+(UNIQUE\s+)?INDEX"
+    r"|ALTER\s+TABLE\s.*\sADD\s+(CONSTRAINT\s+\S+\s+)?"
+    r"(PRIMARY\s+KEY|UNIQUE|EXCLUDE))"
+    r"\b",
+    re.IGNORECASE | re.DOTALL,
+)
+# Other post-data statements, depending on indexes (a foreign key needs the
+# primary key or unique constraint it references, a comment needs its index...)
+# or locking several tables: they run one at a time, after the indexes.
+CONSTRAINT_STATEMENT = re.compile(
+    r"^(ALTER\s+TABLE\s.*\sADD\s+(CONSTRAINT\s+\S+\s+)?FOREIGN\s+KEY"
+    r"|ALTER\s+TABLE\s.*\s(CLUSTER\s+ON|REPLICA\s+IDENTITY\s+USING\s+INDEX)"
+    r"|ALTER\s+INDEX"
+    r"|CREATE\s+(OR\s+REPLACE\s+)?(CONSTRAINT\s+)?TRIGGER"
+    r"|COMMENT\s+ON\s+(INDEX|CONSTRAINT|TRIGGER))"
+    r"\b",
+    re.IGNORECASE | re.DOTALL,
+)
+# Statements configuring the session (e.g. the search_path): they apply to the
+# post-data statements too.
+SESSION_STATEMENT = re.compile(
+    r"^(SET\s|SELECT\s+(pg_catalog\.)?set_config\s*\()", re.IGNORECASE
+)
+# COPY statements using psql's standard input or output: only psql can run
+# them. The data of a COPY FROM STDIN follows it in the script, up to a "\."
+# line.
+COPY_FROM_STDIN_STATEMENT = re.compile(
+    r"^COPY\s.*\sFROM\s+STDIN\b", re.IGNORECASE | re.DOTALL
+)
+COPY_TO_STDOUT_STATEMENT = re.compile(
+    r"^COPY\s.*\sTO\s+STDOUT\b", re.IGNORECASE | re.DOTALL
+)
+COPY_DATA_END = re.compile(r"^\\\.[ \t]*\r?$\n?", re.MULTILINE)
+
+
+@dataclasses.dataclass
+class PostData:
+    session: List[str] = dataclasses.field(default_factory=list)
+    indexes: List[str] = dataclasses.field(default_factory=list)
+    constraints: List[str] = dataclasses.field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.indexes) + len(self.constraints)
+
+
+def get_text(statement: sqlparse.sql.Statement) -> Optional[str]:
+    """
+    Return the statement without its comments, or None if it contains psql
+    meta-commands (only psql can run it).
+    """
+    parts = []
+    for token in statement.flatten():
+        if token.ttype in sqlparse.tokens.Generic.Command:
+            return None
+        if token.ttype not in sqlparse.tokens.Comment:
+            parts.append(token.value)
+    return "".join(parts).strip()
+
+
+def iter_statements(sql: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Yield the statements of a script: their source, and their text without
+    comments (None if only psql can run them, see get_text and the COPY
+    statements above). The data of a COPY FROM STDIN is part of the source of
+    the statement, untouched.
+    """
+    position = 0
+    while position < len(sql):
+        # Statements are parsed lazily, so that the data of a COPY is never
+        # parsed as SQL: parsing starts again after it.
+        for statement in sqlparse.parsestream(sql[position:]):
+            source = str(statement)
+            position += len(source)
+            text = get_text(statement)
+            copy_from_stdin = bool(text and COPY_FROM_STDIN_STATEMENT.match(text))
+            if text and (copy_from_stdin or COPY_TO_STDOUT_STATEMENT.match(text)):
+                text = None
+            if not copy_from_stdin:
+                yield source, text
+                continue
+            end = COPY_DATA_END.search(sql, position)
+            data_end = end.end() if end else len(sql)
+            yield source + sql[position:data_end], None
+            position = data_end
+            break
+        else:
+            return
+
+
+def _has_several_actions(text: str) -> bool:
+    """
+    Whether an ALTER TABLE statement has several actions, separated by commas
+    outside of parentheses and quotes (e.g. ADD COLUMN ..., ADD CONSTRAINT ...).
+    """
+    depth = 0
+    quote = None
+    for char in text:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            return True
+    return False
+
+
+def classify(text: str) -> Optional[str]:
+    """
+    Return the post-data category of a statement ("indexes" or "constraints"),
+    or None if it's part of the pre-data section.
+    """
+    if text.upper().startswith("ALTER") and _has_several_actions(text):
+        return None
+    if INDEX_STATEMENT.match(text):
+        return "indexes"
+    if CONSTRAINT_STATEMENT.match(text):
+        return "constraints"
+    return None
+
+
+def split_statements(sql: str) -> Optional[List[str]]:
+    """
+    Return the statements of a script, without their comments, or None if it
+    contains psql meta-commands or COPY statements using psql's standard input
+    or output.
+    """
+    statements = []
+    for _, text in iter_statements(sql):
+        if text is None:
+            return None
+        # Empty statements (e.g. ";;") are skipped
+        if text.rstrip(";").strip():
+            statements.append(text)
+    return statements
+
+
+def split_schema(sql: str) -> Tuple[str, PostData]:
+    """
+    Return the pre-data section of a schema, and its post-data statements.
+    COPY statements and their inline data (as written by a plain pg_dump) are
+    left untouched in the pre-data section.
+    """
+    pre_data = []
+    post_data = PostData()
+    for source, text in iter_statements(sql):
+        category = classify(text) if text else None
+        if category is None:
+            pre_data.append(source)
+            if text and SESSION_STATEMENT.match(text):
+                post_data.session.append(text)
+            continue
+        getattr(post_data, category).append(text)
+
+    return "".join(pre_data) + "\n", post_data
+
+
+def build_post_data(
+    settings: configuration.Settings,
+    post_data: PostData,
+    progress: Optional[Callable[[str], None]] = None,
+) -> None:
+    """
+    Build the indexes in parallel, over settings.RESTORE_JOBS connections, then
+    the constraints.
+    """
+    done = 0
+
+    def report() -> None:
+        if progress:
+            progress(f"({done}/{len(post_data)} statements)")
+
+    logger.info("Building %s indexes", len(post_data.indexes))
+    run_index = functools.partial(_run_statement, settings, post_data.session)
+    for _ in utils.map_concurrently(
+        run_index, post_data.indexes, workers=settings.RESTORE_JOBS
+    ):
+        done += 1
+        report()
+
+    if post_data.constraints:
+        logger.info("Building %s constraints", len(post_data.constraints))
+        db.run_statements(
+            settings=settings, statements=post_data.session + post_data.constraints
+        )
+        done += len(post_data.constraints)
+        report()
+
+
+def _run_statement(
+    settings: configuration.Settings, session: List[str], statement: str
+) -> None:
+    db.run_statements(settings=settings, statements=session + [statement])
@@ -0,0 +1,169 @@
+"""
+Cache of migrated databases: after migrating an empty database, a dump of it
+(a "snapshot") is saved, keyed by a hash of the migration files and of the
+settings they're applied with. Migrating another empty database with the same
+key restores the snapshot instead of replaying the schema, the fixtures and
+the migrations.
+"""
+import hashlib
+import logging
+import os
+import pathlib
+from typing import Any, Iterable, Optional
+
+from septentrion import archives, configuration, files, runner, style, utils
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SUFFIX = ".dump"
+
+# Settings that change the database we get from the migration files
+KEY_SETTINGS = [
+    "TABLE",
+    "VERSION_COLUMN",
+    "NAME_COLUMN",
+    "APPLIED_AT_COLUMN",
+    "SCHEMA_TEMPLATE",
+    "FIXTURES_TEMPLATE",
+    "SCHEMA_VERSION",
+    "TARGET_VERSION",
+    "BEFORE_SCHEMA_FILE",
+    "ADDITIONAL_SCHEMA_FILE",
+    "AFTER_SCHEMA_FILE",
+    "IGNORE_SYMLINKS",
+]
+
+
+def _walk(folder: Any) -> Iterable[Any]:
+    for entry in sorted(folder.iterdir()):
+        if entry.is_dir():
+            yield from _walk(entry)
+        else:
+            yield entry
+
+
+def iter_repository_files(root: Any) -> Iterable[Any]:
+    """
+    Yield the files of the migrations root (folder or archive) that septentrion
+    reads, in a deterministic order.
+    """
+    for folder in sorted(root.iterdir()):
+        if not folder.is_dir():
+            continue
+        if folder.name in archives.SPECIAL_FOLDERS or utils.is_version(folder.name):
+            yield from _walk(folder)
+
+
+def get_repository_key(settings: configuration.Settings) -> str:
+    """
+    Hash the contents of the migration files, and the settings they're applied
+    with. File modification times are not used: they change with each checkout.
+    """
+    digest = hashlib.sha256()
+    for name in KEY_SETTINGS:
+        digest.update(f"{name}={getattr(settings, name)!r}\n".encode("utf-8"))
+
+    root = settings.MIGRATIONS_ROOT
+    for path in iter_repository_files(root):
+        relative_path = path.relative_to(root).as_posix()
+        digest.update(f"{relative_path}={files.hash_file(path)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_snapshot_path(settings: configuration.Settings) -> Optional[pathlib.Path]:
+    """
+    Return the path of the snapshot matching the migration files, whether it
+    exists or not, or None if snapshots are disabled.
+    """
+    if not settings.SNAPSHOT_DIR:
+        return None
+    key = get_repository_key(settings=settings)
+    return settings.SNAPSHOT_DIR / f"{key}{SNAPSHOT_SUFFIX}"
+
+
+def restore_snapshot(
+    settings: configuration.Settings,
+    path: pathlib.Path,
+    stylist: style.Stylist = style.noop_stylist,
+) -> None:
+    with stylist.checkbox(
+        content=f"Restoring snapshot {path.name}...",
+        content_after=f"Restored snapshot {path.name}",
+    ):
+        # Mark the snapshot as recently used (see evict_snapshots)
+        path.touch()
+        runner.run_command(
+            settings=settings,
+            args=[
+                "pg_restore",
+                # The migrations table may already exist, empty
+                "--clean",
+                "--if-exists",
+                "--no-owner",
+                "--single-transaction",
+                # An empty name lets libpq use PGDATABASE or its default
+                f"--dbname={settings.DBNAME or ''}",
+                str(path),
+            ],
+        )
+
+
+def save_snapshot(
+    settings: configuration.Settings,
+    path: pathlib.Path,
+    stylist: style.Stylist = style.noop_stylist,
+) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written next to its final path, then renamed: concurrent runs never see
+    # an incomplete snapshot.
+    temporary_path = path.with_name(f".{path.name}.{os.getpid()}")
+    with stylist.checkbox(
+        content=f"Saving snapshot {path.name}...",
+        content_after=f"Saved snapshot {path.name}",
+    ):
+        try:
+            runner.run_command(
+                settings=settings,
+                args=[
+                    "pg_dump",
+                    "--format=custom",
+                    "--no-owner",
+                    f"--file={temporary_path}",
+                ],
+            )
+            os.replace(temporary_path, path)
+        finally:
+            if temporary_path.exists():
+                temporary_path.unlink()
+
+    evict_snapshots(
+        directory=path.parent, max_size=settings.SNAPSHOT_MAX_SIZE, keep=path
+    )
+
+
+def evict_snapshots(
+    directory: pathlib.Path, max_size: int, keep: Optional[pathlib.Path] = None
+) -> None:
+    """
+    Delete the least recently used snapshots until the snapshots use at most
+    max_size MiB. The keep snapshot is never deleted.
+    """
+    snapshots = []
+    for path in directory.glob(f"*{SNAPSHOT_SUFFIX}"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        snapshots.append((stat.st_mtime, stat.st_size, path))
+
+    budget = max_size * 1024 * 1024
+    used = 0
+    for _, size, path in sorted(snapshots, reverse=True):
+        used += size
+        if used <= budget or path == keep:
+            continue
+        logger.info("Deleting snapshot %s", path)
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,175 @@
+"""
+Where the state of a database, i.e. its applied migrations, is read from. It's
+the migrations table (see septentrion.db), unless a state store is given: the
+migration plan can then be computed without a database, e.g. from a state
+exported to a JSON file (see the "export-state" command, and the --state option
+of "show-migrations" and "plan").
+"""
+import abc
+import json
+import os
+import pathlib
+from typing import Dict, Iterable, List, Optional, Set, TextIO, Tuple
+
+from septentrion import configuration, db, exceptions, versions
+
+STATE_FORMAT = 1
+
+# Version and name of an applied migration
+Entry = Tuple[str, str]
+
+
+class StateStore(abc.ABC):
+    """
+    The migrations applied to a database.
+    """
+
+    @abc.abstractmethod
+    def is_initialized(self) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_applied_versions(self) -> Iterable[versions.Version]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_applied_migrations_by_version(
+        self, versions_: Iterable[versions.Version]
+    ) -> Dict[versions.Version, Set[str]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_entries(self) -> List[Entry]:
+        """
+        Return all the applied migrations, in the order they were applied.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def write_migration(self, version: versions.Version, name: str) -> None:
+        raise NotImplementedError
+
+    def get_current_version(self) -> Optional[versions.Version]:
+        return max(self.get_applied_versions(), default=None)
+
+
+class PostgresStateStore(StateStore):
+    """
+    The migrations table of the database of the settings.
+    """
+
+    def __init__(self, settings: configuration.Settings):
+        self.settings = settings
+
+    def is_initialized(self) -> bool:
+        return db.is_schema_initialized(settings=self.settings)
+
+    def get_applied_versions(self) -> Iterable[versions.Version]:
+        return db.get_applied_versions(settings=self.settings)
+
+    def get_applied_migrations_by_version(
+        self, versions_: Iterable[versions.Version]
+    ) -> Dict[versions.Version, Set[str]]:
+        return db.get_applied_migrations_by_version(
+            settings=self.settings, versions_=versions_
+        )
+
+    def get_entries(self) -> List[Entry]:
+        if not self.is_initialized():
+            return []
+        return db.get_all_migrations(settings=self.settings)
+
+    def write_migration(self, version: versions.Version, name: str) -> None:
+        db.write_migration(settings=self.settings, version=version, name=name)
+
+    def get_current_version(self) -> Optional[versions.Version]:
+        return db.get_current_schema_version(settings=self.settings)
+
+
+class MemoryStateStore(StateStore):
+    def __init__(self, entries: Iterable[Entry] = ()):
+        self.entries = list(entries)
+
+    def is_initialized(self) -> bool:
+        return bool(self.entries)
+
+    def get_applied_versions(self) -> Iterable[versions.Version]:
+        version_strings = dict.fromkeys(version for version, _ in self.entries)
+        return [versions.Version.from_string(string) for string in version_strings]
+
+    def get_applied_migrations_by_version(
+        self, versions_: Iterable[versions.Version]
+    ) -> Dict[versions.Version, Set[str]]:
+        by_string = {version.original_string: version for version in versions_}
+        applied: Dict[versions.Version, Set[str]] = {
+            version: set() for version in by_string.values()
+        }
+        for version_string, name in self.entries:
+            if version_string in by_string:
+                applied[by_string[version_string]].add(name)
+        return applied
+
+    def get_entries(self) -> List[Entry]:
+        return list(self.entries)
+
+    def write_migration(self, version: versions.Version, name: str) -> None:
+        self.entries.append((version.original_string, name))
+
+
+class JSONFileStateStore(MemoryStateStore):
+    """
+    A state exported to a JSON file (see write_state). Written migrations are
+    saved to the file.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        entries: List[Entry] = []
+        if path.exists():
+            with path.open() as file:
+                entries = read_state(file)
+        super().__init__(entries)
+
+    def write_migration(self, version: versions.Version, name: str) -> None:
+        super().write_migration(version=version, name=name)
+        # Written next to the file, then renamed: an interrupted write never
+        # leaves an incomplete state behind.
+        temporary_path = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+        try:
+            with temporary_path.open("w") as file:
+                write_state(self, file)
+            os.replace(temporary_path, self.path)
+        finally:
+            if temporary_path.exists():
+                temporary_path.unlink()
+
+
+def get_store(
+    settings: configuration.Settings, store: Optional[StateStore] = None
+) -> StateStore:
+    return store if store is not None else PostgresStateStore(settings=settings)
+
+
+def write_state(store: StateStore, file: TextIO) -> None:
+    state = {
+        "format": STATE_FORMAT,
+        "migrations": [
+            {"version": version, "name": name} for version, name in store.get_entries()
+        ],
+    }
+    json.dump(state, file, separators=(",", ":"))
+    file.write("\n")
+
+
+def read_state(file: TextIO) -> List[Entry]:
+    try:
+        state = json.load(file)
+    except ValueError as exc:
+        raise exceptions.SeptentrionException(f"Invalid state file: {exc}") from exc
+    if not isinstance(state, dict) or state.get("format") != STATE_FORMAT:
+        raise exceptions.SeptentrionException(
+            f"Invalid state file: expected format {STATE_FORMAT}"
+        )
+    return [
+        (migration["version"], migration["name"]) for migration in state["migrations"]
+    ]
@@ -38,9 +38,19 @@ class Stylist(object):
         self, content: str, content_after: Optional[str] = None, margin: int = 2
     ) -> Any:
         content_after = content_after or content
-        space_len = max(0, len(content) - len(content_after))
+        longest = len(content)
         self.draw_checkbox(content=content, checked=False, margin=margin)
-        yield
+
+        def progress(details: str) -> None:
+            # Redraw the unchecked box, followed by some progress information
+            nonlocal longest
+            line = "{} {}".format(content, details)
+            longest = max(longest, len(line))
+            self.echo("\r", nl=False)
+            self.draw_checkbox(content=line, checked=False, margin=margin)
+
+        yield progress
+        space_len = max(0, longest - len(content_after))
         self.echo("\r", nl=False)
         self.draw_checkbox(
             content=content_after + " " * space_len, checked=True, margin=margin
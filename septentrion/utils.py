@@ -2,10 +2,12 @@
 All functions in here should be easily unit testable
 """
 
+import concurrent.futures
 import itertools
-from typing import Iterable, TypeVar
+import os
+from typing import Callable, Dict, Iterable, Iterator, TypeVar
 
-from septentrion import exceptions, versions
+from septentrion import versions
 
 
 def is_version(vstring: str) -> bool:
@@ -16,14 +18,11 @@ def is_version(vstring: str) -> bool:
     >>> is_version("bananas")
     False
     """
-    try:
-        versions.Version.from_string(vstring)
-    except exceptions.InvalidVersion:
-        return False
-    return True
+    return versions.parse_version_tuple(vstring) is not None
 
 
 T = TypeVar("T")
+U = TypeVar("U")
 
 
 def until(iterable: Iterable[T], value: T) -> Iterable[T]:
@@ -47,3 +46,46 @@ def since(iterable: Iterable[T], value: T) -> Iterable[T]:
     [297, 298, 299]
     """
     yield from itertools.dropwhile((lambda x: x != value), iterable)
+
+
+def format_pg_options(options: Dict[str, str]) -> str:
+    """
+    Format PostgreSQL settings for the PGOPTIONS environment variable (or the
+    libpq "options" parameter). Spaces in values are escaped.
+    >>> format_pg_options({"synchronous_commit": "off", "work_mem": "64MB"})
+    '-c synchronous_commit=off -c work_mem=64MB'
+    """
+    return " ".join(
+        "-c {}={}".format(name, value.replace("\\", "\\\\").replace(" ", "\\ "))
+        for name, value in options.items()
+    )
+
+
+def get_pg_options(options: Dict[str, str]) -> str:
+    """
+    Like format_pg_options, but keeps the PGOPTIONS of the environment, which
+    the result replaces: the given settings come last, and take precedence.
+    """
+    return " ".join(
+        value
+        for value in [os.environ.get("PGOPTIONS", ""), format_pg_options(options)]
+        if value
+    )
+
+
+def map_concurrently(
+    function: Callable[[T], U], iterable: Iterable[T], workers: int = 1
+) -> Iterator[U]:
+    """
+    Like map(), but spreads the calls over a pool of `workers` threads.
+    Results are yielded in the order of the input, whatever the order in
+    which the calls complete.
+    >>> list(map_concurrently(str, range(3), workers=2))
+    ['0', '1', '2']
+    """
+    if workers <= 1:
+        yield from map(function, iterable)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(function, iterable)
@@ -1,8 +1,37 @@
+import bisect
 import dataclasses
+import functools
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 from septentrion import exceptions
 
 
+def _could_be_int(part: str) -> bool:
+    """
+    Cheap check rejecting what int() would reject, based on the first character
+    """
+    first = part[:1]
+    return bool(first) and (first.isdecimal() or first.isspace() or first in "+-")
+
+
+@functools.lru_cache(maxsize=None)
+def parse_version_tuple(version_string: str) -> Optional[Tuple[int, ...]]:
+    """
+    Return the tuple of a version string, or None if it's not a valid version.
+    Results are cached: version strings (folder names, rows of the migrations
+    table) are parsed many times.
+    """
+    if not version_string:
+        return None
+    parts = version_string.split(".")
+    if not all(_could_be_int(part) for part in parts):
+        return None
+    try:
+        return tuple(int(part) for part in parts)
+    except ValueError:
+        return None
+
+
 @dataclasses.dataclass(order=True, unsafe_hash=True, frozen=True)
 class Version:
 
@@ -11,12 +40,71 @@ class Version:
 
     @classmethod
     def from_string(cls, version_string: str) -> "Version":
-        try:
-            assert version_string
-            version_tuple = tuple(int(e) for e in version_string.split("."))
-        except (AssertionError, ValueError) as exc:
-            raise exceptions.InvalidVersion(str(exc)) from exc
-        return cls(version_tuple=version_tuple, original_string=version_string)
+        """
+        Versions are interned: parsing the same string twice returns the same
+        object.
+        """
+        return _from_string(version_string)
 
     def __str__(self):
         return self.original_string
+
+
+@functools.lru_cache(maxsize=None)
+def _from_string(version_string: str) -> Version:
+    version_tuple = parse_version_tuple(version_string)
+    if version_tuple is None:
+        raise exceptions.InvalidVersion(f"Invalid version {version_string!r}")
+    return Version(version_tuple=version_tuple, original_string=version_string)
+
+
+class VersionIndex:
+    """
+    Sorted versions, with bisect lookups.
+    """
+
+    def __init__(self, versions: Iterable[Version]):
+        self.versions: List[Version] = sorted(versions)
+
+    def __iter__(self) -> Iterator[Version]:
+        return iter(self.versions)
+
+    def __len__(self) -> int:
+        return len(self.versions)
+
+    def __contains__(self, version: Version) -> bool:
+        return self.find(version) is not None
+
+    def find(self, version: Version) -> Optional[Version]:
+        """
+        Return the indexed version equal to version, if any.
+        """
+        index = bisect.bisect_left(self.versions, version)
+        if index < len(self.versions) and self.versions[index] == version:
+            return self.versions[index]
+        return None
+
+    def window(
+        self, start: Optional[Version] = None, end: Optional[Version] = None
+    ) -> List[Version]:
+        """
+        Return the versions between start and end, both included (None meaning
+        no bound).
+        """
+        low = 0 if start is None else bisect.bisect_left(self.versions, start)
+        if end is None:
+            high = len(self.versions)
+        else:
+            high = bisect.bisect_right(self.versions, end)
+        return self.versions[low:high]
+
+    def closest(self, version: Optional[Version] = None) -> Optional[Version]:
+        """
+        Return the greatest version lower than or equal to version (None
+        meaning the greatest version), if any.
+        """
+        if version is None:
+            index = len(self.versions)
+        else:
+            index = bisect.bisect_right(self.versions, version)
+        return self.versions[index - 1] if index else None
@@ -1,7 +1,8 @@
 import pathlib
 
-from septentrion import __main__, configuration
+from septentrion import __main__, configuration, databases
 from septentrion import db as db_module
+from septentrion import state
 
 
 def test_version(cli_runner):
@@ -73,3 +74,159 @@ def test_configuration_file_from_cli(cli_runner, temporary_directory, mocker):
         catch_exceptions=False,
     )
     assert result.exit_code == 0, (result.output,)
+
+
+def test_show_migrations_last(cli_runner, mocker):
+    describe = mocker.patch("septentrion.core.describe_migration_plan")
+    mocker.patch("septentrion.db.create_table")
+    result = cli_runner.invoke(
+        __main__.main,
+        ["--target-version=0.0.0", "show-migrations", "--last", "2"],
+        catch_exceptions=False,
+    )
+    assert result.exit_code == 0, (result.output,)
+    assert describe.call_args.kwargs["last"] == 2
+
+
+def test_pack(cli_runner, tmp_path, mocker):
+    create_table = mocker.patch("septentrion.db.create_table")
+    output = tmp_path / "migrations.zip"
+    result = cli_runner.invoke(
+        __main__.main,
+        ["--migrations-root", "example_migrations", "pack", str(output)],
+        catch_exceptions=False,
+    )
+    assert result.exit_code == 0, (result.output,)
+    assert "Packed 24 files" in result.output
+    assert output.exists()
+    create_table.assert_not_called()
+
+
+def test_bundle(cli_runner, tmp_path, mocker):
+    create_table = mocker.patch("septentrion.db.create_table")
+    output = tmp_path / "bundle.sql"
+    result = cli_runner.invoke(
+        __main__.main,
+        [
+            "--migrations-root",
+            "example_migrations",
+            "bundle",
+            "--from",
+            "1.2",
+            "--to",
+            "1.2",
+            "--single-transaction",
+            "--output",
+            str(output),
+        ],
+        catch_exceptions=False,
+    )
+    assert result.exit_code == 0, (result.output,)
+    bundle = output.read_text()
+    assert bundle.count("BEGIN;") == 1
+    assert bundle.count("COMMIT;") == 1
+    assert "'1.2', '1.2-rename-num-pages-ddl.sql'" in bundle
+    create_table.assert_not_called()
+
+
+def test_migrate_databases(cli_runner, tmp_path, mocker):
+    create_table = mocker.patch("septentrion.db.create_table")
+    migrate_targets = mocker.patch(
+        "septentrion.databases.migrate_targets",
+        return_value=[
+            databases.Result(name="tenant_1", status=databases.STATUS_MIGRATED),
+            databases.Result(
+                name="tenant_2", status=databases.STATUS_FAILED, error="boom"
+            ),
+        ],
+    )
+    names = tmp_path / "databases.txt"
+    names.write_text("tenant_1\ntenant_2\n")
+    result = cli_runner.invoke(
+        __main__.main,
+        ["--dbname", "postgres", "migrate", "--databases", str(names)],
+    )
+    assert result.exit_code == 1, (result.output,)
+    assert "tenant_2  failed" in result.output
+    assert "tenant_2: boom" in result.output
+    assert "1 of 2 databases failed to migrate" in result.output
+    assert migrate_targets.call_args.kwargs["names"] == ["tenant_1", "tenant_2"]
+    assert migrate_targets.call_args.kwargs["workers"] == 4
+    assert migrate_targets.call_args.kwargs["select"] is databases.select_database
+    # Not in the database used to list the others
+    create_table.assert_not_called()
+
+
+def test_migrate_databases_exclusive(cli_runner, tmp_path, mocker):
+    mocker.patch("septentrion.db.create_table")
+    names = tmp_path / "databases.txt"
+    names.write_text("tenant_1\n")
+    result = cli_runner.invoke(
+        __main__.main,
+        ["migrate", "--databases", str(names), "--dbname-pattern", "tenant_%"],
+    )
+    assert result.exit_code == 2, (result.output,)
+    assert "mutually exclusive" in result.output
+
+
+def test_migrate_schemas(cli_runner, mocker):
+    mocker.patch("septentrion.db.create_table")
+    get_schema_names = mocker.patch(
+        "septentrion.db.get_schema_names", return_value=["tenant_1"]
+    )
+    migrate_targets = mocker.patch(
+        "septentrion.databases.migrate_targets",
+        return_value=[
+            databases.Result(name="tenant_1", status=databases.STATUS_UP_TO_DATE)
+        ],
+    )
+    result = cli_runner.invoke(
+        __main__.main,
+        ["migrate", "--schema-pattern", "tenant_%", "--concurrency", "8"],
+    )
+    assert result.exit_code == 0, (result.output,)
+    assert "Schema    Status" in result.output
+    assert get_schema_names.call_args.kwargs["pattern"] == "tenant_%"
+    assert migrate_targets.call_args.kwargs["select"] is databases.select_schema
+    assert migrate_targets.call_args.kwargs["workers"] == 8
+
+
+def test_export_state(cli_runner, mocker, tmp_path):
+    mocker.patch("septentrion.db.create_table")
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=True)
+    mocker.patch("septentrion.db.get_all_migrations", return_value=[("1.1", "a.sql")])
+    output = tmp_path / "state.json"
+
+    result = cli_runner.invoke(
+        __main__.main, ["export-state", "-o", str(output)], catch_exceptions=False
+    )
+
+    assert result.exit_code == 0, (result.output,)
+    with output.open() as file:
+        assert state.read_state(file) == [("1.1", "a.sql")]
+
+
+def test_show_migrations_state(cli_runner, mocker, tmp_path):
+    create_table = mocker.patch("septentrion.db.create_table")
+    execute = mocker.patch("septentrion.db.execute")
+    path = tmp_path / "state.json"
+    with path.open("w") as file:
+        state.write_state(state.MemoryStateStore([("1.1", "1.1-index-ddl.sql")]), file)
+
+    result = cli_runner.invoke(
+        __main__.main,
+        [
+            "--migrations-root=example_migrations",
+            "--target-version=1.2",
+            "show-migrations",
+            "--state",
+            str(path),
+        ],
+        catch_exceptions=False,
+    )
+
+    assert result.exit_code == 0, (result.output,)
+    assert "Current version is 1.1" in result.output
+    assert "1.2-rename-num-pages-ddl.sql" in result.output
+    create_table.assert_not_called()
+    execute.assert_not_called()
@@ -0,0 +1,93 @@
+import pathlib
+import zipfile
+
+import pytest
+
+from septentrion import archives, configuration, exceptions, files, versions
+
+
+def test_pack(tmp_path):
+    output = tmp_path / "migrations.zip"
+
+    count = archives.pack(root=pathlib.Path("example_migrations"), output=output)
+
+    settings = configuration.Settings(migrations_root=output)
+    assert isinstance(settings.MIGRATIONS_ROOT, archives.ArchivePath)
+    assert count == 24
+    assert [str(v) for v in files.get_known_versions(settings=settings)] == [
+        "0.1",
+        "1.0",
+        "1.1",
+        "1.2",
+        "1.3",
+    ]
+    mapping = files.get_migrations_files_mapping(
+        settings=settings, version=versions.Version.from_string("1.1")
+    )
+    assert sorted(mapping) == [
+        "1.1-0-version-dml.sql",
+        "1.1-add-num-pages-1-ddl.sql",
+        "1.1-add-num-pages-2-dml.sql",
+        "1.1-index-ddl.sql",
+    ]
+    with files.open_migration(mapping["1.1-index-ddl.sql"]) as content:
+        assert content.read().startswith(b"CREATE INDEX")
+
+
+@pytest.mark.parametrize("ignore_symlinks, expected", [(False, 2), (True, 1)])
+def test_pack_ignore_symlinks(tmp_path, ignore_symlinks, expected):
+    root = tmp_path / "migrations"
+    (root / "1.0").mkdir(parents=True)
+    (root / "1.0" / "1.0-a-ddl.sql").write_text("SELECT 1;")
+    (root / "1.0" / "1.0-b-ddl.sql").symlink_to(root / "1.0" / "1.0-a-ddl.sql")
+    output = tmp_path / "migrations.zip"
+
+    count = archives.pack(root=root, output=output, ignore_symlinks=ignore_symlinks)
+
+    assert count == expected
+    with zipfile.ZipFile(output) as archive:
+        assert len(archive.namelist()) == expected
+
+
+def test_package_root(tmp_path, monkeypatch):
+    package = tmp_path / "septentrion_test_package"
+    (package / "migrations" / "1.0").mkdir(parents=True)
+    (package / "__init__.py").touch()
+    (package / "migrations" / "1.0" / "1.0-a-ddl.sql").touch()
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    settings = configuration.Settings(
+        migrations_root="package:septentrion_test_package/migrations"
+    )
+
+    assert settings.MIGRATIONS_ROOT == package / "migrations"
+    assert archives.is_immutable(settings.MIGRATIONS_ROOT)
+    assert files.get_known_versions(settings=settings) == [
+        versions.Version.from_string("1.0")
+    ]
+
+
+def test_package_root_zipped(tmp_path, monkeypatch):
+    wheel = tmp_path / "package.zip"
+    with zipfile.ZipFile(wheel, "w") as zip_file:
+        zip_file.writestr("septentrion_test_zipped/__init__.py", "")
+        zip_file.writestr(
+            "septentrion_test_zipped/migrations/1.0/1.0-a-ddl.sql", "SELECT 1;"
+        )
+    monkeypatch.syspath_prepend(str(wheel))
+
+    settings = configuration.Settings(
+        migrations_root="package:septentrion_test_zipped/migrations"
+    )
+
+    assert isinstance(settings.MIGRATIONS_ROOT, archives.ArchivePath)
+    mapping = files.get_migrations_files_mapping(
+        settings=settings, version=versions.Version.from_string("1.0")
+    )
+    with files.open_migration(mapping["1.0-a-ddl.sql"]) as content:
+        assert content.read() == b"SELECT 1;"
+
+
+def test_package_root_unknown():
+    with pytest.raises(exceptions.SeptentrionException):
+        configuration.Settings(migrations_root="package:septentrion_nope/migrations")
@@ -44,3 +44,45 @@ def test_write_migration(db, settings_factory):
     assert name == "some_migration.sql"
     one_sec = datetime.timedelta(seconds=1)
     assert now - one_sec < date < now + one_sec
+
+
+def test_create_database(db, settings_factory):
+    settings = settings_factory(**db)
+    name = "test_septentrion_clone"
+    db_module.drop_database(settings=settings, dbname=name)
+
+    assert db_module.get_database_comment(settings=settings, dbname=name) == (
+        False,
+        None,
+    )
+
+    db_module.create_database(settings=settings, dbname=name, template=db["dbname"])
+    db_module.comment_database(settings=settings, dbname=name, comment="hello")
+    try:
+        assert db_module.get_database_comment(settings=settings, dbname=name) == (
+            True,
+            "hello",
+        )
+    finally:
+        db_module.drop_database(settings=settings, dbname=name)
+
+
+def test_truncate_tables(db, settings_factory):
+    settings = settings_factory(**db)
+    db_module.create_table(settings=settings)
+    db_module.write_migration(
+        settings=settings,
+        version=versions.Version.from_string("1.2.3"),
+        name="some_migration.sql",
+    )
+    with db_module.execute(
+        settings=settings, query="CREATE TABLE foo AS SELECT 1 AS a"
+    ):
+        pass
+
+    db_module.truncate_tables(settings=settings)
+
+    with db_module.execute(settings=settings, query="SELECT * FROM foo") as cursor:
+        assert cursor.fetchall() == []
+    with db_module.Query(settings=settings, query="SELECT * FROM {table}") as cursor:
+        assert len(list(cursor)) == 1
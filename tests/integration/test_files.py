@@ -1,6 +1,9 @@
+import gzip
+import lzma
+
 import pytest
 
-from septentrion import files
+from septentrion import exceptions, files
 
 
 def test_iter_dirs(tmp_path):
@@ -21,3 +24,98 @@ def test_iter_files(tmp_path, ignore_symlinks, expected):
     assert list(files.iter_files(tmp_path, ignore_symlinks=ignore_symlinks)) == [
         tmp_path / e for e in expected
     ]
+
+
+def test_map_file(tmp_path):
+    path = tmp_path / "foo.sql"
+    path.write_text("SELECT 1;\n")
+
+    with files.map_file(path) as content:
+        assert content[:] == b"SELECT 1;\n"
+
+
+def test_map_file_empty(tmp_path):
+    path = tmp_path / "foo.sql"
+    path.touch()
+
+    with files.map_file(path) as content:
+        assert content == b""
+
+
+def test_get_migration_metadata(tmp_path):
+    path = tmp_path / "foo.dml.sql"
+    path.write_text("--meta-psql:do-until-0\nUPDATE foo SET a = 1;\n")
+
+    metadata = files.get_migration_metadata(path)
+
+    assert metadata == files.MigrationMetadata(manual=True, meta=("do-until-0",))
+
+
+@pytest.mark.parametrize("suffix, compress", [("", bytes), (".gz", gzip.compress)])
+def test_get_migration_metadata_meta_psql_after_sql(tmp_path, mocker, suffix, compress):
+    # Only the header is read: directives further in the file are found when
+    # the migration is run (see runner.Script)
+    path = tmp_path / ("foo.dml.sql" + suffix)
+    path.write_bytes(compress(b"SELECT * from foo;\n--meta-psql:do-until-0\n"))
+    read = mocker.spy(files, "read_header")
+
+    metadata = files.get_migration_metadata(path)
+
+    assert metadata == files.MigrationMetadata()
+    read.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "suffix, compress", [(".gz", gzip.compress), (".xz", lzma.compress)]
+)
+def test_open_migration_compressed(tmp_path, suffix, compress):
+    path = tmp_path / ("foo.sql" + suffix)
+    path.write_bytes(compress(b"SELECT 1;\n"))
+
+    with files.open_migration(path) as content:
+        assert content.read() == b"SELECT 1;\n"
+
+
+def test_find_special_file(tmp_path):
+    (tmp_path / "schema_1.0.sql.gz").touch()
+    (tmp_path / "schema_1.1.sql").touch()
+
+    assert files.find_special_file(tmp_path, "schema_1.0.sql") == (
+        tmp_path / "schema_1.0.sql.gz"
+    )
+    assert files.find_special_file(tmp_path, "schema_1.1.sql") == (
+        tmp_path / "schema_1.1.sql"
+    )
+
+
+def test_find_dump(tmp_path):
+    (tmp_path / "schema_1.0.dump").touch()
+    (tmp_path / "schema_1.1.dump").mkdir()
+    (tmp_path / "schema_1.1.dump" / "toc.dat").touch()
+    (tmp_path / "schema_1.2.dump").mkdir()
+
+    assert files.find_dump(tmp_path, "schema_1.0.sql") == tmp_path / "schema_1.0.dump"
+    assert files.find_dump(tmp_path, "schema_1.1.sql") == tmp_path / "schema_1.1.dump"
+    # Not a pg_dump archive
+    assert files.find_dump(tmp_path, "schema_1.2.sql") is None
+    assert files.find_dump(tmp_path, "schema_1.3.sql") is None
+
+
+def test_get_special_files_dump(tmp_path):
+    (tmp_path / "schemas" / "schema_1.0.dump").mkdir(parents=True)
+    (tmp_path / "schemas" / "schema_1.0.dump" / "toc.dat").touch()
+    (tmp_path / "schemas" / "other").mkdir()
+    (tmp_path / "schemas" / "schema_1.1.sql").touch()
+
+    assert files.get_special_files(root=tmp_path, folder="schemas") == [
+        "schema_1.1.sql",
+        "schema_1.0.dump",
+    ]
+
+
+def test_list_migrations_and_paths_compressed_duplicate(tmp_path):
+    (tmp_path / "foo-ddl.sql").write_text("SELECT 1;\n")
+    (tmp_path / "foo-ddl.sql.gz").write_bytes(gzip.compress(b"SELECT 1;\n"))
+
+    with pytest.raises(exceptions.SeptentrionException, match="foo-ddl.sql"):
+        list(files.list_migrations_and_paths(folder=tmp_path, ignore_symlinks=False))
@@ -0,0 +1,100 @@
+import gzip
+import json
+
+import pytest
+
+from septentrion import db as db_module
+from septentrion import exceptions, fixtures
+
+
+def write_manifest(path, tables):
+    path.mkdir()
+    (path / "manifest.json").write_text(json.dumps({"tables": tables}))
+
+
+def test_read_manifest(tmp_path):
+    path = tmp_path / "fixtures_1.0.copy"
+    write_manifest(
+        path,
+        [
+            {"table": "public.author", "file": "author.csv", "header": True},
+            {
+                "table": "book",
+                "file": "book.txt",
+                "format": "text",
+                "columns": ["id", "title"],
+            },
+        ],
+    )
+
+    assert fixtures.read_manifest(path) == [
+        fixtures.TableFile(
+            table="public.author", path=path / "author.csv", header=True
+        ),
+        fixtures.TableFile(
+            table="book",
+            path=path / "book.txt",
+            format="text",
+            columns=("id", "title"),
+        ),
+    ]
+
+
+@pytest.mark.parametrize(
+    "tables",
+    [
+        [{"table": "author"}],
+        [{"table": "author", "file": "author.csv", "format": "xml"}],
+        [
+            {"table": "author", "file": "author.csv"},
+            {"table": "author", "file": "other.csv"},
+        ],
+    ],
+)
+def test_read_manifest_invalid(tmp_path, tables):
+    path = tmp_path / "fixtures_1.0.copy"
+    write_manifest(path, tables)
+
+    with pytest.raises(exceptions.SeptentrionException):
+        fixtures.read_manifest(path)
+
+
+def test_open_table_file(tmp_path):
+    path = tmp_path / "author.csv.gz"
+    path.write_bytes(gzip.compress(b"1,Jules Verne\n"))
+
+    with fixtures.open_table_file(path) as file:
+        assert file.read() == b"1,Jules Verne\n"
+
+
+def test_load_fixtures(db, settings_factory, tmp_path):
+    settings = settings_factory(**db, restore_jobs=2)
+    with db_module.execute(
+        settings=settings,
+        query="CREATE TABLE author (id INT PRIMARY KEY, name TEXT);"
+        "CREATE INDEX author_name ON author (name);"
+        "CREATE TABLE book (title TEXT, author_id INT REFERENCES author (id));",
+    ):
+        pass
+    path = tmp_path / "fixtures_1.0.copy"
+    write_manifest(
+        path,
+        [
+            {"table": "book", "file": "book.csv"},
+            {"table": "author", "file": "author.csv.gz", "header": True},
+        ],
+    )
+    (path / "book.csv").write_text("Around the World in Eighty Days,1\n")
+    (path / "author.csv.gz").write_bytes(gzip.compress(b"id,name\n1,Jules Verne\n"))
+
+    fixtures.load_fixtures(settings=settings, path=path)
+
+    with db_module.execute(
+        settings=settings,
+        query="SELECT title, name FROM book JOIN author ON author.id = author_id",
+    ) as cursor:
+        assert cursor.fetchall() == [["Around the World in Eighty Days", "Jules Verne"]]
+    assert db_module.get_droppable_indexes(settings=settings, tables=["author"]) == [
+        ("author_name", "CREATE INDEX author_name ON public.author USING btree (name)")
+    ]
+    assert len(db_module.get_foreign_keys(settings=settings, tables=["book"])) == 1
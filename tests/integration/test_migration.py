@@ -1,5 +1,5 @@
 import pathlib
-from unittest.mock import call
+from unittest.mock import ANY, call
 
 from septentrion import configuration, core, migration, versions
 
@@ -24,10 +24,12 @@ def test_init_schema(mocker):
         call(
             settings=settings,
             path=pathlib.Path("example_migrations/schemas/schema_0.1.sql"),
+            progress=ANY,
         ),
         call(
             settings=settings,
             path=pathlib.Path("example_migrations/fixtures/fixtures_0.1.sql"),
+            progress=ANY,
         ),
     ]
     assert calls == patch.call_args_list
@@ -64,6 +66,7 @@ def test_init_schema_extra_files(mocker):
         call(
             settings=settings,
             path=pathlib.Path("example_migrations/schemas/schema_0.1.sql"),
+            progress=ANY,
         ),
         call(
             settings=settings,
@@ -72,6 +75,7 @@ def test_init_schema_extra_files(mocker):
         call(
             settings=settings,
             path=pathlib.Path("example_migrations/fixtures/fixtures_0.1.sql"),
+            progress=ANY,
         ),
     ]
     assert calls == patch.call_args_list
@@ -1,10 +1,21 @@
+import gzip
 import io
 import os
+import pathlib
 
 import pytest
 
+from septentrion import archives, configuration
+from septentrion import db as db_module
+from septentrion import files, runner
 from septentrion.db import Query
-from septentrion.runner import Script, SQLRunnerException
+from septentrion.runner import (
+    Script,
+    SQLRunnerException,
+    get_environment,
+    restore_dump,
+    run_command,
+)
 
 
 @pytest.fixture()
@@ -110,3 +121,199 @@ UPDATE foo SET value = foo.value * 100
             900,
             1000,
         ]
+
+
+def test_run_simple_progress(db, settings_factory, mocker):
+    settings = settings_factory(**db)
+    mocker.patch("septentrion.runner.PROGRESS_INTERVAL", 0)
+    progress = mocker.Mock()
+
+    script = Script(settings, b"SELECT 1;\nSELECT 2;\n", pathlib.Path("-"), progress)
+    output = script._run_simple()
+
+    assert output.lines > 0
+    progress.assert_called_with(f"({output.lines:,} lines of output)")
+
+
+def test_run_command():
+    run_command(configuration.Settings(), ["python", "-c", "print('ok')"])
+
+
+def test_run_command_error():
+    with pytest.raises(SQLRunnerException) as exc_info:
+        run_command(
+            configuration.Settings(),
+            ["python", "-c", "import sys; sys.exit('boom')"],
+        )
+
+    assert "boom" in str(exc_info.value)
+
+
+def test_run_command_not_found():
+    with pytest.raises(RuntimeError):
+        run_command(configuration.Settings(), ["septentrion-not-a-command"])
+
+
+def test_restore_dump(mocker, tmp_path):
+    run_command = mocker.patch("septentrion.runner.run_command")
+    settings = configuration.Settings(dbname="foo", restore_jobs=4)
+
+    restore_dump(settings, tmp_path / "schema_1.1.dump")
+
+    run_command.assert_called_once_with(
+        settings=settings,
+        args=[
+            "pg_restore",
+            "--no-owner",
+            "--exit-on-error",
+            "--jobs=4",
+            "--dbname=foo",
+            str(tmp_path / "schema_1.1.dump"),
+        ],
+    )
+
+
+def test_restore_dump_sections(mocker, tmp_path):
+    run_command = mocker.patch("septentrion.runner.run_command")
+
+    restore_dump(
+        configuration.Settings(restore_jobs=1),
+        tmp_path / "schema_1.1.dump",
+        sections=["pre-data", "data"],
+    )
+
+    assert run_command.call_args[1]["args"][-3:] == [
+        "--section=pre-data",
+        "--section=data",
+        str(tmp_path / "schema_1.1.dump"),
+    ]
+
+
+def test_restore_dump_archive(mocker):
+    path = mocker.Mock(spec=archives.ArchivePath)
+
+    with pytest.raises(SQLRunnerException):
+        restore_dump(configuration.Settings(), path)
+
+
+def test_get_environment(monkeypatch):
+    monkeypatch.delenv("PGOPTIONS", raising=False)
+    settings = configuration.Settings(dbname="foo").with_session_options(
+        {"synchronous_commit": "off"}
+    )
+
+    assert get_environment(settings=settings) == {
+        "PGDATABASE": "foo",
+        "PGOPTIONS": "-c synchronous_commit=off",
+    }
+
+
+def test_get_environment_keeps_pgoptions(monkeypatch):
+    monkeypatch.setenv("PGOPTIONS", "-c statement_timeout=0")
+    settings = configuration.Settings().with_session_options(
+        {"synchronous_commit": "off"}
+    )
+
+    assert get_environment(settings=settings)["PGOPTIONS"] == (
+        "-c statement_timeout=0 -c synchronous_commit=off"
+    )
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        (b"UPDATE foo SET a = 1;\n", False),
+        (b"UPDATE foo SET a = 1;\n--meta-psql:do-until-0\n", True),
+        # After the header, and across a chunk boundary
+        (b"-" * (runner.CHUNK_SIZE - 4) + b"\n--meta-psql:do-until-0\n", True),
+    ],
+)
+def test_has_meta_directives_stream(tmp_path, content, expected):
+    path = tmp_path / "foo.dml.sql.gz"
+    script = Script(configuration.Settings(), io.BytesIO(content), path)
+    stdin = io.BytesIO()
+    stdin.close = lambda: None
+
+    # Searched as it's sent to psql
+    script._write_input(stdin)
+
+    assert stdin.getvalue() == content
+    assert script._has_meta_directives() is expected
+
+
+def test_has_meta_directives_buffer(tmp_path):
+    content = b"SELECT 1;\n" + b"-- padding\n" * 10000 + b"--meta-psql:do-until-0\n"
+    script = Script(configuration.Settings(), content, tmp_path / "foo.dml.sql")
+
+    assert script._has_meta_directives() is True
+
+
+@pytest.mark.parametrize(
+    "content, runs",
+    [
+        (b"UPDATE foo SET a = 1;\n--meta-psql:do-until-0\n", 3),
+        (b"UPDATE foo SET a = 1;\n", 1),
+    ],
+)
+def test_run_stream_meta_loop(mocker, tmp_path, content, runs):
+    path = tmp_path / "foo.dml.sql.gz"
+    with gzip.open(path, "wb") as file:
+        file.write(content)
+    rows_remaining = iter([True, True, False])
+    sent = []
+
+    def run_simple(script):
+        stdin = io.BytesIO()
+        stdin.close = lambda: None
+        script._write_input(stdin)
+        sent.append(stdin.getvalue())
+        return runner.Output(rows_remaining=next(rows_remaining))
+
+    mocker.patch.object(Script, "_run_simple", autospec=True, side_effect=run_simple)
+
+    with files.open_migration(path) as stream:
+        Script(configuration.Settings(), stream, path).run()
+
+    # With directives, the file is decompressed again for each run
+    assert sent == [content] * runs
+
+
+def test_run_over_cached_connections(mocker, tmp_path):
+    statuses = iter(["UPDATE 2", "UPDATE 0"])
+
+    def run_script(settings, statements, callback):
+        assert statements == ["UPDATE foo SET a = 1;"]
+        callback(next(statuses))
+
+    db_run_script = mocker.patch("septentrion.db.run_script", side_effect=run_script)
+    run_simple = mocker.patch("septentrion.runner.Script._run_simple")
+    content = b"--meta-psql:do-until-0\nUPDATE foo SET a = 1;\n"
+    script = Script(configuration.Settings(), content, tmp_path / "foo.dml.sql")
+
+    with db_module.use_connection_cache(db_module.ConnectionCache(run_scripts=True)):
+        script.run()
+
+    # Run until no row is updated, without psql
+    assert db_run_script.call_count == 2
+    run_simple.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "content, run_scripts",
+    [
+        (b"\\set foo 1\nSELECT :foo;\n", True),
+        (b"COPY foo (a) FROM stdin;\n1\n2\n\\.\n", True),
+        (b"SELECT 1;\n", False),
+    ],
+)
+def test_run_over_cached_connections_psql(mocker, tmp_path, content, run_scripts):
+    db_run_script = mocker.patch("septentrion.db.run_script")
+    run_simple = mocker.patch("septentrion.runner.Script._run_simple")
+    script = Script(configuration.Settings(), content, tmp_path / "foo.ddl.sql")
+    cache = db_module.ConnectionCache(run_scripts=run_scripts)
+
+    with db_module.use_connection_cache(cache):
+        script.run()
+
+    run_simple.assert_called_once_with()
+    db_run_script.assert_not_called()
@@ -0,0 +1,137 @@
+import os
+import pathlib
+import shutil
+
+import pytest
+
+from septentrion import archives, configuration, runner, snapshots
+
+
+@pytest.fixture
+def migrations_root(tmp_path):
+    root = tmp_path / "migrations"
+    shutil.copytree("example_migrations", root)
+    return root
+
+
+def test_iter_repository_files(migrations_root):
+    paths = [
+        path.relative_to(migrations_root).as_posix()
+        for path in snapshots.iter_repository_files(migrations_root)
+    ]
+
+    assert paths[:2] == ["0.1/.empty", "1.0/1.0-0-version-dml.sql"]
+    assert paths[-1] == "schemas/schema_0.1.sql"
+    assert paths == sorted(paths)
+
+
+def test_get_repository_key(migrations_root):
+    settings = configuration.Settings(migrations_root=migrations_root)
+    key = snapshots.get_repository_key(settings=settings)
+
+    # Stable
+    assert snapshots.get_repository_key(settings=settings) == key
+
+    # Depends on the settings
+    other_settings = configuration.Settings(
+        migrations_root=migrations_root, target_version="1.1"
+    )
+    assert snapshots.get_repository_key(settings=other_settings) != key
+
+    # Depends on the contents of the files, not their modification time
+    path = migrations_root / "1.1" / "1.1-index-ddl.sql"
+    os.utime(path, (0, 0))
+    assert snapshots.get_repository_key(settings=settings) == key
+    path.write_text("SELECT 1;")
+    assert snapshots.get_repository_key(settings=settings) != key
+
+
+def test_get_repository_key_archive(migrations_root, tmp_path):
+    output = tmp_path / "migrations.zip"
+    archives.pack(root=migrations_root, output=output)
+
+    folder_settings = configuration.Settings(migrations_root=migrations_root)
+    archive_settings = configuration.Settings(migrations_root=output)
+
+    assert snapshots.get_repository_key(
+        settings=folder_settings
+    ) == snapshots.get_repository_key(settings=archive_settings)
+
+
+def test_get_snapshot_path(migrations_root, tmp_path):
+    settings = configuration.Settings(
+        migrations_root=migrations_root, snapshot_dir=tmp_path / "snapshots"
+    )
+
+    path = snapshots.get_snapshot_path(settings=settings)
+
+    assert path.parent == tmp_path / "snapshots"
+    assert path.name.endswith(".dump")
+
+
+def test_get_snapshot_path_disabled(migrations_root):
+    settings = configuration.Settings(migrations_root=migrations_root)
+
+    assert snapshots.get_snapshot_path(settings=settings) is None
+
+
+def write_snapshot(directory: pathlib.Path, name: str, size: int, mtime: int):
+    path = directory / name
+    path.write_bytes(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_evict_snapshots(tmp_path):
+    mib = 1024 * 1024
+    oldest = write_snapshot(tmp_path, "a.dump", mib, 1)
+    old = write_snapshot(tmp_path, "b.dump", mib, 2)
+    recent = write_snapshot(tmp_path, "c.dump", mib, 3)
+    other = write_snapshot(tmp_path, "other.txt", mib, 0)
+
+    snapshots.evict_snapshots(directory=tmp_path, max_size=2)
+
+    assert not oldest.exists()
+    assert old.exists()
+    assert recent.exists()
+    assert other.exists()
+
+
+def test_evict_snapshots_keep(tmp_path):
+    kept = write_snapshot(tmp_path, "a.dump", 2 * 1024 * 1024, 1)
+    recent = write_snapshot(tmp_path, "b.dump", 1024 * 1024, 2)
+
+    snapshots.evict_snapshots(directory=tmp_path, max_size=1, keep=kept)
+
+    assert kept.exists()
+    assert recent.exists()
+
+
+def test_save_snapshot(mocker, tmp_path):
+    def pg_dump(settings, args):
+        pathlib.Path(args[-1].partition("=")[2]).write_bytes(b"dump")
+
+    run_command = mocker.patch("septentrion.runner.run_command", side_effect=pg_dump)
+    settings = configuration.Settings(snapshot_max_size=10)
+    path = tmp_path / "snapshots" / "key.dump"
+
+    snapshots.save_snapshot(settings=settings, path=path)
+
+    assert path.read_bytes() == b"dump"
+    assert os.listdir(path.parent) == ["key.dump"]
+    assert run_command.call_args.kwargs["args"][0] == "pg_dump"
+
+
+def test_save_snapshot_error(mocker, tmp_path):
+    def pg_dump(settings, args):
+        pathlib.Path(args[-1].partition("=")[2]).write_bytes(b"partial")
+        raise runner.SQLRunnerException("boom")
+
+    mocker.patch("septentrion.runner.run_command", side_effect=pg_dump)
+    settings = configuration.Settings()
+    path = tmp_path / "key.dump"
+
+    with pytest.raises(runner.SQLRunnerException):
+        snapshots.save_snapshot(settings=settings, path=path)
+
+    assert os.listdir(tmp_path) == []
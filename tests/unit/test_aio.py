@@ -0,0 +1,202 @@
+import asyncio
+import contextlib
+import gzip
+import sys
+
+import pytest
+
+from septentrion import aio, configuration, exceptions, runner
+
+
+class FakeConnection:
+    """
+    An asyncpg connection to a database holding only the migrations table
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    async def execute(self, query, *args):
+        self.queries.append(query)
+        if query.lstrip().startswith("INSERT"):
+            self.rows.append(args[:2])
+
+    async def fetchrow(self, query, *args):
+        return (True,) if self.rows else None
+
+    async def fetch(self, query, *args):
+        if "ANY" in query:
+            return [row for row in self.rows if row[0] in args[0]]
+        return [(version,) for version in {version for version, _ in self.rows}]
+
+
+@pytest.fixture
+def connection(mocker):
+    connection = FakeConnection(rows=[])
+
+    @contextlib.asynccontextmanager
+    async def connect(settings):
+        yield connection
+
+    mocker.patch("septentrion.aio.connect", connect)
+    return connection
+
+
+@pytest.fixture
+def scripts(mocker):
+    paths = []
+
+    async def run_script(settings, path, progress=None):
+        paths.append(path.name)
+
+    mocker.patch("septentrion.aio.run_script", run_script)
+    return paths
+
+
+def test_format_query():
+    settings = configuration.Settings(table='my "table"', name_column="n")
+
+    assert (
+        aio.format_query(settings, "SELECT {name_column} FROM {table} WHERE a = %s")
+        == 'SELECT "n" FROM "my ""table""" WHERE a = $1'
+    )
+
+
+def test_import_asyncpg_missing(mocker):
+    mocker.patch.dict(sys.modules, {"asyncpg": None})
+
+    with pytest.raises(
+        exceptions.SeptentrionException, match=r"septentrion\[asyncpg\]"
+    ):
+        aio._import_asyncpg()
+
+
+def test_migrate(connection, scripts):
+    connection.rows.extend(
+        [
+            ("1.1", "1.1-0-version-dml.sql"),
+            ("1.1", "1.1-add-num-pages-1-ddl.sql"),
+            ("1.1", "1.1-add-num-pages-2-dml.sql"),
+            ("1.1", "1.1-index-ddl.sql"),
+            ("1.2", "1.2-0-version-dml.sql"),
+        ]
+    )
+
+    asyncio.run(
+        aio.migrate(
+            migrations_root="example_migrations", target_version="1.3", quiet=True
+        )
+    )
+
+    expected = [
+        "1.2-remove-author-dob-ddl.sql",
+        "1.2-rename-num-pages-ddl.sql",
+        "1.3-0-version-dml.sql",
+        "1.3-add-readers-ddl.sql",
+        "1.3-add-readers-dml.sql",
+        "1.3-remove-author-dob-ddl.sql",
+        "1.3-rename-num-pages-ddl.sql",
+    ]
+    assert scripts == expected
+    assert [name for _, name in connection.rows[5:]] == expected
+    assert "CREATE TABLE" in connection.queries[0]
+
+
+def test_migrate_empty_database(connection, scripts, mocker):
+    migrate = mocker.patch("septentrion.migration.migrate")
+
+    asyncio.run(aio.migrate(migrations_root="example_migrations", quiet=True))
+
+    migrate.assert_called_once()
+    assert scripts == []
+
+
+def test_is_schema_initialized_undefined_table(mocker):
+    error = Exception("relation does not exist")
+    error.sqlstate = aio.UNDEFINED_TABLE
+    connection = mocker.Mock(fetchrow=mocker.AsyncMock(side_effect=error))
+    settings = configuration.Settings()
+
+    assert asyncio.run(aio._is_schema_initialized(connection, settings)) is False
+
+
+def test_is_schema_initialized(connection):
+    assert asyncio.run(aio.is_schema_initialized(create_table=False)) is False
+    connection.rows.append(("1.1", "a.sql"))
+    assert asyncio.run(aio.is_schema_initialized(create_table=False)) is True
+    assert connection.queries == []
+
+
+def test_fake(connection):
+    asyncio.run(
+        aio.fake("1.0", migrations_root="example_migrations", create_table=False)
+    )
+
+    assert connection.rows == [
+        ("1.0", "1.0-0-version-dml.sql"),
+        ("1.0", "1.0-author-1-ddl.sql"),
+        ("1.0", "1.0-author-2-dml.sql"),
+        ("1.0", "1.0-book-1-ddl.sql"),
+        ("1.0", "1.0-book-2-dml.sql"),
+    ]
+
+
+@pytest.fixture
+def fake_psql(tmp_path, monkeypatch):
+    """
+    Put a "psql" executable running the given shell script in the PATH
+    """
+
+    def _fake_psql(script):
+        path = tmp_path / "psql"
+        path.write_text(f"#!/bin/sh\n{script}\n")
+        path.chmod(0o755)
+        monkeypatch.setenv("PATH", str(tmp_path), prepend=":")
+
+    return _fake_psql
+
+
+def test_script_run_async(fake_psql, tmp_path):
+    fake_psql("cat")
+    lines = b"UPDATE 0\nUPDATE 2\nUPDATE 0\n"
+    script = aio.Script(
+        configuration.Settings(), file_handler=lines, path=tmp_path / "a.sql"
+    )
+
+    output = asyncio.run(script._run_simple_async())
+
+    assert (output.lines, output.rows_remaining) == (3, True)
+
+
+def test_script_run_async_error(fake_psql, tmp_path):
+    fake_psql("cat > /dev/null; echo 'ERROR: nope' >&2; exit 3")
+    script = aio.Script(
+        configuration.Settings(), file_handler=b"SELECT 1;", path=tmp_path / "a.sql"
+    )
+
+    with pytest.raises(runner.SQLRunnerException, match="ERROR: nope"):
+        asyncio.run(script.run_async())
+
+
+def test_run_script_compressed(fake_psql, tmp_path, mocker):
+    # Changes rows on the first run only
+    done = tmp_path / "done"
+    fake_psql(
+        f"cat >> {tmp_path / 'input.sql'}; "
+        f"if [ -e {done} ]; then echo 'UPDATE 0'; "
+        f"else touch {done}; echo 'UPDATE 2'; fi"
+    )
+    content = b"UPDATE foo SET a = 1;\n--meta-psql:done\n"
+    path = tmp_path / "a.sql.gz"
+    with gzip.open(path, "wb") as file:
+        file.write(content)
+    run_in_executor = mocker.spy(aio, "_run_in_executor")
+
+    asyncio.run(aio.run_script(configuration.Settings(), path))
+
+    # Run until no row changes, decompressing the file for each run
+    assert (tmp_path / "input.sql").read_bytes() == content * 2
+    # The file is opened, decompressed and searched out of the event loop
+    functions = {call[0][0].__name__ for call in run_in_executor.call_args_list}
+    assert functions == {"enter_context", "read", "_has_meta_directives", "_reopen"}
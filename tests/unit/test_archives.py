@@ -0,0 +1,83 @@
+import io
+import pathlib
+import zipfile
+
+import pytest
+
+from septentrion import archives
+
+
+@pytest.fixture
+def archive():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        zip_file.writestr("1.0/1.0-a-ddl.sql", "CREATE TABLE a ();")
+        zip_file.writestr("1.0/manual/1.0-b-dml.sql", "UPDATE a SET b = 1;")
+        zip_file.writestr("1.1/", "")
+        zip_file.writestr("schemas/schema_1.0.sql", "")
+    return archives.Archive(buffer)  # type: ignore
+
+
+def test_archive_index(archive):
+    assert sorted(str(folder) for folder in archive.folders) == [
+        ".",
+        "1.0",
+        "1.0/manual",
+        "1.1",
+        "schemas",
+    ]
+    assert archive.folders[pathlib.PurePosixPath()] == {"1.0", "1.1", "schemas"}
+
+
+def test_archive_path_iterdir(archive):
+    root = archives.ArchivePath(archive)
+
+    assert [path.name for path in root.iterdir()] == ["1.0", "1.1", "schemas"]
+    assert [path.name for path in (root / "1.0").iterdir()] == [
+        "1.0-a-ddl.sql",
+        "manual",
+    ]
+
+
+@pytest.mark.parametrize(
+    "member, is_dir, is_file",
+    [
+        ("1.0", True, False),
+        ("1.1", True, False),
+        ("1.0/1.0-a-ddl.sql", False, True),
+        ("1.2", False, False),
+    ],
+)
+def test_archive_path_types(archive, member, is_dir, is_file):
+    path = archives.ArchivePath(archive) / member
+
+    assert path.is_dir() is is_dir
+    assert path.is_file() is is_file
+    assert path.exists() is (is_dir or is_file)
+    assert path.is_symlink() is False
+
+
+def test_archive_path_pure_attributes(archive):
+    path = archives.ArchivePath(archive) / "1.0" / "manual" / "1.0-b-dml.sql"
+
+    assert path.name == "1.0-b-dml.sql"
+    assert path.suffixes == [".0-b-dml", ".sql"]
+    assert path.parts == ("1.0", "manual", "1.0-b-dml.sql")
+    assert path == archives.ArchivePath(archive, "1.0/manual/1.0-b-dml.sql")
+
+
+def test_archive_path_open(archive):
+    path = archives.ArchivePath(archive) / "1.0" / "1.0-a-ddl.sql"
+
+    with path.open() as f:
+        assert f.read() == b"CREATE TABLE a ();"
+    assert path.stat().st_size == 18
+
+
+def test_archive_path_missing(archive):
+    path = archives.ArchivePath(archive) / "nope"
+
+    with pytest.raises(FileNotFoundError):
+        list(path.iterdir())
+    with pytest.raises(FileNotFoundError):
+        path.open()
@@ -0,0 +1,159 @@
+import io
+
+import pytest
+
+from septentrion import bundles, exceptions
+from septentrion.versions import Version
+
+
+@pytest.fixture
+def settings(settings_factory):
+    return settings_factory(
+        table="migrations",
+        version_column="version",
+        name_column="name",
+        applied_at_column="applied_at",
+    )
+
+
+def bundled(name, sql="SELECT 1;\n", transactional=True):
+    return bundles.BundledMigration(
+        version=Version.from_string("1.1"),
+        name=name,
+        sql=sql,
+        transactional=transactional,
+    )
+
+
+def test_get_bundle_versions(mocker, settings):
+    mocker.patch(
+        "septentrion.files.get_known_versions",
+        return_value=[Version.from_string(v) for v in ["1.0", "1.1", "1.2", "1.3"]],
+    )
+
+    result = bundles.get_bundle_versions(
+        settings=settings,
+        from_version=Version.from_string("1.1"),
+        to_version=Version.from_string("1.2"),
+    )
+
+    assert result == [Version.from_string("1.1"), Version.from_string("1.2")]
+
+
+def test_get_bundle_versions_includes_from_version(mocker, settings):
+    mocker.patch(
+        "septentrion.files.get_known_versions",
+        return_value=[Version.from_string(v) for v in ["1.0", "1.1"]],
+    )
+
+    result = bundles.get_bundle_versions(
+        settings=settings, from_version=Version.from_string("1.0"), to_version=None
+    )
+
+    assert result == [Version.from_string("1.0"), Version.from_string("1.1")]
+
+
+def test_get_bundle_versions_latest(mocker, settings):
+    mocker.patch(
+        "septentrion.files.get_known_versions",
+        return_value=[Version.from_string(v) for v in ["1.0", "1.1"]],
+    )
+
+    result = bundles.get_bundle_versions(
+        settings=settings, from_version=Version.from_string("0.9"), to_version=None
+    )
+
+    assert result == [Version.from_string("1.0"), Version.from_string("1.1")]
+
+
+def test_get_bundle_versions_unknown(mocker, settings):
+    mocker.patch("septentrion.files.get_known_versions", return_value=[])
+
+    with pytest.raises(exceptions.SeptentrionException):
+        bundles.get_bundle_versions(
+            settings=settings,
+            from_version=Version.from_string("1.0"),
+            to_version=Version.from_string("1.2"),
+        )
+
+
+def test_unwrap_transaction_none():
+    assert bundles.unwrap_transaction("SELECT 1;\n") == ("SELECT 1;\n", False)
+
+
+def test_unwrap_transaction():
+    sql = "\\timing\n-- hello\nBEGIN;\nSELECT 1;\n-- done\nCOMMIT;\n"
+
+    assert bundles.unwrap_transaction(sql) == (
+        "\\timing\n-- hello\n\nSELECT 1;\n-- done\n",
+        False,
+    )
+
+
+def test_unwrap_transaction_function_body():
+    sql = (
+        "CREATE FUNCTION f() RETURNS void AS $$ BEGIN PERFORM 1; END; $$ "
+        "LANGUAGE plpgsql;\n"
+    )
+
+    assert bundles.unwrap_transaction(sql) == (sql, False)
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "BEGIN;\nSELECT 1;\nCOMMIT;\nBEGIN;\nSELECT 2;\nCOMMIT;\n",
+        "SELECT 1;\nCOMMIT;\n",
+        "BEGIN;\nSELECT 1;\nROLLBACK;\n",
+    ],
+)
+def test_unwrap_transaction_controlled(sql):
+    assert bundles.unwrap_transaction(sql) == (sql, True)
+
+
+def test_get_insert_statement(settings):
+    migration = bundled("it's.sql")
+
+    assert bundles.get_insert_statement(settings=settings, migration=migration) == (
+        'INSERT INTO "migrations" ("version", "name", "applied_at") '
+        "VALUES ('1.1', 'it''s.sql', clock_timestamp());\n"
+    )
+
+
+def test_write_bundle(mocker, settings):
+    mocker.patch("septentrion.bundles.get_insert_statement", return_value="INSERT;\n")
+    output = io.StringIO()
+
+    bundles.write_bundle(
+        settings=settings,
+        bundle=[
+            bundled("a.sql"),
+            bundled("b.sql", sql="SELECT 2"),
+            bundled("c.sql", transactional=False),
+            bundled("d.sql"),
+        ],
+        output=output,
+    )
+
+    assert output.getvalue() == (
+        "-- Generated by septentrion, run it with psql\n"
+        "\\set ON_ERROR_STOP on\n"
+        "\nBEGIN;\n"
+        "\n\\echo Applying 1.1 a.sql\nSELECT 1;\nINSERT;\n"
+        "\n\\echo Applying 1.1 b.sql\nSELECT 2\n;\nINSERT;\n"
+        "\nCOMMIT;\n"
+        "\n\\echo Applying 1.1 c.sql\nSELECT 1;\nINSERT;\n"
+        "\nBEGIN;\n"
+        "\n\\echo Applying 1.1 d.sql\nSELECT 1;\nINSERT;\n"
+        "\nCOMMIT;\n"
+    )
+
+
+def test_write_bundle_single_transaction(settings):
+    with pytest.raises(exceptions.SeptentrionException):
+        bundles.write_bundle(
+            settings=settings,
+            bundle=[bundled("a.sql"), bundled("b.sql", transactional=False)],
+            output=io.StringIO(),
+            single_transaction=True,
+        )
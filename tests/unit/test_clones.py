@@ -0,0 +1,85 @@
+from septentrion import clones, configuration
+
+
+def test_get_clone_names():
+    assert clones.get_clone_names(prefix="test_", count=3) == [
+        "test_0",
+        "test_1",
+        "test_2",
+    ]
+
+
+def test_is_template_up_to_date(mocker):
+    mocker.patch(
+        "septentrion.db.get_database_comment", return_value=(True, "septentrion:abc")
+    )
+    settings = configuration.Settings()
+
+    assert clones.is_template_up_to_date(settings=settings, template="t", key="abc")
+    assert not clones.is_template_up_to_date(settings=settings, template="t", key="def")
+
+
+def test_is_template_up_to_date_missing(mocker):
+    mocker.patch("septentrion.db.get_database_comment", return_value=(False, None))
+    settings = configuration.Settings()
+
+    assert not clones.is_template_up_to_date(settings=settings, template="t", key="abc")
+
+
+def test_prepare_template_up_to_date(mocker):
+    mocker.patch("septentrion.snapshots.get_repository_key", return_value="abc")
+    mocker.patch(
+        "septentrion.db.get_database_comment", return_value=(True, "septentrion:abc")
+    )
+    create_database = mocker.patch("septentrion.db.create_database")
+    migrate = mocker.patch("septentrion.migration.migrate")
+    settings = configuration.Settings(dbname="postgres")
+
+    clones.prepare_template(settings=settings, template="test_template")
+
+    create_database.assert_not_called()
+    migrate.assert_not_called()
+
+
+def test_prepare_template(mocker):
+    mocker.patch("septentrion.snapshots.get_repository_key", return_value="abc")
+    mocker.patch(
+        "septentrion.db.get_database_comment", return_value=(True, "septentrion:old")
+    )
+    drop_database = mocker.patch("septentrion.db.drop_database")
+    create_database = mocker.patch("septentrion.db.create_database")
+    create_table = mocker.patch("septentrion.db.create_table")
+    migrate = mocker.patch("septentrion.migration.migrate")
+    comment_database = mocker.patch("septentrion.db.comment_database")
+    settings = configuration.Settings(dbname="postgres")
+
+    clones.prepare_template(settings=settings, template="test_template")
+
+    drop_database.assert_called_once_with(settings=settings, dbname="test_template")
+    create_database.assert_called_once_with(settings=settings, dbname="test_template")
+    # The template itself is migrated
+    assert create_table.call_args.kwargs["settings"].DBNAME == "test_template"
+    assert migrate.call_args.kwargs["settings"].DBNAME == "test_template"
+    comment_database.assert_called_once_with(
+        settings=settings, dbname="test_template", comment="septentrion:abc"
+    )
+    assert settings.DBNAME == "postgres"
+
+
+def test_clone_databases(mocker):
+    prepare_template = mocker.patch("septentrion.clones.prepare_template")
+    drop_database = mocker.patch("septentrion.db.drop_database")
+    create_database = mocker.patch("septentrion.db.create_database")
+    settings = configuration.Settings(dbname="postgres")
+
+    names = clones.clone_databases(settings=settings, count=2, prefix="test_")
+
+    assert names == ["test_0", "test_1"]
+    prepare_template.assert_called_once_with(
+        settings=settings, template="test_template", stylist=mocker.ANY
+    )
+    assert [call.kwargs["dbname"] for call in drop_database.call_args_list] == names
+    assert [call.kwargs for call in create_database.call_args_list] == [
+        {"settings": settings, "dbname": "test_0", "template": "test_template"},
+        {"settings": settings, "dbname": "test_1", "template": "test_template"},
+    ]
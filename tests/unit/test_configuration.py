@@ -137,3 +137,51 @@ def test_settings_clean_schema_version():
     schema = configuration.Settings(schema_version="1.2.3").SCHEMA_VERSION
 
     assert schema == versions.Version(version_tuple=(1, 2, 3), original_string="1.2.3")
+
+
+def test_settings_clean_discovery_workers():
+    assert configuration.Settings(discovery_workers="4").DISCOVERY_WORKERS == 4
+
+
+def test_settings_clean_schema_file_workers():
+    assert configuration.Settings(schema_file_workers="4").SCHEMA_FILE_WORKERS == 4
+
+
+def test_settings_clean_snapshot_dir():
+    settings = configuration.Settings(snapshot_dir="snapshots", snapshot_max_size="5")
+
+    assert settings.SNAPSHOT_DIR == pathlib.Path("snapshots")
+    assert settings.SNAPSHOT_MAX_SIZE == 5
+
+
+def test_settings_clean_snapshot_dir_default():
+    assert configuration.Settings().SNAPSHOT_DIR is None
+
+
+def test_settings_clean_restore_jobs(mocker):
+    mocker.patch("os.cpu_count", return_value=8)
+
+    assert configuration.Settings(restore_jobs="2").RESTORE_JOBS == 2
+    assert configuration.Settings().RESTORE_JOBS == 8
+
+
+def test_settings_replace():
+    settings = configuration.Settings(dbname="a", target_version="1.1")
+
+    other = settings.replace(dbname="b")
+
+    assert other.DBNAME == "b"
+    assert other.TARGET_VERSION == settings.TARGET_VERSION
+    assert settings.DBNAME == "a"
+
+
+def test_settings_with_session_options():
+    settings = configuration.Settings(dbname="a")
+
+    other = settings.with_session_options({"work_mem": "64MB"})
+
+    assert other.SESSION_OPTIONS == {"work_mem": "64MB"}
+    assert other.replace(dbname="b").SESSION_OPTIONS == {"work_mem": "64MB"}
+    assert settings.SESSION_OPTIONS == {}
+    # Not a configuration value
+    assert "session_options" not in configuration.DEFAULTS
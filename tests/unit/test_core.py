@@ -2,7 +2,7 @@ import pathlib
 
 import pytest
 
-from septentrion import configuration, core, exceptions
+from septentrion import configuration, core, exceptions, files, state
 from septentrion.versions import Version
 
 
@@ -158,18 +158,20 @@ def test_build_migration_plan_unknown_version(known_versions):
         list(core.build_migration_plan(settings, from_version=from_version))
 
 
-def test_build_migration_plan_db(mocker, known_versions):
+@pytest.mark.parametrize("discovery_workers", [1, 4])
+def test_build_migration_plan_db(mocker, known_versions, discovery_workers):
     # What a mock hell ><
 
-    # So first, we mock db.get_applied_migrations to tell the following story:
+    # So first, we mock db.get_applied_migrations_by_version to tell the
+    # following story:
     # - on 1.1, only migration "a" was previously applied.
     # - on 1.2, no migration was previously applied.
     mocker.patch(
-        "septentrion.db.get_applied_migrations",
-        side_effect=lambda settings, version: {
-            Version.from_string("1.1"): ["a"],
-            Version.from_string("1.2"): [],
-        }[version],
+        "septentrion.db.get_applied_migrations_by_version",
+        side_effect=lambda settings, versions_: {
+            Version.from_string("1.1"): {"a"},
+            Version.from_string("1.2"): set(),
+        },
     )
     # Then, regarding the migration files that exist on the disk:
     # - There are 2 files for 1.1 (so one already applied and one new)
@@ -188,18 +190,15 @@ def test_build_migration_plan_db(mocker, known_versions):
             Version.from_string("1.3"): {"d": pathlib.Path("d")},
         }[version],
     )
-    # The contents of each migration is ignored
-    mocker.patch("septentrion.files.file_lines_generator", return_value="")
-    # Migration "c" is a manual migration
-    mocker.patch(
-        "septentrion.files.is_manual_migration",
-        side_effect=(
-            lambda migration_path, migration_contents: str(migration_path) == "c"
-        ),
+    # Migration "c" is a manual migration (applied migrations are never read)
+    get_migration_metadata = mocker.patch(
+        "septentrion.files.get_migration_metadata",
+        side_effect=lambda path: files.MigrationMetadata(manual=str(path) == "c"),
     )
     # We'll apply migrations up until 1.2 included
     settings = configuration.Settings(
         target_version=Version.from_string("1.2"),
+        discovery_workers=discovery_workers,
     )
     # And we'll start at version 1.1 included
     from_version = Version.from_string("1.1")
@@ -225,10 +224,168 @@ def test_build_migration_plan_db(mocker, known_versions):
     ]
 
     assert list(plan) == expected
+    assert sorted(call.args[0] for call in get_migration_metadata.call_args_list) == [
+        pathlib.Path("b"),
+        pathlib.Path("c"),
+    ]
+
+
+@pytest.fixture
+def migration_files(mocker):
+    mocker.patch(
+        "septentrion.db.get_applied_migrations_by_version",
+        side_effect=lambda settings, versions_: {
+            version: {"1.1": {"a"}, "1.2": {"c"}}.get(str(version), set())
+            for version in versions_
+        },
+    )
+    return mocker.patch(
+        "septentrion.files.get_migrations_files_mapping",
+        side_effect=lambda settings, version: {
+            Version.from_string("1.1"): {
+                "a": pathlib.Path("a"),
+                "b": pathlib.Path("b"),
+            },
+            Version.from_string("1.2"): {"c": pathlib.Path("c")},
+            Version.from_string("1.3"): {"d": pathlib.Path("d")},
+        }[version],
+    )
+
+
+def test_iter_migration_plan(known_versions, migration_files):
+    settings = configuration.Settings(target_version=None)
+    v11, v12, v13 = (Version.from_string(v) for v in ("1.1", "1.2", "1.3"))
+
+    plan = list(core.iter_migration_plan(settings=settings, from_version=v11))
+
+    assert plan == [
+        core.VersionPlan(
+            version=v11,
+            steps=[
+                core.MigrationStep(v11, "a", True, pathlib.Path("a")),
+                core.MigrationStep(v11, "b", False, pathlib.Path("b")),
+            ],
+        ),
+        core.VersionPlan(
+            version=v12, steps=[core.MigrationStep(v12, "c", True, pathlib.Path("c"))]
+        ),
+        core.VersionPlan(
+            version=v13, steps=[core.MigrationStep(v13, "d", False, pathlib.Path("d"))]
+        ),
+    ]
+
+
+def test_iter_migration_plan_pending_only(known_versions, migration_files):
+    settings = configuration.Settings(target_version=None)
+    v11, v13 = Version.from_string("1.1"), Version.from_string("1.3")
+
+    steps = list(
+        core.iter_migration_steps(
+            settings=settings, from_version=v11, pending_only=True
+        )
+    )
+
+    assert steps == [
+        core.MigrationStep(v11, "b", False, pathlib.Path("b")),
+        core.MigrationStep(v13, "d", False, pathlib.Path("d")),
+    ]
+
+
+def test_iter_migration_plan_last(known_versions, migration_files):
+    settings = configuration.Settings(target_version=None)
+    v13 = Version.from_string("1.3")
+
+    plan = list(
+        core.iter_migration_plan(
+            settings=settings, from_version=Version.from_string("1.1"), last=1
+        )
+    )
+
+    assert plan == [
+        core.VersionPlan(
+            version=v13, steps=[core.MigrationStep(v13, "d", False, pathlib.Path("d"))]
+        ),
+    ]
+    # Older version folders are not listed
+    migration_files.assert_called_once_with(settings=settings, version=v13)
+
+
+def test_describe_migration_plan_last(mocker, known_versions, migration_files):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=True)
+    mocker.patch(
+        "septentrion.db.get_current_schema_version",
+        return_value=Version.from_string("1.1"),
+    )
+    stylist = mocker.MagicMock()
+    settings = configuration.Settings(target_version=None)
+
+    core.describe_migration_plan(settings=settings, stylist=stylist, last=1)
+
+    echo = stylist.activate.return_value.__enter__.return_value
+    echoed = [call.args[0] for call in echo.call_args_list]
+    assert "2 earlier versions not shown" in echoed
+    assert "Version 1.3" in echoed
+    assert "Version 1.2" not in echoed
+
+
+@pytest.mark.parametrize("discovery_workers", [1, 2])
+def test_get_first_pending_step(
+    mocker, known_versions, migration_files, discovery_workers
+):
+    get_migration_metadata = mocker.patch("septentrion.files.get_migration_metadata")
+    settings = configuration.Settings(
+        target_version=None, discovery_workers=discovery_workers
+    )
+    v11 = Version.from_string("1.1")
+
+    step = core.get_first_pending_step(settings=settings, from_version=v11)
+
+    assert step == core.MigrationStep(v11, "b", False, pathlib.Path("b"))
+    # Versions after the first batch of listings are not looked at, and no
+    # migration file is read
+    listed = {call[1]["version"] for call in migration_files.call_args_list}
+    assert v11 in listed
+    assert Version.from_string("1.3") not in listed
+    assert len(listed) <= discovery_workers
+    get_migration_metadata.assert_not_called()
+
+
+def test_get_first_pending_step_none(mocker, known_versions):
+    mocker.patch(
+        "septentrion.db.get_applied_migrations_by_version",
+        side_effect=lambda settings, versions_: {v: {"a"} for v in versions_},
+    )
+    mocker.patch(
+        "septentrion.files.get_migrations_files_mapping",
+        return_value={"a": pathlib.Path("a")},
+    )
+    settings = configuration.Settings(target_version=None)
+
+    step = core.get_first_pending_step(
+        settings=settings, from_version=Version.from_string("1.1")
+    )
+
+    assert step is None
+
+
+def test_migration_step_manual(mocker):
+    get_migration_metadata = mocker.patch(
+        "septentrion.files.get_migration_metadata",
+        return_value=files.MigrationMetadata(manual=True),
+    )
+    step = core.MigrationStep(Version.from_string("1.1"), "a", False, pathlib.Path("a"))
+
+    assert step.manual is True
+    assert step.manual is True
+    get_migration_metadata.assert_called_once_with(pathlib.Path("a"))
+    assert step.as_tuple() == ("a", False, pathlib.Path("a"), True)
 
 
 def test_build_migration_plan_with_schema(mocker, known_versions):
-    mocker.patch("septentrion.core.db.get_applied_migrations", return_value=[])
+    mocker.patch(
+        "septentrion.core.db.get_applied_migrations_by_version",
+        side_effect=lambda settings, versions_: {v: set() for v in versions_},
+    )
     settings = configuration.Settings(target_version="1.2")
     from_version = Version.from_string("1.1")
 
@@ -242,7 +399,10 @@ def test_build_migration_plan_with_schema(mocker, known_versions):
 
 
 def test_build_migration_plan_with_no_target_version(mocker, known_versions):
-    mocker.patch("septentrion.core.db.get_applied_migrations", return_value=[])
+    mocker.patch(
+        "septentrion.core.db.get_applied_migrations_by_version",
+        side_effect=lambda settings, versions_: {v: set() for v in versions_},
+    )
     settings = configuration.Settings(target_version=None)
     from_version = Version.from_string("1.1")
 
@@ -254,3 +414,69 @@ def test_build_migration_plan_with_no_target_version(mocker, known_versions):
         {"plan": [], "version": Version.from_string("1.3")},
     ]
     assert list(plan) == expected
+
+
+def test_get_best_schema_version_compressed(mocker, known_versions):
+    mocker.patch(
+        "septentrion.core.files.get_special_files",
+        return_value=["schema_1.1.sql", "schema_1.2.sql.gz"],
+    )
+    settings = configuration.Settings(target_version=Version.from_string("1.3"))
+
+    version = core.get_best_schema_version(settings=settings)
+
+    assert version == Version.from_string("1.2")
+
+
+def test_get_best_schema_version_dump(mocker, known_versions):
+    mocker.patch(
+        "septentrion.core.files.get_special_files",
+        return_value=["schema_1.1.sql", "schema_1.2.dump"],
+    )
+    settings = configuration.Settings(target_version=Version.from_string("1.3"))
+
+    version = core.get_best_schema_version(settings=settings)
+
+    assert version == Version.from_string("1.2")
+
+
+def test_get_template_versions():
+    names = ["schema_1.1.sql", "schema_1.2.sql.gz", "schema_foo.sql", "other.sql"]
+
+    result = list(core.get_template_versions("schema_{}.sql", names))
+
+    assert result == [Version.from_string("1.1")]
+
+
+def test_get_closest_version_original_string(known_versions):
+    # The file must be named after the version folder
+    settings = configuration.Settings()
+
+    version = core.get_closest_version(
+        settings=settings,
+        target_version=None,
+        sql_tpl="schema_{}.sql",
+        existing_files=["schema_1.01.sql"],
+    )
+
+    assert version is None
+
+
+def test_describe_migration_plan_offline(mocker, known_versions):
+    execute = mocker.patch("septentrion.db.execute")
+    mocker.patch(
+        "septentrion.files.get_migrations_files_mapping",
+        side_effect=lambda settings, version: {f"{version}-a.sql": pathlib.Path("a")},
+    )
+    mocker.patch("septentrion.files.get_migration_metadata")
+    store = state.MemoryStateStore([("1.1", "1.1-a.sql"), ("1.2", "1.2-a.sql")])
+    stylist = mocker.MagicMock()
+    settings = configuration.Settings(target_version=None)
+
+    core.describe_migration_plan(settings=settings, stylist=stylist, store=store)
+
+    echo = stylist.activate.return_value.__enter__.return_value
+    echoed = [call.args[0] for call in echo.call_args_list]
+    assert "Current version is 1.2" in echoed
+    assert "Version 1.3" in echoed
+    execute.assert_not_called()
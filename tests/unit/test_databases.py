@@ -0,0 +1,231 @@
+import io
+
+import pytest
+
+from septentrion import configuration, databases, exceptions
+
+
+def test_read_database_names():
+    content = "tenant_1\n\n# comment\n  tenant_2  \ntenant_1\n"
+
+    assert databases.read_names(io.StringIO(content)) == [
+        "tenant_1",
+        "tenant_2",
+    ]
+
+
+def test_select_database():
+    settings = configuration.Settings(dbname="postgres")
+
+    assert databases.select_database(settings, "tenant_1").DBNAME == "tenant_1"
+
+
+def test_select_schema():
+    settings = configuration.Settings().with_session_options({"work_mem": "64MB"})
+
+    assert databases.select_schema(settings, 'a"b').SESSION_OPTIONS == {
+        "work_mem": "64MB",
+        "search_path": '"a""b", "public"',
+    }
+
+
+@pytest.mark.parametrize(
+    "initialized, version, expected", [(False, None, None), (True, "1.1", "1.1")]
+)
+def test_get_version(mocker, initialized, version, expected):
+    create_table = mocker.patch("septentrion.db.create_table")
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=initialized)
+    mocker.patch(
+        "septentrion.db.get_current_schema_version",
+        return_value=version and mocker.Mock(original_string=version),
+    )
+    settings = configuration.Settings(create_table=True)
+
+    assert databases.get_version(settings=settings) == expected
+    create_table.assert_called_once_with(settings=settings)
+
+
+def test_group_databases(mocker):
+    versions = {"a": "1.1", "b": None, "c": "1.1", "d": OSError("nope")}
+
+    def get_version(settings):
+        version = versions[settings.DBNAME]
+        if isinstance(version, Exception):
+            raise version
+        return version
+
+    mocker.patch("septentrion.databases.get_version", side_effect=get_version)
+    settings = configuration.Settings()
+
+    groups, failures = databases.group_targets(
+        settings=settings, names=["a", "b", "c", "d"], workers=2
+    )
+
+    assert groups == {"1.1": ["a", "c"], None: ["b"]}
+    assert failures == [
+        databases.Result(name="d", status=databases.STATUS_FAILED, error="nope")
+    ]
+
+
+def test_group_schemas_missing(mocker):
+    mocker.patch("septentrion.db.get_current_schema", return_value="public")
+    get_version = mocker.patch("septentrion.databases.get_version")
+    settings = configuration.Settings()
+
+    groups, failures = databases.group_targets(
+        settings=settings, names=["a"], select=databases.select_schema
+    )
+
+    assert groups == {}
+    assert failures == [
+        databases.Result(
+            name="a", status=databases.STATUS_FAILED, error="Schema a does not exist"
+        )
+    ]
+    get_version.assert_not_called()
+
+
+@pytest.fixture
+def plan():
+    return {
+        "schema_version": None,
+        "current_version": "1.1",
+        "versions": [
+            {
+                "version": "1.2",
+                "migrations": [{"name": "a.sql", "applied": False}],
+            }
+        ],
+    }
+
+
+def test_has_work(plan):
+    assert databases.has_work(plan) is True
+    plan["versions"][0]["migrations"][0]["applied"] = True
+    assert databases.has_work(plan) is False
+    plan["schema_version"] = "1.1"
+    assert databases.has_work(plan) is True
+
+
+def test_migrate_database(mocker, plan):
+    migrate_plan = mocker.patch("septentrion.migration.migrate_plan")
+    mocker.patch("septentrion.databases.get_version", return_value="1.2")
+    settings = configuration.Settings(dbname="postgres")
+
+    result = databases.migrate_target(settings=settings, name="a", plan=plan)
+
+    assert migrate_plan.call_args.kwargs["settings"].DBNAME == "a"
+    assert migrate_plan.call_args.kwargs["check_files"] is False
+    assert (result.name, result.status) == ("a", databases.STATUS_MIGRATED)
+    assert (result.from_version, result.to_version) == ("1.1", "1.2")
+
+
+def test_migrate_database_outdated_plan(mocker, plan):
+    own_plan = dict(plan, current_version="1.0")
+    migrate_plan = mocker.patch(
+        "septentrion.migration.migrate_plan",
+        side_effect=[exceptions.OutdatedPlan("nope"), None],
+    )
+    mocker.patch("septentrion.plans.build_plan", return_value=own_plan)
+    mocker.patch("septentrion.databases.get_version", return_value="1.2")
+    settings = configuration.Settings()
+
+    result = databases.migrate_target(settings=settings, name="a", plan=plan)
+
+    assert migrate_plan.call_args.kwargs["plan"] is own_plan
+    assert result.status == databases.STATUS_MIGRATED
+    assert result.from_version == "1.0"
+
+
+def test_migrate_database_error(mocker, plan):
+    mocker.patch(
+        "septentrion.migration.migrate_plan",
+        side_effect=exceptions.SeptentrionException("boom"),
+    )
+    settings = configuration.Settings()
+
+    result = databases.migrate_target(settings=settings, name="a", plan=plan)
+
+    assert result.failed
+    assert (result.error, result.from_version) == ("boom", "1.1")
+
+
+def test_migrate_databases(mocker, plan):
+    mocker.patch(
+        "septentrion.databases.group_targets",
+        return_value=(
+            {"1.1": ["a", "c"], None: ["b"]},
+            [databases.Result(name="d", status=databases.STATUS_FAILED)],
+        ),
+    )
+    build_plan = mocker.patch(
+        "septentrion.plans.build_plan", side_effect=[plan, ValueError("no schema")]
+    )
+
+    def migrate_target(settings, name, plan, select, connections):
+        assert connections is None
+        return databases.Result(name=name, status=databases.STATUS_MIGRATED)
+
+    mocker.patch("septentrion.databases.migrate_target", side_effect=migrate_target)
+    settings = configuration.Settings(migrations_root="example_migrations")
+
+    results = databases.migrate_targets(
+        settings=settings, names=["a", "b", "c", "d"], workers=2
+    )
+
+    # One plan per group, computed from its first database
+    assert [call.kwargs["settings"].DBNAME for call in build_plan.call_args_list] == [
+        "a",
+        "b",
+    ]
+    assert [(result.name, result.status) for result in results] == [
+        ("a", databases.STATUS_MIGRATED),
+        ("b", databases.STATUS_FAILED),
+        ("c", databases.STATUS_MIGRATED),
+        ("d", databases.STATUS_FAILED),
+    ]
+    assert results[1].error == "no schema"
+
+
+def test_migrate_targets_schemas(mocker, plan):
+    mocker.patch(
+        "septentrion.databases.group_targets", return_value=({"1.1": ["a"]}, [])
+    )
+    build_plan = mocker.patch("septentrion.plans.build_plan", return_value=plan)
+    migrate_target = mocker.patch(
+        "septentrion.databases.migrate_target",
+        return_value=databases.Result(name="a", status=databases.STATUS_MIGRATED),
+    )
+    settings = configuration.Settings()
+
+    databases.migrate_targets(
+        settings=settings, names=["a"], select=databases.select_schema
+    )
+
+    options = build_plan.call_args.kwargs["settings"].SESSION_OPTIONS
+    assert options["search_path"] == '"a", "public"'
+    assert migrate_target.call_args.kwargs["select"] is databases.select_schema
+    # The schemas share their connections, and scripts are run over them
+    connections = migrate_target.call_args.kwargs["connections"]
+    assert connections.switch_search_path and connections.run_scripts
+
+
+def test_format_summary():
+    results = [
+        databases.Result(
+            name="tenant_1",
+            status=databases.STATUS_MIGRATED,
+            from_version="1.1",
+            to_version="1.2",
+            duration=1.25,
+        ),
+        databases.Result(name="t2", status=databases.STATUS_FAILED, error="boom"),
+    ]
+
+    assert databases.format_summary(results, kind="Schema") == [
+        "Schema    Status    From  To   Duration",
+        "--------  --------  ----  ---  --------",
+        "tenant_1  migrated  1.1   1.2  1.2s",
+        "t2        failed    -     -    0.0s",
+        "t2: boom",
+    ]
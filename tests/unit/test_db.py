@@ -25,6 +25,24 @@ def test_get_applied_migrations(fake_db):
     fake_db.assert_called_once()
 
 
+def test_get_applied_migrations_by_version(fake_db):
+    settings = configuration.Settings()
+    fake_db.return_value = [["1.1", "first.sql"], ["1.1", "second.sql"]]
+    v11, v12 = Version.from_string("1.1"), Version.from_string("1.2")
+
+    result = db.get_applied_migrations_by_version(settings, [v11, v12])
+
+    assert result == {v11: {"first.sql", "second.sql"}, v12: set()}
+    fake_db.assert_called_once()
+
+
+def test_get_applied_migrations_by_version_empty(fake_db):
+    settings = configuration.Settings()
+
+    assert db.get_applied_migrations_by_version(settings, []) == {}
+    fake_db.assert_not_called()
+
+
 @pytest.mark.parametrize(
     "applied_versions, current_version",
     [([["1.0"], ["1.1"], ["1.2"]], Version.from_string("1.2")), ([], None)],
@@ -53,3 +71,170 @@ def test_is_schema_initialized(fake_db, db_responses, initialized):
     result = db.is_schema_initialized(settings)
 
     assert result is initialized
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.statusmessage = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, args=None):
+        self.connection.queries.append((query, args))
+        self.statusmessage = query.split()[0]
+        if query.startswith("BEGIN"):
+            self.connection.transaction_status = 2
+
+
+class FakeConnection:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.closed = 0
+        self.autocommit = True
+        self.rolled_back = False
+        self.queries = []
+        self.transaction_status = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.transaction_status
+
+    def set_session(self, autocommit):
+        self.autocommit = autocommit
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connect(mocker):
+    return mocker.patch(
+        "psycopg2.connect", side_effect=lambda **kwargs: FakeConnection(**kwargs)
+    )
+
+
+def test_get_connection_kwargs(monkeypatch):
+    monkeypatch.setenv("PGOPTIONS", "-c statement_timeout=0")
+    settings = configuration.Settings(
+        host="", port=5433, dbname="a"
+    ).with_session_options({"work_mem": "64MB"})
+
+    assert db.get_connection_kwargs(settings=settings) == {
+        "port": 5433,
+        "dbname": "a",
+        "options": "-c statement_timeout=0 -c work_mem=64MB",
+    }
+
+
+@pytest.mark.parametrize(
+    "error, expected", [(None, True), (psycopg2.errors.InsufficientPrivilege, False)]
+)
+def test_can_set_option(connect, mocker, error, expected):
+    if error:
+        mocker.patch.object(FakeCursor, "execute", side_effect=error)
+    rollback = mocker.spy(FakeConnection, "rollback")
+    settings = configuration.Settings()
+
+    result = db.can_set_option(
+        settings=settings, name="session_replication_role", value="replica"
+    )
+
+    assert result is expected
+    # The value was only set in a transaction, which is rolled back
+    rollback.assert_called_once()
+
+
+def test_get_connection(connect):
+    settings = configuration.Settings()
+
+    with db.get_connection(settings=settings) as first:
+        pass
+    with db.get_connection(settings=settings) as second:
+        pass
+
+    assert first is not second
+    assert first.closed and second.closed
+
+
+def test_get_connection_cached(connect):
+    settings = configuration.Settings()
+    cache = db.ConnectionCache()
+
+    with db.use_connection_cache(cache):
+        with db.get_connection(settings=settings) as first:
+            first.autocommit = False
+        with db.get_connection(settings=settings) as second:
+            pass
+        with db.get_connection(settings=settings.replace(dbname="b")) as other:
+            pass
+
+    assert first is second
+    assert first is not other
+    # Left in a transaction, then given back as it was opened
+    assert first.rolled_back and first.autocommit
+    assert not first.closed
+
+    cache.close()
+
+    assert first.closed and other.closed
+    with db.get_connection(settings=settings) as third:
+        pass
+    assert third is not first
+
+
+def test_get_connection_switch_search_path(connect):
+    settings = configuration.Settings().with_session_options(
+        {"work_mem": "64MB", "search_path": '"a"'}
+    )
+    cache = db.ConnectionCache(switch_search_path=True)
+
+    with db.use_connection_cache(cache):
+        with db.get_connection(settings=settings) as first:
+            pass
+        other_schema = settings.with_session_options(
+            {"work_mem": "64MB", "search_path": '"b"'}
+        )
+        with db.get_connection(settings=other_schema) as second:
+            pass
+
+    # A single connection for both schemas, without the search_path option
+    assert first is second
+    assert first.kwargs["options"] == "-c work_mem=64MB"
+    set_config = "SELECT pg_catalog.set_config('search_path', %s, false)"
+    assert first.queries == [
+        (set_config, ('"a"',)),
+        ("RESET search_path", None),
+        (set_config, ('"b"',)),
+        ("RESET search_path", None),
+    ]
+
+
+def test_run_script(connect):
+    settings = configuration.Settings()
+    statuses = []
+
+    with db.use_connection_cache(db.ConnectionCache()):
+        with db.get_connection(settings=settings) as connection:
+            pass
+        db.run_script(
+            settings=settings,
+            statements=["BEGIN;", "UPDATE foo SET a = 1;"],
+            callback=statuses.append,
+        )
+
+    assert statuses == ["BEGIN;", "UPDATE"]
+    # The transaction left open is rolled back, and the session discarded
+    assert [query for query, _ in connection.queries[-2:]] == [
+        "ROLLBACK",
+        "DISCARD ALL",
+    ]
@@ -12,6 +12,11 @@ from septentrion import configuration, exceptions, files, versions
         ("/foo.dml.sql", ["--meta-psql:done"], True),
         ("/blah.tgz", [], False),
         ("/foo.dml.sql", ["foo"], False),
+        ("/foo.dml.sql", ["-- comment", "", "--meta-psql:done"], True),
+        ("/foo.dml.sql.gz", ["--meta-psql:done"], True),
+        # Directives are only read in the header
+        ("/foo.dml.sql", ["SELECT 1;", "--meta-psql:done"], False),
+        ("/foo.ddl.sql", ["--meta-psql:done"], False),
     ],
 )
 def test_is_manual_migration(migration_path, migration_contents, expected):
@@ -76,6 +81,8 @@ def test_get_migrations_files_mapping(mocker):
             pathlib.Path("tests/test_data/sql/17.1/manual/file.sql"),
             pathlib.Path("tests/test_data/sql/17.1/manual/file.dml.sql"),
             pathlib.Path("tests/test_data/sql/17.1/manual/file.ddl.sql"),
+            pathlib.Path("tests/test_data/sql/17.1/manual/other.ddl.sql.xz"),
+            pathlib.Path("tests/test_data/sql/17.1/manual/other.ddl.tar.gz"),
         ],
     )
     settings = configuration.Settings(
@@ -89,4 +96,107 @@ def test_get_migrations_files_mapping(mocker):
     assert values == {
         "file.dml.sql": pathlib.Path("tests/test_data/sql/17.1/manual/file.dml.sql"),
         "file.ddl.sql": pathlib.Path("tests/test_data/sql/17.1/manual/file.ddl.sql"),
+        "other.ddl.sql": pathlib.Path(
+            "tests/test_data/sql/17.1/manual/other.ddl.sql.xz"
+        ),
     }
+
+
+@pytest.mark.parametrize(
+    "migration_path,migration_contents,expected",
+    [
+        ("/foo.ddl.sql", ["CREATE TABLE foo();"], files.MigrationMetadata()),
+        (
+            "/foo.dml.sql",
+            ["--meta-psql:do-until-0\n", "UPDATE foo SET a = 1;\n"],
+            files.MigrationMetadata(manual=True, meta=("do-until-0",)),
+        ),
+        (
+            "/foo.ddl.sql",
+            ["-- Some comment\n", "--septentrion:non-transactional\n", "VACUUM;\n"],
+            files.MigrationMetadata(transactional=False),
+        ),
+        (
+            "/foo.ddl.sql",
+            ["--septentrion:manual\n"],
+            files.MigrationMetadata(manual=True),
+        ),
+        (
+            "/foo.ddl.sql",
+            ["SELECT 1;\n", "--septentrion:manual\n"],
+            files.MigrationMetadata(),
+        ),
+    ],
+)
+def test_parse_migration_metadata(migration_path, migration_contents, expected):
+    assert (
+        files.parse_migration_metadata(
+            migration_path=pathlib.Path(migration_path),
+            migration_contents=migration_contents,
+        )
+        == expected
+    )
+
+
+def test_iter_header_lines_max_size(mocker):
+    mocker.patch("septentrion.files.HEADER_MAX_SIZE", 10)
+
+    lines = list(files.iter_header_lines(["-- abc\n", "-- def\n", "-- ghi\n"]))
+
+    assert lines == ["-- abc"]
+
+
+def test_header_lines(mocker):
+    mocker.patch("septentrion.files.HEADER_MAX_SIZE", 13)
+
+    assert files.header_lines(b"-- foo\n-- bar\n-- baz\n") == ["-- foo\n", "-- bar"]
+
+
+@pytest.mark.parametrize(
+    "name,expected",
+    [
+        ("schema_1.0.sql", "schema_1.0.sql"),
+        ("schema_1.0.sql.gz", "schema_1.0.sql"),
+        ("schema_1.0.sql.xz", "schema_1.0.sql"),
+        ("schema_1.0.sql.zst", "schema_1.0.sql"),
+        ("schema_1.0.sql.bz2", "schema_1.0.sql.bz2"),
+    ],
+)
+def test_strip_compression_suffix(name, expected):
+    assert files.strip_compression_suffix(name) == expected
+
+
+@pytest.mark.parametrize("immutable, calls", [(True, 1), (False, 2)])
+def test_get_known_versions_cache(mocker, immutable, calls):
+    mocker.patch("septentrion.files.archives.is_immutable", return_value=immutable)
+    iter_dirs = mocker.patch(
+        "septentrion.files.iter_dirs", return_value=[pathlib.Path("16.11")]
+    )
+    settings = configuration.Settings(migrations_root="some/package/migrations")
+
+    try:
+        first = files.get_known_versions(settings=settings)
+        first.append("something")
+        second = files.get_known_versions(settings=settings)
+    finally:
+        files._list_versions.cache_clear()
+
+    assert second == [versions.Version.from_string("16.11")]
+    assert iter_dirs.call_count == calls
+
+
+def test_frozen_root(mocker):
+    iter_dirs = mocker.patch(
+        "septentrion.files.iter_dirs", return_value=[pathlib.Path("16.11")]
+    )
+    root = pathlib.Path("some/migrations")
+
+    with files.frozen_root(root):
+        files._list_versions(root)
+        files._list_versions(root)
+        assert iter_dirs.call_count == 1
+    # Not cached anymore, and the cache was emptied
+    files._list_versions(root)
+    with files.frozen_root(root):
+        files._list_versions(root)
+    assert iter_dirs.call_count == 3
@@ -0,0 +1,80 @@
+import pathlib
+
+import pytest
+
+from septentrion import configuration, fixtures
+
+
+@pytest.fixture
+def table_files():
+    return [
+        fixtures.TableFile(table="author", path=pathlib.Path("author.csv")),
+        fixtures.TableFile(table="book", path=pathlib.Path("book.csv")),
+    ]
+
+
+def test_load_fixtures(mocker, table_files):
+    mocker.patch("septentrion.fixtures.read_manifest", return_value=table_files)
+    mocker.patch(
+        "septentrion.db.get_droppable_indexes",
+        return_value=[("book_title", "CREATE INDEX book_title ON book (title)")],
+    )
+    mocker.patch(
+        "septentrion.db.get_foreign_keys",
+        return_value=[("book", "book_author_fk", "FOREIGN KEY (author_id) ...")],
+    )
+    manager = mocker.Mock()
+    for name in [
+        "drop_constraint",
+        "drop_index",
+        "create_index",
+        "add_constraint",
+    ]:
+        manager.attach_mock(mocker.patch(f"septentrion.db.{name}"), name)
+    manager.attach_mock(
+        mocker.patch("septentrion.fixtures.load_table", return_value=2), "load_table"
+    )
+    progress = mocker.Mock()
+    settings = configuration.Settings(restore_jobs=1)
+
+    fixtures.load_fixtures(
+        settings=settings, path=pathlib.Path("fixtures_1.0.copy"), progress=progress
+    )
+
+    assert manager.mock_calls == [
+        mocker.call.drop_constraint(
+            settings=settings, table="book", name="book_author_fk"
+        ),
+        mocker.call.drop_index(settings=settings, index="book_title"),
+        mocker.call.load_table(settings, table_files[0]),
+        mocker.call.load_table(settings, table_files[1]),
+        mocker.call.create_index(settings, "CREATE INDEX book_title ON book (title)"),
+        mocker.call.add_constraint(
+            settings=settings,
+            table="book",
+            name="book_author_fk",
+            definition="FOREIGN KEY (author_id) ...",
+        ),
+    ]
+    progress.assert_called_with("(2/2 tables, 4 rows)")
+
+
+def test_load_fixtures_error(mocker, table_files):
+    mocker.patch("septentrion.fixtures.read_manifest", return_value=table_files)
+    mocker.patch(
+        "septentrion.db.get_droppable_indexes",
+        return_value=[("book_title", "CREATE INDEX book_title ON book (title)")],
+    )
+    mocker.patch("septentrion.db.get_foreign_keys", return_value=[])
+    mocker.patch("septentrion.db.drop_index")
+    create_index = mocker.patch("septentrion.db.create_index")
+    mocker.patch("septentrion.fixtures.load_table", side_effect=ValueError)
+
+    with pytest.raises(ValueError):
+        fixtures.load_fixtures(
+            settings=configuration.Settings(restore_jobs=2),
+            path=pathlib.Path("fixtures_1.0.copy"),
+        )
+
+    # Indexes are created again
+    create_index.assert_called_once()
@@ -1,6 +1,7 @@
+import psycopg2
 import pytest
 
-from septentrion import lib, style, versions
+from septentrion import configuration, db, files, lib, style, versions
 
 
 @pytest.mark.parametrize(
@@ -93,3 +94,144 @@ def test_get_known_versions(fake_db, mocker):
     assert lib.get_known_versions() == ["1.0.0", "1.2.3"]
 
     mock.assert_called_with(settings=mocker.ANY)
+
+
+def test_clone(fake_db, mocker):
+    create_table = mocker.patch("septentrion.db.create_table")
+    mock = mocker.patch(
+        "septentrion.clones.clone_databases", return_value=["test_0", "test_1"]
+    )
+
+    assert lib.clone(count=2) == ["test_0", "test_1"]
+
+    mock.assert_called_with(
+        count=2,
+        prefix="test_",
+        template=None,
+        settings=mocker.ANY,
+        stylist=mocker.ANY,
+    )
+    create_table.assert_not_called()
+
+
+@pytest.fixture
+def migrator(mocker):
+    mocker.patch("septentrion.db.create_table")
+    with lib.Migrator(migrations_root="example_migrations", quiet=True) as migrator:
+        yield migrator
+
+
+def test_migrator_settings():
+    settings = configuration.Settings(dbname="a")
+
+    migrator = lib.Migrator(settings, table="b")
+
+    assert (migrator.settings.DBNAME, migrator.settings.TABLE) == ("a", "b")
+    assert migrator.stylist is style.stylist
+
+
+def test_migrator_creates_table_once(migrator, mocker):
+    migrate = mocker.patch("septentrion.migration.migrate")
+
+    migrator.migrate()
+    migrator.migrate()
+
+    assert migrate.call_count == 2
+    db.create_table.assert_called_once_with(settings=migrator.settings)
+
+
+def test_migrator_caches_discovery(migrator, mocker):
+    list_dirs = mocker.spy(files, "iter_dirs")
+
+    assert files.get_known_versions(settings=migrator.settings)
+    assert files.get_known_versions(settings=migrator.settings)
+    list_dirs.assert_called_once()
+
+    migrator.close()
+    files.get_known_versions(settings=migrator.settings)
+    assert list_dirs.call_count == 2
+
+
+def test_migrator_reuses_connections(migrator, mocker):
+    def migrate(settings, stylist):
+        with db.get_connection(settings=settings) as first:
+            pass
+        with db.get_connection(settings=settings) as second:
+            assert first is second
+
+    mocker.patch("psycopg2.connect").return_value.closed = 0
+    mocker.patch("septentrion.migration.migrate", side_effect=migrate)
+
+    migrator.migrate()
+    migrator.migrate()
+
+    psycopg2.connect.assert_called_once()
+
+
+def test_migrator_migrate_plan(migrator, mocker):
+    migrate_plan = mocker.patch("septentrion.migration.migrate_plan")
+
+    migrator.migrate(plan={"versions": []})
+
+    migrate_plan.assert_called_once_with(
+        settings=migrator.settings,
+        plan={"versions": []},
+        stylist=style.noop_stylist,
+    )
+
+
+def test_migrator_fake(migrator, mocker):
+    create_fake_entries = mocker.patch("septentrion.migration.create_fake_entries")
+
+    migrator.fake("1.1")
+
+    assert create_fake_entries.call_args.kwargs["version"] == versions.Version(
+        (1, 1), "1.1"
+    )
+
+
+def test_migrator_status(migrator, mocker):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=True)
+    mocker.patch(
+        "septentrion.db.get_current_schema_version",
+        return_value=versions.Version.from_string("1.2"),
+    )
+    mocker.patch(
+        "septentrion.db.get_applied_migrations_by_version",
+        return_value={
+            versions.Version.from_string("1.2"): {
+                "1.2-0-version-dml.sql",
+                "1.2-remove-author-dob-ddl.sql",
+                "1.2-rename-num-pages-ddl.sql",
+            },
+            versions.Version.from_string("1.3"): set(),
+        },
+    )
+
+    is_manual_migration = mocker.patch("septentrion.files.is_manual_migration")
+
+    assert migrator.status() == {
+        "current_version": "1.2",
+        "pending": [
+            "1.3-0-version-dml.sql",
+            "1.3-add-readers-ddl.sql",
+            "1.3-add-readers-dml.sql",
+            "1.3-remove-author-dob-ddl.sql",
+            "1.3-rename-num-pages-ddl.sql",
+        ],
+    }
+    is_manual_migration.assert_not_called()
+
+
+def test_migrator_status_empty(migrator, mocker):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=False)
+    mocker.patch(
+        "septentrion.core.get_best_schema_version",
+        return_value=versions.Version.from_string("1.3"),
+    )
+    mocker.patch(
+        "septentrion.db.get_applied_migrations_by_version",
+        return_value={versions.Version.from_string("1.3"): set()},
+    )
+
+    assert migrator.status() == {"current_version": None, "pending": []}
@@ -1,4 +1,9 @@
-from septentrion import configuration, migration
+import pathlib
+from unittest.mock import ANY
+
+import pytest
+
+from septentrion import configuration, exceptions, migration, sections, versions
 
 
 def test_migrate_uses_correct_version_with_db(mocker):
@@ -28,6 +33,53 @@ def test_migrate_uses_correct_version_with_db(mocker):
     )
 
 
+def test_migrate_restores_snapshot(mocker):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=False)
+    mock_init_schema = mocker.patch("septentrion.migration.init_schema")
+    current_version = mocker.patch("septentrion.db.get_current_schema_version")
+    snapshot_path = mocker.Mock()
+    snapshot_path.exists.return_value = True
+    mocker.patch("septentrion.snapshots.get_snapshot_path", return_value=snapshot_path)
+    restore_snapshot = mocker.patch("septentrion.snapshots.restore_snapshot")
+    save_snapshot = mocker.patch("septentrion.snapshots.save_snapshot")
+    build_migration_plan = mocker.patch(
+        "septentrion.migration.core.build_migration_plan", return_value=[]
+    )
+    settings = configuration.Settings()
+
+    migration.migrate(settings=settings)
+
+    restore_snapshot.assert_called_once_with(
+        settings=settings, path=snapshot_path, stylist=ANY
+    )
+    mock_init_schema.assert_not_called()
+    save_snapshot.assert_not_called()
+    build_migration_plan.assert_called_with(
+        settings=settings, from_version=current_version.return_value
+    )
+
+
+def test_migrate_saves_snapshot(mocker):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=False)
+    mock_init_schema = mocker.patch("septentrion.migration.init_schema")
+    mocker.patch("septentrion.core.get_best_schema_version")
+    snapshot_path = mocker.Mock()
+    snapshot_path.exists.return_value = False
+    mocker.patch("septentrion.snapshots.get_snapshot_path", return_value=snapshot_path)
+    restore_snapshot = mocker.patch("septentrion.snapshots.restore_snapshot")
+    save_snapshot = mocker.patch("septentrion.snapshots.save_snapshot")
+    mocker.patch("septentrion.migration.core.build_migration_plan", return_value=[])
+    settings = configuration.Settings()
+
+    migration.migrate(settings=settings)
+
+    mock_init_schema.assert_called_once()
+    restore_snapshot.assert_not_called()
+    save_snapshot.assert_called_once_with(
+        settings=settings, path=snapshot_path, stylist=ANY
+    )
+
+
 def test_migrate_uses_correct_version_without_db(mocker):
     mocker.patch("septentrion.db.is_schema_initialized", return_value=False)
     mock_init_schema = mocker.patch("septentrion.migration.init_schema")
@@ -54,3 +106,224 @@ def test_migrate_uses_correct_version_without_db(mocker):
     build_migration_plan.assert_called_with(
         settings=settings, from_version=schema_version.return_value
     )
+
+
+def test_migrate_plan(mocker):
+    check_plan = mocker.patch("septentrion.plans.check_plan", return_value=[])
+    mock_init_schema = mocker.patch("septentrion.migration.init_schema")
+    apply_migration_plan = mocker.patch("septentrion.migration.apply_migration_plan")
+    settings = configuration.Settings()
+    plan = {"schema_version": "1.1"}
+
+    migration.migrate_plan(settings=settings, plan=plan)
+
+    check_plan.assert_called_once_with(settings=settings, plan=plan, check_files=True)
+    mock_init_schema.assert_called_once_with(
+        settings=settings, init_version=versions.Version.from_string("1.1"), stylist=ANY
+    )
+    apply_migration_plan.assert_called_once_with(
+        settings=settings, migration_plan=[], stylist=ANY
+    )
+
+
+def test_run_special_file_dump(mocker, tmp_path):
+    (tmp_path / "schema_1.1.sql").touch()
+    (tmp_path / "schema_1.1.dump").touch()
+    restore_dump = mocker.patch("septentrion.runner.restore_dump")
+    run_script = mocker.patch("septentrion.migration.run_script")
+    settings = configuration.Settings()
+
+    migration.run_special_file(
+        settings=settings, folder=tmp_path, name="schema_1.1.sql"
+    )
+
+    restore_dump.assert_called_once_with(
+        settings=settings, path=tmp_path / "schema_1.1.dump"
+    )
+    run_script.assert_not_called()
+
+
+def test_run_special_file_sql(mocker, tmp_path):
+    (tmp_path / "schema_1.1.sql").touch()
+    restore_dump = mocker.patch("septentrion.runner.restore_dump")
+    run_script = mocker.patch("septentrion.migration.run_script")
+    settings = configuration.Settings()
+
+    migration.run_special_file(
+        settings=settings, folder=tmp_path, name="schema_1.1.sql"
+    )
+
+    run_script.assert_called_once_with(
+        settings=settings, path=tmp_path / "schema_1.1.sql", progress=None
+    )
+    restore_dump.assert_not_called()
+
+
+def test_migrate_fast_init(mocker):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=False)
+    mock_init_schema = mocker.patch("septentrion.migration.init_schema")
+    mocker.patch("septentrion.core.get_best_schema_version")
+    mocker.patch("septentrion.core.build_migration_plan", return_value=[])
+    apply_migration_plan = mocker.patch("septentrion.migration.apply_migration_plan")
+    analyze = mocker.patch("septentrion.db.analyze")
+    settings = configuration.Settings(fast_init=True)
+
+    migration.migrate(settings=settings)
+
+    init_settings = mock_init_schema.call_args[1]["settings"]
+    assert init_settings.SESSION_OPTIONS == migration.FAST_INIT_OPTIONS
+    assert apply_migration_plan.call_args[1]["settings"] is init_settings
+    analyze.assert_called_once_with(settings=settings)
+    # The settings of the caller are not changed
+    assert settings.SESSION_OPTIONS == {}
+
+
+def test_migrate_fast_init_initialized(mocker):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=True)
+    mocker.patch("septentrion.db.get_current_schema_version")
+    mocker.patch("septentrion.core.build_migration_plan", return_value=[])
+    apply_migration_plan = mocker.patch("septentrion.migration.apply_migration_plan")
+    analyze = mocker.patch("septentrion.db.analyze")
+    settings = configuration.Settings(fast_init=True)
+
+    migration.migrate(settings=settings)
+
+    assert apply_migration_plan.call_args[1]["settings"] is settings
+    analyze.assert_not_called()
+
+
+def test_load_fixtures_fast_init(mocker):
+    mocker.patch(
+        "septentrion.core.get_fixtures_version",
+        return_value=versions.Version.from_string("1.1"),
+    )
+    mocker.patch("septentrion.db.can_set_option", return_value=True)
+    run_special_file = mocker.patch("septentrion.migration.run_special_file")
+    settings = configuration.Settings(fast_init=True)
+
+    migration.load_fixtures(
+        settings=settings, init_version=versions.Version.from_string("1.1")
+    )
+
+    assert run_special_file.call_args[1]["settings"].SESSION_OPTIONS == {
+        **migration.FAST_INIT_OPTIONS,
+        **migration.FAST_INIT_FIXTURES_OPTIONS,
+    }
+
+
+def test_load_fixtures_fast_init_not_superuser(mocker, caplog):
+    mocker.patch(
+        "septentrion.core.get_fixtures_version",
+        return_value=versions.Version.from_string("1.1"),
+    )
+    mocker.patch("septentrion.db.can_set_option", return_value=False)
+    run_special_file = mocker.patch("septentrion.migration.run_special_file")
+    settings = configuration.Settings(fast_init=True)
+
+    migration.load_fixtures(
+        settings=settings, init_version=versions.Version.from_string("1.1")
+    )
+
+    # Fixtures are loaded anyway, with triggers
+    options = run_special_file.call_args[1]["settings"].SESSION_OPTIONS
+    assert options == migration.FAST_INIT_OPTIONS
+    assert "Not allowed to set session_replication_role" in caplog.text
+
+
+def test_load_schema(mocker, tmp_path):
+    run_special_file = mocker.patch("septentrion.migration.run_special_file")
+    settings = configuration.Settings()
+
+    result = migration.load_schema(
+        settings=settings, folder=tmp_path, name="schema_1.1.sql"
+    )
+
+    assert result is None
+    run_special_file.assert_called_once_with(
+        settings=settings, folder=tmp_path, name="schema_1.1.sql", progress=None
+    )
+
+
+def test_load_schema_defer_post_data(mocker, tmp_path):
+    (tmp_path / "schema_1.1.sql").write_text(
+        "CREATE TABLE a (b INT);\nCREATE INDEX a_b ON a (b);\n"
+    )
+    script = mocker.patch("septentrion.runner.Script")
+    build_post_data = mocker.patch("septentrion.sections.build_post_data")
+    settings = configuration.Settings(defer_post_data=True)
+
+    result = migration.load_schema(
+        settings=settings, folder=tmp_path, name="schema_1.1.sql"
+    )
+
+    assert script.call_args[1]["file_handler"] == b"CREATE TABLE a (b INT);\n"
+    script.return_value.run.assert_called_once_with()
+    build_post_data.assert_not_called()
+
+    result(None)
+
+    build_post_data.assert_called_once_with(
+        settings, sections.PostData(indexes=["CREATE INDEX a_b ON a (b);"]), None
+    )
+
+
+def test_load_schema_defer_post_data_dump(mocker, tmp_path):
+    (tmp_path / "schema_1.1.dump").touch()
+    restore_dump = mocker.patch("septentrion.runner.restore_dump")
+    settings = configuration.Settings(defer_post_data=True)
+
+    result = migration.load_schema(
+        settings=settings, folder=tmp_path, name="schema_1.1.sql"
+    )
+    result(None)
+
+    assert restore_dump.call_args_list == [
+        mocker.call(
+            settings=settings,
+            path=tmp_path / "schema_1.1.dump",
+            sections=["pre-data", "data"],
+        ),
+        mocker.call(
+            settings=settings,
+            path=tmp_path / "schema_1.1.dump",
+            sections=["post-data"],
+        ),
+    ]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_load_schema_files_stops_at_empty(mocker, workers):
+    run_script = mocker.patch("septentrion.migration.run_script")
+    settings = configuration.Settings(
+        migrations_root="migrations", schema_file_workers=workers
+    )
+
+    migration._load_schema_files(settings, ["a.sql", "b.sql", "", "c.sql"])
+
+    assert sorted(call[1]["path"] for call in run_script.call_args_list) == [
+        pathlib.Path("migrations/schemas/a.sql"),
+        pathlib.Path("migrations/schemas/b.sql"),
+    ]
+
+
+def test_load_schema_files_concurrently(mocker):
+    def run_script(settings, path):
+        if path.name != "b.sql":
+            raise ValueError(path.name)
+
+    run_script = mocker.patch(
+        "septentrion.migration.run_script", side_effect=run_script
+    )
+    settings = configuration.Settings(
+        migrations_root="migrations", schema_file_workers=2
+    )
+
+    with pytest.raises(exceptions.SchemaFilesError) as exc_info:
+        migration._load_schema_files(settings, ["a.sql", "b.sql", "c.sql"])
+
+    # All the files ran
+    assert run_script.call_count == 3
+    assert [(path.name, str(error)) for path, error in exc_info.value.errors] == [
+        ("a.sql", "a.sql"),
+        ("c.sql", "c.sql"),
+    ]
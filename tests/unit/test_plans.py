@@ -0,0 +1,223 @@
+import io
+import pathlib
+
+import pytest
+
+from septentrion import configuration, exceptions, plans, state
+from septentrion.versions import Version
+
+
+@pytest.fixture
+def plan():
+    return {
+        "format": 1,
+        "schema_version": None,
+        "current_version": "1.1",
+        "target_version": None,
+        "versions": [
+            {
+                "version": "1.1",
+                "migrations": [
+                    {
+                        "name": "a.sql",
+                        "path": "1.1/a.sql",
+                        "applied": True,
+                        "manual": False,
+                        "sha256": None,
+                    },
+                    {
+                        "name": "b.sql",
+                        "path": "1.1/b.sql",
+                        "applied": False,
+                        "manual": True,
+                        "sha256": "abc",
+                    },
+                ],
+            }
+        ],
+    }
+
+
+def test_build_plan(mocker, plan):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=True)
+    mocker.patch(
+        "septentrion.db.get_current_schema_version",
+        return_value=Version.from_string("1.1"),
+    )
+    mocker.patch(
+        "septentrion.core.build_migration_plan",
+        return_value=[
+            {
+                "version": Version.from_string("1.1"),
+                "plan": [
+                    ("a.sql", True, pathlib.Path("migrations/1.1/a.sql"), False),
+                    ("b.sql", False, pathlib.Path("migrations/1.1/b.sql"), True),
+                ],
+            }
+        ],
+    )
+    hash_file = mocker.patch("septentrion.files.hash_file", return_value="abc")
+    settings = configuration.Settings(migrations_root="migrations")
+
+    assert plans.build_plan(settings=settings) == plan
+    hash_file.assert_called_once_with(pathlib.Path("migrations/1.1/b.sql"))
+
+
+def test_build_plan_empty_database(mocker):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=False)
+    mocker.patch(
+        "septentrion.core.get_best_schema_version",
+        return_value=Version.from_string("1.1"),
+    )
+    mocker.patch(
+        "septentrion.core.build_migration_plan",
+        return_value=[
+            {
+                "version": Version.from_string("1.1"),
+                "plan": [("a.sql", False, pathlib.Path("1.1/a.sql"), False)],
+            }
+        ],
+    )
+    mocker.patch("septentrion.files.hash_file", return_value="abc")
+    settings = configuration.Settings()
+
+    plan = plans.build_plan(settings=settings)
+
+    assert plan["schema_version"] == "1.1"
+    assert plan["current_version"] is None
+    # Migrations of the schema version are faked when the schema is loaded
+    assert plan["versions"][0]["migrations"][0]["applied"] is True
+    assert plan["versions"][0]["migrations"][0]["sha256"] is None
+
+
+def test_write_read_plan(plan):
+    file = io.StringIO()
+    plans.write_plan(plan, file)
+    file.seek(0)
+
+    assert plans.read_plan(file) == plan
+
+
+@pytest.mark.parametrize("content", ["nope", "{}", '{"format": 42}', "[]"])
+def test_read_plan_invalid(content):
+    with pytest.raises(exceptions.SeptentrionException):
+        plans.read_plan(io.StringIO(content))
+
+
+def test_check_plan(mocker, plan):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=True)
+    mocker.patch(
+        "septentrion.db.get_current_schema_version",
+        return_value=Version.from_string("1.1"),
+    )
+    mocker.patch(
+        "septentrion.db.get_applied_migrations_by_version",
+        side_effect=lambda settings, versions_: {v: {"a.sql"} for v in versions_},
+    )
+    mocker.patch("septentrion.files.hash_file", return_value="abc")
+    settings = configuration.Settings(migrations_root="migrations")
+
+    assert plans.check_plan(settings=settings, plan=plan) == [
+        {
+            "version": Version.from_string("1.1"),
+            "plan": [
+                ("a.sql", True, pathlib.Path("migrations/1.1/a.sql"), False),
+                ("b.sql", False, pathlib.Path("migrations/1.1/b.sql"), True),
+            ],
+        }
+    ]
+
+
+@pytest.mark.parametrize(
+    "initialized, current_version, applied, file_hash",
+    [
+        # Database was emptied
+        (False, None, [], "abc"),
+        # Someone migrated in the meantime
+        (True, "1.2", ["a.sql"], "abc"),
+        (True, "1.1", ["a.sql", "b.sql"], "abc"),
+        (True, "1.1", [], "abc"),
+        # File changed
+        (True, "1.1", ["a.sql"], "def"),
+        (True, "1.1", ["a.sql"], FileNotFoundError),
+    ],
+)
+def test_check_plan_outdated(
+    mocker, plan, initialized, current_version, applied, file_hash
+):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=initialized)
+    mocker.patch(
+        "septentrion.db.get_current_schema_version",
+        return_value=Version.from_string(current_version) if current_version else None,
+    )
+    mocker.patch(
+        "septentrion.db.get_applied_migrations_by_version",
+        side_effect=lambda settings, versions_: {v: set(applied) for v in versions_},
+    )
+    if isinstance(file_hash, str):
+        mocker.patch("septentrion.files.hash_file", return_value=file_hash)
+    else:
+        mocker.patch("septentrion.files.hash_file", side_effect=file_hash)
+    settings = configuration.Settings(migrations_root="migrations")
+
+    with pytest.raises(exceptions.OutdatedPlan):
+        plans.check_plan(settings=settings, plan=plan)
+
+
+def test_check_plan_without_files(mocker, plan):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=True)
+    mocker.patch(
+        "septentrion.db.get_current_schema_version",
+        return_value=Version.from_string("1.1"),
+    )
+    mocker.patch(
+        "septentrion.db.get_applied_migrations_by_version",
+        side_effect=lambda settings, versions_: {v: {"a.sql"} for v in versions_},
+    )
+    hash_file = mocker.patch("septentrion.files.hash_file", return_value="def")
+    settings = configuration.Settings(migrations_root="migrations")
+
+    assert plans.check_plan(settings=settings, plan=plan, check_files=False)
+    hash_file.assert_not_called()
+
+
+def test_check_plan_expects_empty_database(mocker, plan):
+    plan["schema_version"] = "1.1"
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=True)
+    settings = configuration.Settings()
+
+    with pytest.raises(exceptions.OutdatedPlan):
+        plans.check_plan(settings=settings, plan=plan)
+
+
+def test_build_plan_offline(mocker):
+    execute = mocker.patch("septentrion.db.execute")
+    store = state.MemoryStateStore(
+        [
+            ("1.1", "1.1-0-version-dml.sql"),
+            ("1.1", "1.1-add-num-pages-1-ddl.sql"),
+            ("1.1", "1.1-add-num-pages-2-dml.sql"),
+            ("1.1", "1.1-index-ddl.sql"),
+        ]
+    )
+    settings = configuration.Settings(
+        migrations_root="example_migrations", target_version="1.2"
+    )
+
+    plan = plans.build_plan(settings=settings, store=store)
+
+    assert plan["current_version"] == "1.1"
+    assert [
+        (plan_version["version"], migration["name"], migration["applied"])
+        for plan_version in plan["versions"]
+        for migration in plan_version["migrations"]
+    ] == [
+        ("1.1", "1.1-0-version-dml.sql", True),
+        ("1.1", "1.1-add-num-pages-1-ddl.sql", True),
+        ("1.1", "1.1-add-num-pages-2-dml.sql", True),
+        ("1.1", "1.1-index-ddl.sql", True),
+        ("1.2", "1.2-0-version-dml.sql", False),
+        ("1.2", "1.2-remove-author-dob-ddl.sql", False),
+        ("1.2", "1.2-rename-num-pages-ddl.sql", False),
+    ]
+    execute.assert_not_called()
@@ -0,0 +1,177 @@
+import contextlib
+
+import pytest
+
+from septentrion import pytest_plugin
+
+pytest_plugins = ["pytester"]
+
+
+@pytest.fixture
+def session(mocker):
+    config = mocker.Mock()
+    config.cache.get.return_value = None
+    return pytest_plugin.Session(config)
+
+
+def test_stats_add():
+    stats = pytest_plugin.Stats(template_duration=1.0, clones=1, clone_duration=0.5)
+
+    stats.add(
+        pytest_plugin.Stats(
+            template_duration=2.0, migration_duration=3.0, clones=2, clone_duration=1
+        )
+    )
+
+    assert stats == pytest_plugin.Stats(
+        template_duration=3.0, migration_duration=3.0, clones=3, clone_duration=1.5
+    )
+
+
+def test_clone(mocker, session):
+    drop = mocker.patch("septentrion.db.drop_database")
+    create = mocker.patch("septentrion.db.create_database")
+
+    session._clone(mocker.sentinel.settings, "test_template", "test_main")
+
+    drop.assert_called_once_with(settings=mocker.sentinel.settings, dbname="test_main")
+    create.assert_called_once_with(
+        settings=mocker.sentinel.settings, dbname="test_main", template="test_template"
+    )
+    assert session.stats.clones == 1
+
+
+def test_testnodedown(mocker, session):
+    node = mocker.Mock(workeroutput={"septentrion": {"clones": 2}})
+
+    session.pytest_testnodedown(node=node, error=None)
+
+    assert session.stats.clones == 2
+
+
+def test_terminal_summary(mocker, session):
+    session.stats = pytest_plugin.Stats(
+        template_duration=0.5, clones=10, clone_duration=1.5
+    )
+    session.config.cache.get.return_value = 2.0
+    reporter = mocker.Mock()
+
+    session.pytest_terminal_summary(terminalreporter=reporter)
+
+    reporter.write_line.assert_called_once_with(
+        "septentrion: template reused (checked in 0.5s), 10 database(s) copied in "
+        "1.5s, ~18.0s of setup saved"
+    )
+
+
+def test_terminal_summary_unused(mocker, session):
+    reporter = mocker.Mock()
+
+    session.pytest_terminal_summary(terminalreporter=reporter)
+
+    reporter.write_line.assert_not_called()
+
+
+def test_options(pytester):
+    result = pytester.runpytest("-p", "septentrion.pytest_plugin", "--help")
+
+    result.stdout.fnmatch_lines(["*--septentrion-reset=*"])
+
+
+def test_not_loaded_by_default(pytester):
+    pytester.makepyfile("def test_db(septentrion_db):\n    pass\n")
+
+    result = pytester.runpytest()
+
+    result.assert_outcomes(errors=1)
+    result.stdout.fnmatch_lines(["*fixture 'septentrion_db' not found*"])
+
+
+@pytest.fixture
+def databases(mocker, monkeypatch):
+    """
+    Record the databases created, dropped and truncated by the fixtures
+    """
+    monkeypatch.delenv("PYTEST_XDIST_WORKER", raising=False)
+    calls = []
+    mocker.patch("septentrion.snapshots.get_repository_key", return_value="key")
+    mocker.patch("septentrion.clones.is_template_up_to_date", return_value=True)
+    mocker.patch(
+        "septentrion.db.drop_database",
+        side_effect=lambda settings, dbname: calls.append(("drop", dbname)),
+    )
+    mocker.patch(
+        "septentrion.db.create_database",
+        side_effect=lambda settings, dbname, template: calls.append(
+            ("create", dbname, template)
+        ),
+    )
+    mocker.patch(
+        "septentrion.db.truncate_tables",
+        side_effect=lambda settings: calls.append(("truncate", settings.DBNAME)),
+    )
+    return calls
+
+
+DB_TESTS = """
+def test_first(septentrion_db):
+    assert septentrion_db.DBNAME == "test_main"
+
+def test_second(septentrion_db):
+    assert septentrion_db.DBNAME == "test_main"
+"""
+
+
+def test_septentrion_db_clone(pytester, databases):
+    pytester.makepyfile(DB_TESTS)
+
+    result = pytester.runpytest("-p", "septentrion.pytest_plugin")
+
+    result.assert_outcomes(passed=2)
+    assert databases == [
+        ("drop", "test_main"),
+        ("create", "test_main", "test_template"),
+        # Copied again before the second test
+        ("drop", "test_main"),
+        ("create", "test_main", "test_template"),
+        ("drop", "test_main"),
+    ]
+    result.stdout.fnmatch_lines(["*2 database(s) copied*"])
+
+
+def test_septentrion_db_truncate(pytester, databases):
+    pytester.makepyfile(DB_TESTS)
+
+    result = pytester.runpytest(
+        "-p", "septentrion.pytest_plugin", "--septentrion-reset", "truncate"
+    )
+
+    result.assert_outcomes(passed=2)
+    assert databases == [
+        ("drop", "test_main"),
+        ("create", "test_main", "test_template"),
+        ("truncate", "test_main"),
+        ("drop", "test_main"),
+    ]
+
+
+def test_septentrion_connection(pytester, databases, mocker):
+    connection = mocker.Mock(autocommit=True)
+
+    @contextlib.contextmanager
+    def get_connection(settings):
+        assert settings.DBNAME == "test_main"
+        yield connection
+
+    mocker.patch("septentrion.db.get_connection", get_connection)
+    pytester.makeconftest("pytest_plugins = ['septentrion.pytest_plugin']")
+    pytester.makepyfile("""
+def test_connection(septentrion_connection):
+    assert septentrion_connection.autocommit is False
+    septentrion_connection.rollback.assert_not_called()
+""")
+
+    result = pytester.runpytest()
+
+    result.assert_outcomes(passed=1)
+    connection.rollback.assert_called_once_with()
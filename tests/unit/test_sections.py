@@ -0,0 +1,152 @@
+import pytest
+
+from septentrion import configuration, sections
+
+SCHEMA = """\\restrict abc
+SET search_path = public;
+CREATE TABLE author (id INT, name TEXT);
+CREATE TABLE book (id INT, author_id INT);
+-- Indexes
+ALTER TABLE ONLY author ADD CONSTRAINT author_pkey PRIMARY KEY (id);
+CREATE INDEX author_name ON author (name) WHERE name LIKE 'a%';
+ALTER TABLE book ADD CONSTRAINT book_author_fk FOREIGN KEY (author_id)
+    REFERENCES author (id);
+CREATE FUNCTION f() RETURNS trigger AS $$ BEGIN RETURN NEW; END; $$
+    LANGUAGE plpgsql;
+CREATE TRIGGER t BEFORE INSERT ON book FOR EACH ROW EXECUTE FUNCTION f();
+"""
+
+
+def test_split_schema():
+    pre_data, post_data = sections.split_schema(SCHEMA)
+
+    assert pre_data == (
+        "\\restrict abc\nSET search_path = public;"
+        "\nCREATE TABLE author (id INT, name TEXT);"
+        "\nCREATE TABLE book (id INT, author_id INT);"
+        "\nCREATE FUNCTION f() RETURNS trigger AS $$ BEGIN RETURN NEW; END; $$"
+        "\n    LANGUAGE plpgsql;\n"
+    )
+    assert post_data == sections.PostData(
+        session=[],
+        indexes=[
+            "ALTER TABLE ONLY author ADD CONSTRAINT author_pkey PRIMARY KEY (id);",
+            "CREATE INDEX author_name ON author (name) WHERE name LIKE 'a%';",
+        ],
+        constraints=[
+            "ALTER TABLE book ADD CONSTRAINT book_author_fk FOREIGN KEY (author_id)"
+            "\n    REFERENCES author (id);",
+            "CREATE TRIGGER t BEFORE INSERT ON book FOR EACH ROW EXECUTE FUNCTION f();",
+        ],
+    )
+
+
+def test_split_schema_copy_data():
+    copy = (
+        "COPY public.note (id, body) FROM stdin;\n"
+        "1\tCREATE INDEX a_b ON a (b);\n"
+        "2\tALTER TABLE a ADD CONSTRAINT a_pkey PRIMARY KEY (id);\n"
+        "\\.\n"
+    )
+
+    pre_data, post_data = sections.split_schema(
+        "CREATE TABLE note (id INT, body TEXT);\n"
+        + copy
+        + "\nCREATE INDEX note_id ON note (id);\n"
+    )
+
+    # The data rows are kept as is, in the pre-data section
+    assert pre_data == "CREATE TABLE note (id INT, body TEXT);\n" + copy + "\n"
+    assert post_data.indexes == ["CREATE INDEX note_id ON note (id);"]
+
+
+def test_split_schema_session():
+    _, post_data = sections.split_schema(
+        "SELECT pg_catalog.set_config('search_path', '', false);\n"
+        "CREATE INDEX a_b ON public.a (b);\n"
+    )
+
+    assert post_data.session == [
+        "SELECT pg_catalog.set_config('search_path', '', false);"
+    ]
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("CREATE UNIQUE INDEX a_b ON a (b);", "indexes"),
+        ("ALTER TABLE a ADD PRIMARY KEY (id);", "indexes"),
+        ("ALTER TABLE a ADD CONSTRAINT a_b UNIQUE (b, c);", "indexes"),
+        ("ALTER TABLE a ADD FOREIGN KEY (b, c) REFERENCES b (x, y);", "constraints"),
+        ("ALTER INDEX a_b ATTACH PARTITION a_b_1;", "constraints"),
+        ("COMMENT ON INDEX a_b IS 'b';", "constraints"),
+        ("ALTER TABLE a ADD COLUMN b INT, ADD CONSTRAINT a_b UNIQUE (b);", None),
+        ("ALTER TABLE a ADD COLUMN b INT UNIQUE;", None),
+        ("ALTER TABLE a ADD CONSTRAINT a_b CHECK (b > 0);", None),
+        ("CREATE TABLE a (id INT PRIMARY KEY);", None),
+    ],
+)
+def test_classify(text, expected):
+    assert sections.classify(text) == expected
+
+
+def test_build_post_data(mocker):
+    run_statements = mocker.patch("septentrion.db.run_statements")
+    progress = mocker.Mock()
+    settings = configuration.Settings(restore_jobs=1)
+    post_data = sections.PostData(
+        session=["SET search_path = public;"],
+        indexes=["CREATE INDEX a;", "CREATE INDEX b;"],
+        constraints=["ALTER TABLE c;"],
+    )
+
+    sections.build_post_data(settings=settings, post_data=post_data, progress=progress)
+
+    assert run_statements.call_args_list == [
+        mocker.call(
+            settings=settings,
+            statements=["SET search_path = public;", "CREATE INDEX a;"],
+        ),
+        mocker.call(
+            settings=settings,
+            statements=["SET search_path = public;", "CREATE INDEX b;"],
+        ),
+        mocker.call(
+            settings=settings,
+            statements=["SET search_path = public;", "ALTER TABLE c;"],
+        ),
+    ]
+    progress.assert_called_with("(3/3 statements)")
+
+
+@pytest.mark.parametrize(
+    "sql, expected",
+    [
+        (
+            "-- comment\nUPDATE a SET b = 1;;\nSELECT ';';\n",
+            ["UPDATE a SET b = 1;", "SELECT ';';"],
+        ),
+        ("SELECT 1;\n\\set foo 1\n", None),
+        # Only psql can send or receive COPY data
+        ("COPY a (b) FROM stdin;\n1\n2\n\\.\nSELECT 1;\n", None),
+        ("COPY a TO STDOUT;\n", None),
+        ("COPY a FROM '/tmp/a.csv';\n", ["COPY a FROM '/tmp/a.csv';"]),
+    ],
+)
+def test_split_statements(sql, expected):
+    assert sections.split_statements(sql) == expected
+
+
+def test_iter_statements_copy_data():
+    sql = (
+        "COPY a (b) FROM stdin;\n"
+        "x;\n"
+        "CREATE INDEX c ON d (e);\n"
+        "\\.\n"
+        "SELECT 1;\n"
+    )
+
+    assert list(sections.iter_statements(sql)) == [
+        ("COPY a (b) FROM stdin;\nx;\nCREATE INDEX c ON d (e);\n\\.\n", None),
+        ("SELECT 1;", "SELECT 1;"),
+    ]
@@ -0,0 +1,112 @@
+import io
+
+import pytest
+
+from septentrion import configuration, exceptions, state
+from septentrion.versions import Version
+
+
+@pytest.fixture
+def store():
+    return state.MemoryStateStore(
+        [("1.1", "a.sql"), ("1.2", "b.sql"), ("1.1", "c.sql")]
+    )
+
+
+def test_memory_state_store(store):
+    v11, v12, v13 = (Version.from_string(v) for v in ("1.1", "1.2", "1.3"))
+
+    assert store.is_initialized() is True
+    assert list(store.get_applied_versions()) == [v11, v12]
+    assert store.get_current_version() == v12
+    assert store.get_applied_migrations_by_version([v11, v13]) == {
+        v11: {"a.sql", "c.sql"},
+        v13: set(),
+    }
+
+
+def test_memory_state_store_empty():
+    store = state.MemoryStateStore()
+
+    assert store.is_initialized() is False
+    assert store.get_current_version() is None
+
+    store.write_migration(version=Version.from_string("1.3"), name="d.sql")
+
+    assert store.get_entries() == [("1.3", "d.sql")]
+
+
+def test_json_file_state_store(tmp_path):
+    path = tmp_path / "state.json"
+    store = state.JSONFileStateStore(path)
+    assert store.is_initialized() is False
+
+    store.write_migration(version=Version.from_string("1.1"), name="a.sql")
+
+    assert state.JSONFileStateStore(path).get_entries() == [("1.1", "a.sql")]
+    assert [child.name for child in tmp_path.iterdir()] == ["state.json"]
+
+
+def test_json_file_state_store_interrupted(tmp_path, mocker):
+    path = tmp_path / "state.json"
+    store = state.JSONFileStateStore(path)
+    store.write_migration(version=Version.from_string("1.1"), name="a.sql")
+    mocker.patch("septentrion.state.write_state", side_effect=KeyboardInterrupt)
+
+    with pytest.raises(KeyboardInterrupt):
+        store.write_migration(version=Version.from_string("1.1"), name="b.sql")
+
+    # The file still holds the previous state
+    assert state.JSONFileStateStore(path).get_entries() == [("1.1", "a.sql")]
+    assert [child.name for child in tmp_path.iterdir()] == ["state.json"]
+
+
+def test_postgres_state_store(mocker):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=True)
+    get_all_migrations = mocker.patch(
+        "septentrion.db.get_all_migrations", return_value=[("1.1", "a.sql")]
+    )
+    settings = configuration.Settings()
+
+    assert state.PostgresStateStore(settings).get_entries() == [("1.1", "a.sql")]
+    get_all_migrations.assert_called_once_with(settings=settings)
+
+
+def test_postgres_state_store_no_table(mocker):
+    mocker.patch("septentrion.db.is_schema_initialized", return_value=False)
+    get_all_migrations = mocker.patch("septentrion.db.get_all_migrations")
+
+    store = state.PostgresStateStore(configuration.Settings())
+
+    assert store.get_entries() == []
+    get_all_migrations.assert_not_called()
+
+
+def test_state_store_incomplete():
+    class IncompleteStore(state.StateStore):
+        def is_initialized(self):
+            return False
+
+    with pytest.raises(TypeError):
+        IncompleteStore()
+
+
+def test_get_store(store):
+    settings = configuration.Settings()
+
+    assert state.get_store(settings=settings, store=store) is store
+    assert state.get_store(settings=settings).settings is settings
+
+
+def test_write_read_state(store):
+    file = io.StringIO()
+    state.write_state(store, file)
+    file.seek(0)
+
+    assert state.read_state(file) == store.get_entries()
+
+
+@pytest.mark.parametrize("content", ["nope", "{}", '{"format": 42}', "[]"])
+def test_read_state_invalid(content):
+    with pytest.raises(exceptions.SeptentrionException):
+        state.read_state(io.StringIO(content))
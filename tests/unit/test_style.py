@@ -47,3 +47,14 @@ def test_activate(capsys):
         echo("foo")
         out, _ = capsys.readouterr()
         assert out == "\x1b[36m\x1b[1mfoo\n"
+
+
+def test_checkbox_progress(capsys):
+    with stylist.checkbox(content="Applying ...", content_after="Applied") as progress:
+        progress("(10 lines)")
+        out, _ = capsys.readouterr()
+        assert out == "  {0}Applying ...\r  {0}Applying ... (10 lines)".format(
+            NOT_CHECKED
+        )
+    out, _ = capsys.readouterr()
+    assert out == "\r  {}Applied{}\n".format(CHECKED, " " * 16)
@@ -1,6 +1,12 @@
 import pytest
 
-from septentrion.utils import is_version, since, until
+from septentrion.utils import (
+    format_pg_options,
+    is_version,
+    map_concurrently,
+    since,
+    until,
+)
 
 
 @pytest.mark.parametrize("value,expected", [("1.2", True), ("bananas", False)])
@@ -23,3 +29,18 @@ def test_since():
     values = list(since(range(300), 297))
 
     assert values == [297, 298, 299]
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_map_concurrently(workers):
+    values = list(map_concurrently(lambda x: x * 2, range(10), workers=workers))
+
+    assert values == [0, 2, 4, 6, 8, 10, 12, 14, 16, 18]
+
+
+def test_format_pg_options():
+    options = {"synchronous_commit": "off", "search_path": "a, b"}
+
+    assert format_pg_options(options) == (
+        "-c synchronous_commit=off -c search_path=a,\\ b"
+    )
@@ -50,3 +50,66 @@ def test_version_str():
     assert str(versions.Version.from_string("1.2.3")) == "1.2.3"
 
     assert str(versions.Version.from_string("1.2.03")) == "1.2.03"
+
+
+def test_version_interned():
+    assert versions.Version.from_string("1.2.3") is versions.Version.from_string(
+        "1.2.3"
+    )
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [("1.2", (1, 2)), ("10", (10,)), ("", None), ("schemas", None), ("1.a", None)],
+)
+def test_parse_version_tuple(value, expected):
+    assert versions.parse_version_tuple(value) == expected
+
+
+@pytest.fixture
+def index():
+    return versions.VersionIndex(
+        versions.Version.from_string(v) for v in ["1.3", "1.1", "1.2", "2.0"]
+    )
+
+
+def v(version_string):
+    return versions.Version.from_string(version_string)
+
+
+def test_version_index_sorted(index):
+    assert list(index) == [v("1.1"), v("1.2"), v("1.3"), v("2.0")]
+
+
+def test_version_index_find(index):
+    assert index.find(v("1.02")).original_string == "1.2"
+    assert index.find(v("1.5")) is None
+    assert v("1.3") in index
+
+
+@pytest.mark.parametrize(
+    "start,end,expected",
+    [
+        ("1.2", "1.3", ["1.2", "1.3"]),
+        (None, "1.2", ["1.1", "1.2"]),
+        ("1.3", None, ["1.3", "2.0"]),
+        ("1.2.5", "1.9", ["1.3"]),
+        ("2.1", None, []),
+    ],
+)
+def test_version_index_window(index, start, end, expected):
+    window = index.window(
+        start=v(start) if start else None, end=v(end) if end else None
+    )
+
+    assert [version.original_string for version in window] == expected
+
+
+@pytest.mark.parametrize(
+    "version,expected",
+    [("1.2", "1.2"), ("1.9", "1.3"), ("3", "2.0"), (None, "2.0"), ("1.0", None)],
+)
+def test_version_index_closest(index, version, expected):
+    closest = index.closest(v(version) if version else None)
+
+    assert (closest.original_string if closest else None) == expected